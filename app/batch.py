@@ -0,0 +1,141 @@
+"""
+Batch question answering for offline jobs (evaluation runs, bulk FAQ generation).
+
+Compared to N calls of /chat/chain:
+- response cache hits are answered first, without retrieval
+- retrieval for all remaining queries runs as one batch
+  (ManualHybridRetriever.batch_invoke_with_metadata)
+- generations are dispatched with at most BATCH_LLM_CONCURRENCY in flight,
+  and duplicate queries share one generation (single-flight)
+- results are yielded as each query completes, not in input order
+
+Batch queries are stateless: no chat session history is read or written, and
+answers are cached under their own `batch_response:` keys, apart from /chat/chain.
+"""
+import os
+import time
+import asyncio
+import threading
+from functools import partial
+from typing import AsyncIterator, List, Optional
+from langchain_core.messages import HumanMessage, SystemMessage
+from llm import model
+from cache import aget_llm_cache, aset_llm_cache, get_hash
+from compression import compress_documents
+from context_packer import build_prompt
+from observability import span, get_token_usage
+from metrics import record_cache, record_tokens, record_context
+from singleflight import response_flights
+
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", 256))
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", 8))
+
+def _cache_key(query: str) -> str:
+    # Own namespace: batch answers have no session history or summary, so they must not
+    # be served to /chat/chain (or pick up its session-shaped answers)
+    return f"batch_response:{get_hash(query)}"
+
+def _assemble_prompt(query: str, docs) -> str:
+    with span("compress"):
+        docs, compression_stats = compress_documents(query, docs)
+    with span("pack"):
+        prompt, stats = build_prompt(query, docs, [], None)
+    record_context({**stats, **compression_stats})
+    return prompt
+
+async def _generate(index: int, query: str, docs, doc_ids: list, semaphore: asyncio.Semaphore) -> dict:
+    start_time = time.time()
+    # Duplicate queries, here or in concurrent batches, share one generation
+    cache_key = _cache_key(query)
+    token_usage = {}
+    try:
+        async with response_flights.alead(cache_key, partial(aget_llm_cache, cache_key)) as flight:
+            if not flight.shared:
+                async with semaphore:
+                    # Compression and tokenization are CPU-bound; keep them off the event loop
+                    prompt = await asyncio.to_thread(_assemble_prompt, query, docs)
+                    message = await model.ainvoke([SystemMessage(content=prompt), HumanMessage(content=query)])
+
+                flight.value = message.content
+                await aset_llm_cache(cache_key, flight.value)
+                token_usage = get_token_usage(message)
+                record_tokens(token_usage)
+        return {
+            "index": index,
+            "query": query,
+            "response": flight.value,
+            "cached": flight.shared,
+            "retrieved_doc_ids": doc_ids,
+            "token_usage": token_usage,
+            "latency_seconds": round(time.time() - start_time, 4),
+        }
+    except Exception as e:
+        return {"index": index, "query": query, "error": str(e)}
+
+async def abatch_answer(queries: List[str], concurrency: int = BATCH_LLM_CONCURRENCY) -> AsyncIterator[dict]:
+    """
+    Answer `queries`, yielding one result dict per query as it completes.
+    Each result carries its `index` in `queries`; failed queries carry `error`.
+    """
+    from retriever import final_retriever
+
+    cached = await asyncio.gather(*(aget_llm_cache(_cache_key(query)) for query in queries))
+    pending = []
+    for index, (query, answer) in enumerate(zip(queries, cached)):
+        record_cache("response", bool(answer))
+        if answer:
+            yield {"index": index, "query": query, "response": answer, "cached": True}
+        else:
+            pending.append(index)
+
+    if not pending:
+        return
+
+    print(f"--- Batch: {len(queries) - len(pending)} cached, retrieving {len(pending)} ---")
+    try:
+        retrieved = await final_retriever.abatch_invoke_with_metadata([queries[i] for i in pending])
+    except Exception as e:
+        for index in pending:
+            yield {"index": index, "query": queries[index], "error": str(e)}
+        return
+
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    tasks = [
+        asyncio.create_task(_generate(index, queries[index], docs, doc_ids, semaphore))
+        for index, (docs, doc_ids) in zip(pending, retrieved)
+    ]
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            yield await next_result
+    finally:
+        # Consumer went away (e.g. client disconnected): stop the remaining generations
+        for task in tasks:
+            task.cancel()
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+def _batch_loop() -> asyncio.AbstractEventLoop:
+    """
+    Event loop shared by every batch_answer call, running on a daemon thread.
+    The async Redis clients bind their pooled connections to the loop that
+    first uses them, so a fresh asyncio.run per call would fail on the second.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="batch-loop", daemon=True).start()
+    return _loop
+
+def batch_answer(queries: List[str], concurrency: int = BATCH_LLM_CONCURRENCY) -> List[dict]:
+    """
+    Blocking Python API: answer all `queries` and return the results in input order.
+    Safe to call repeatedly, from any thread. For offline jobs: in a process that
+    also serves the API, use /chat/batch instead (the server's loop owns the clients).
+    """
+    async def collect():
+        return [result async for result in abatch_answer(queries, concurrency)]
+
+    results = asyncio.run_coroutine_threadsafe(collect(), _batch_loop()).result()
+    return sorted(results, key=lambda result: result["index"])
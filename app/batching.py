@@ -0,0 +1,92 @@
+"""
+Micro-batching scheduler.
+
+Concurrent callers submit single items; a background thread collects them
+for up to `max_wait_ms` (or until `max_batch_size` items are queued), runs
+one batched call, and hands each caller its own result. Used to turn
+concurrent batch-size-1 embedding and rerank forward passes into one pass.
+"""
+import os
+import time
+import queue
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable
+
+MICROBATCH_MAX_WAIT_MS = float(os.getenv("MICROBATCH_MAX_WAIT_MS", 5))
+MICROBATCH_MAX_SIZE = int(os.getenv("MICROBATCH_MAX_SIZE", 32))
+
+class MicroBatcher:
+    def __init__(
+        self,
+        fn: Callable[[list], list],
+        max_batch_size: int = MICROBATCH_MAX_SIZE,
+        max_wait_ms: float = MICROBATCH_MAX_WAIT_MS,
+        name: str = "microbatcher",
+    ):
+        """`fn` takes a list of items and returns a list of results in the same order."""
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.name = name
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_worker(self):
+        # Started lazily so importing a module never spawns threads (e.g. before forking)
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                    self._thread.start()
+
+    def submit_future(self, item: Any) -> Future:
+        future = Future()
+        self._ensure_worker()
+        self._queue.put((item, future))
+        return future
+
+    def submit(self, item: Any) -> Any:
+        """Blocking submit, for sync callers and worker threads."""
+        return self.submit_future(item).result()
+
+    async def asubmit(self, item: Any) -> Any:
+        """Awaitable submit, for the event loop."""
+        return await asyncio.wrap_future(self.submit_future(item))
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                results = self.fn([item for item, _ in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f"{self.name}: batched call returned {len(results)} results for {len(batch)} items")
+            except Exception as e:
+                for _, future in batch:
+                    self._resolve(future, error=e)
+                continue
+
+            for (_, future), result in zip(batch, results):
+                self._resolve(future, result)
+
+    @staticmethod
+    def _resolve(future: Future, result: Any = None, error: Exception = None):
+        # A caller that gave up (e.g. cancelled asubmit) cancels its future; never let that kill the worker
+        if future.cancelled():
+            return
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
@@ -0,0 +1,188 @@
+"""
+Inverted-index BM25 engine.
+
+Drop-in replacement for LangChain's BM25Retriever in ManualHybridRetriever.
+Postings are stored term-major in CSR arrays with the full BM25 term weight
+precomputed per posting, so a query only touches the postings of its own
+terms instead of scoring every chunk in Python.
+Scoring matches rank_bm25's BM25Okapi (same idf and epsilon floor).
+"""
+from collections import Counter
+from typing import Callable, Optional
+import numpy as np
+from langchain_core.documents import Document
+
+def default_preprocessing_func(text: str) -> list[str]:
+    # Same tokenization as langchain_community's BM25Retriever
+    return text.split()
+
+class InvertedBM25Retriever:
+    def __init__(
+        self,
+        docs: list[Document],
+        vocab: dict[str, int],
+        indptr: np.ndarray,
+        doc_ids: np.ndarray,
+        weights: np.ndarray,
+        k: int = 4,
+        preprocess_func: Callable[[str], list[str]] = default_preprocessing_func,
+    ):
+        self.docs = docs
+        self.vocab = vocab
+        self.indptr = indptr      # int64[n_terms + 1], postings of term t are [indptr[t], indptr[t+1])
+        self.doc_ids = doc_ids    # int32[n_postings]
+        self.weights = weights    # float32[n_postings], precomputed BM25 contribution
+        self.k = k
+        self.preprocess_func = preprocess_func
+
+    @classmethod
+    def from_documents(
+        cls,
+        documents: list[Document],
+        k1: float = 1.5,
+        b: float = 0.75,
+        epsilon: float = 0.25,
+        k: int = 4,
+        preprocess_func: Callable[[str], list[str]] = default_preprocessing_func,
+    ) -> "InvertedBM25Retriever":
+        """Build the index from chunks."""
+        builder = BM25IndexBuilder(k1=k1, b=b, epsilon=epsilon, preprocess_func=preprocess_func)
+        builder.add_documents(documents)
+        return builder.build(list(documents), k=k)
+
+    def search(self, query: str, k: Optional[int] = None) -> list[tuple[int, float]]:
+        """Return (chunk index, score) pairs for the top-k chunks, best first."""
+        k = self.k if k is None else k
+        postings_ids, postings_weights = [], []
+        # Repeated query terms count repeatedly, as in BM25Okapi.get_scores
+        for term in self.preprocess_func(query):
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            postings_ids.append(self.doc_ids[start:end])
+            postings_weights.append(self.weights[start:end])
+
+        if not postings_ids:
+            return []
+
+        # Accumulate scores over candidate chunks only (cost ~ postings touched, not corpus size)
+        candidates, inverse = np.unique(np.concatenate(postings_ids), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(postings_weights))
+
+        if len(candidates) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(candidates))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(candidates[i]), float(scores[i])) for i in top]
+
+    def invoke(self, query: str) -> list[Document]:
+        return [self.docs[i] for i, _ in self.search(query)]
+
+    async def ainvoke(self, query: str) -> list[Document]:
+        # Sub-millisecond and pure NumPy, no need to leave the event loop
+        return self.invoke(query)
+
+    def state_dict(self) -> dict:
+        """Arrays and vocabulary needed to rebuild the index (documents are stored separately)."""
+        return {
+            "vocab": self.vocab,
+            "indptr": self.indptr,
+            "doc_ids": self.doc_ids,
+            "weights": self.weights,
+        }
+
+    @classmethod
+    def from_state(cls, state: dict, docs: list[Document], k: int = 4) -> "InvertedBM25Retriever":
+        return cls(docs, state["vocab"], state["indptr"], state["doc_ids"], state["weights"], k=k)
+
+class BM25IndexBuilder:
+    """
+    Accumulates postings batch by batch, so an index can be built while chunks
+    stream past (ingestion) without keeping the Documents around. Only compact
+    per-batch arrays are held until build().
+    """
+    def __init__(
+        self,
+        k1: float = 1.5,
+        b: float = 0.75,
+        epsilon: float = 0.25,
+        preprocess_func: Callable[[str], list[str]] = default_preprocessing_func,
+    ):
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.preprocess_func = preprocess_func
+        self.vocab: dict[str, int] = {}
+        self.n_docs = 0
+        self._terms: list[np.ndarray] = []
+        self._doc_ids: list[np.ndarray] = []
+        self._tfs: list[np.ndarray] = []
+        self._doc_lens: list[np.ndarray] = []
+
+    def add_documents(self, documents: list[Document]):
+        """Index the next batch of chunks (chunk indices continue from the previous batch)."""
+        term_col, doc_col, tf_col = [], [], []
+        doc_len = np.zeros(len(documents), dtype=np.float32)
+        for offset, doc in enumerate(documents):
+            tokens = self.preprocess_func(doc.page_content)
+            doc_len[offset] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                term_col.append(self.vocab.setdefault(term, len(self.vocab)))
+                doc_col.append(self.n_docs + offset)
+                tf_col.append(tf)
+        self._terms.append(np.asarray(term_col, dtype=np.int64))
+        self._doc_ids.append(np.asarray(doc_col, dtype=np.int32))
+        self._tfs.append(np.asarray(tf_col, dtype=np.float32))
+        self._doc_lens.append(doc_len)
+        self.n_docs += len(documents)
+
+    def _concat(self, parts: list[np.ndarray], dtype) -> np.ndarray:
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=dtype)
+
+    def state_dict(self) -> dict:
+        """Finalize the BM25 weights; same layout as InvertedBM25Retriever.state_dict()."""
+        terms = self._concat(self._terms, np.int64)
+        doc_ids = self._concat(self._doc_ids, np.int32)
+        tfs = self._concat(self._tfs, np.float32)
+        doc_len = self._concat(self._doc_lens, np.float32)
+        vocab = self.vocab
+
+        # Group postings by term (CSR layout)
+        order = np.argsort(terms, kind="stable")
+        terms, doc_ids, tfs = terms[order], doc_ids[order], tfs[order]
+        df = np.bincount(terms, minlength=len(vocab))
+        indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(df, out=indptr[1:])
+
+        # idf exactly as rank_bm25.BM25Okapi, including the epsilon floor for negative values
+        n_docs = self.n_docs
+        idf = np.log(n_docs - df + 0.5) - np.log(df + 0.5)
+        if len(idf):
+            average_idf = idf.sum() / len(idf)
+            idf[idf < 0] = self.epsilon * average_idf
+
+        k1, b = self.k1, self.b
+        avgdl = doc_len.sum() / n_docs if n_docs else 0.0
+        norm = k1 * (1 - b + b * doc_len[doc_ids] / avgdl) if avgdl else k1 * (1 - b)
+        weights = (idf[terms] * tfs * (k1 + 1) / (tfs + norm)).astype(np.float32)
+
+        return {"vocab": vocab, "indptr": indptr, "doc_ids": doc_ids, "weights": weights}
+
+    def build(self, docs: list[Document], k: int = 4) -> InvertedBM25Retriever:
+        """Retriever over `docs`, which must be the added chunks in the same order."""
+        state = self.state_dict()
+        return InvertedBM25Retriever(
+            docs, state["vocab"], state["indptr"], state["doc_ids"], state["weights"],
+            k=k, preprocess_func=self.preprocess_func,
+        )
+
+if __name__ == "__main__":
+    corpus = [
+        Document(page_content="We collect your name and email address"),
+        Document(page_content="Data is shared for billing and tax audits"),
+        Document(page_content="You may request deletion of your account"),
+    ]
+    bm25 = InvertedBM25Retriever.from_documents(corpus, k=2)
+    print(bm25.search("What data do you collect"))
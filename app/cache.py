@@ -1,8 +1,19 @@
 import redis
+import redis.asyncio as aioredis
+import asyncio
 import hashlib
 import json
 import os
+import time
+import uuid
+import threading
+import numpy as np
+from collections import OrderedDict
 from typing import Any, Optional
+from redis_backend import (
+    CircuitBreaker, ResilientRedis, AsyncResilientRedis, InMemoryBackend, AsyncInMemoryBackend,
+    make_fallback, pool_kwargs, REDIS_FALLBACK, REDIS_BACKEND
+)
 
 # Redis configuration
 REDIS_URL = os.getenv("REDIS_URL", None)
@@ -10,79 +21,328 @@ REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
 REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
 REDIS_DB = int(os.getenv("REDIS_DB", 0))
 
-try:
+# Embedding vectors are stored as packed floats; float16 halves memory at a small precision cost
+EMBEDDING_DTYPE = np.dtype(np.float16 if os.getenv("EMBEDDING_CACHE_DTYPE", "float32") == "float16" else np.float32)
+EMB_PREFIX = f"emb:{EMBEDDING_DTYPE.name}:"
+
+def _make_pool(pool_cls, decode_responses: bool):
+    # Explicit pools with short timeouts: an unreachable Redis costs ~REDIS_CONNECT_TIMEOUT, not the OS default
     if REDIS_URL:
-        redis_client = redis.from_url(REDIS_URL, decode_responses=True)
-        redis_binary_client = redis.from_url(REDIS_URL, decode_responses=False)
-        print(f"--- Connected to Redis via URL ---")
-    else:
-        redis_client = redis.Redis(
-            host=REDIS_HOST,
-            port=REDIS_PORT,
-            db=REDIS_DB,
-            decode_responses=True 
-        )
-        redis_binary_client = redis.Redis(
-            host=REDIS_HOST,
-            port=REDIS_PORT,
-            db=REDIS_DB,
-            decode_responses=False
-        )
-        print(f"--- Connected to Redis at {REDIS_HOST}:{REDIS_PORT} ---")
-except redis.ConnectionError:
-    print(f"--- WARNING: Could not connect to Redis at {REDIS_HOST}:{REDIS_PORT}. Caching will be disabled. ---")
-    redis_client = None
-    redis_binary_client = None
+        return pool_cls.from_url(REDIS_URL, **pool_kwargs(decode_responses))
+    return pool_cls(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, **pool_kwargs(decode_responses))
+
+if REDIS_BACKEND == "memory":
+    # No Redis at all: every client shares one in-process store (no network calls, nothing to fall back to)
+    _memory_backend = InMemoryBackend()
+    _raw_client = _memory_backend
+    _raw_binary_client = _memory_backend
+    _raw_async_client = AsyncInMemoryBackend(_memory_backend)
+    _raw_async_binary_client = _raw_async_client
+    fallback_backend = None
+    print("--- Redis replaced by the in-memory backend (REDIS_BACKEND=memory) ---")
+else:
+    # redis-py connects lazily, so building clients never fails; outages are handled per call by the breaker
+    _raw_client = redis.Redis(connection_pool=_make_pool(redis.ConnectionPool, True))
+    _raw_binary_client = redis.Redis(connection_pool=_make_pool(redis.ConnectionPool, False))
+    # Async clients for the FastAPI request path
+    _raw_async_client = aioredis.Redis(connection_pool=_make_pool(aioredis.ConnectionPool, True))
+    _raw_async_binary_client = aioredis.Redis(connection_pool=_make_pool(aioredis.ConnectionPool, False))
+    # Shared by all clients while the breaker is open (None when REDIS_FALLBACK=none)
+    fallback_backend = make_fallback()
+    print(f"--- Redis clients ready ({REDIS_URL and 'via URL' or f'{REDIS_HOST}:{REDIS_PORT}'}, fallback: {REDIS_FALLBACK}) ---")
+
+redis_breaker = CircuitBreaker(probe=_raw_client.ping)
+redis_client = ResilientRedis(_raw_client, redis_breaker, fallback_backend)
+redis_binary_client = ResilientRedis(_raw_binary_client, redis_breaker, fallback_backend)
+async_redis_client = AsyncResilientRedis(_raw_async_client, redis_breaker, fallback_backend)
+async_redis_binary_client = AsyncResilientRedis(_raw_async_binary_client, redis_breaker, fallback_backend)
+
+# --- L1: bounded in-process LRU tier in front of Redis (L2) ---
+
+# Per-namespace capacity (entries) and max age (seconds) of the in-process tier
+L1_CAPACITY = {
+    "emb": int(os.getenv("L1_EMB_CAPACITY", 5000)),
+    "retrieval": int(os.getenv("L1_RETRIEVAL_CAPACITY", 2000)),
+    "llm": int(os.getenv("L1_LLM_CAPACITY", 1000)),
+}
+L1_TTL = int(os.getenv("L1_TTL", 300))
+# Publish writes on Redis pub/sub so other workers drop their L1 copy
+CACHE_INVALIDATION = os.getenv("CACHE_INVALIDATION", "false").lower() == "true"
+INVALIDATION_CHANNEL = "cache:invalidate"
+WORKER_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+_MISSING = object()
+
+class LRUCache:
+    """Thread-safe LRU with per-entry expiry and hit/miss counters."""
+    def __init__(self, capacity: int, ttl: int):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return _MISSING
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: str, value: Any, expire: Optional[int] = None):
+        if self.capacity <= 0:
+            return
+        ttl = min(self.ttl, expire) if expire else self.ttl
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.capacity:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+_l1 = {namespace: LRUCache(capacity, L1_TTL) for namespace, capacity in L1_CAPACITY.items()}
+# L2 (Redis) counters per namespace
+_l2_stats = {namespace: {"hits": 0, "misses": 0} for namespace in L1_CAPACITY}
+
+# Key prefix -> L1 namespace
+_NAMESPACES = {"emb": "emb", "retrieval_ref": "retrieval", "llm": "llm"}
+
+def _namespace(key: str) -> Optional[str]:
+    return _NAMESPACES.get(key.split(":", 1)[0])
+
+def _l1_get(key: str) -> Any:
+    namespace = _namespace(key)
+    return _l1[namespace].get(key) if namespace else _MISSING
+
+def _l1_set(key: str, value: Any, expire: Optional[int] = None):
+    namespace = _namespace(key)
+    if namespace:
+        _l1[namespace].set(key, value, expire)
+
+def _record_l2(key: str, hit: bool):
+    namespace = _namespace(key)
+    if namespace:
+        _l2_stats[namespace]["hits" if hit else "misses"] += 1
+
+def _publish_invalidation(key: str):
+    if CACHE_INVALIDATION and redis_client:
+        try:
+            redis_client.publish(INVALIDATION_CHANNEL, f"{WORKER_ID}|{key}")
+        except Exception as e:
+            print(f"Redis Invalidation Publish Error: {e}")
+
+def _on_invalidation(message):
+    origin, _, key = message["data"].partition("|")
+    if origin != WORKER_ID:
+        namespace = _namespace(key)
+        if namespace:
+            _l1[namespace].delete(key)
+
+def start_invalidation_listener():
+    """Subscribe to cache invalidations from other workers (background thread)."""
+    if not (CACHE_INVALIDATION and redis_client):
+        return None
+    try:
+        pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{INVALIDATION_CHANNEL: _on_invalidation})
+        return pubsub.run_in_thread(sleep_time=1.0, daemon=True)
+    except Exception as e:
+        print(f"Redis Invalidation Subscribe Error: {e}")
+        return None
+
+def invalidate(key: str):
+    """Drop a key from both tiers and tell other workers to drop their L1 copy."""
+    namespace = _namespace(key)
+    if namespace:
+        _l1[namespace].delete(key)
+    if redis_client:
+        try:
+            redis_client.delete(key)
+        except Exception as e:
+            print(f"Redis Cache Delete Error: {e}")
+    _publish_invalidation(key)
+
+def get_cache_stats() -> dict:
+    """Hit/miss counters per namespace and tier."""
+    return {
+        namespace: {
+            "l1_hits": _l1[namespace].hits,
+            "l1_misses": _l1[namespace].misses,
+            "l1_size": len(_l1[namespace]),
+            "l2_hits": _l2_stats[namespace]["hits"],
+            "l2_misses": _l2_stats[namespace]["misses"],
+        }
+        for namespace in _l1
+    }
 
 def get_hash(text: str) -> str:
     """Generate a SHA-256 hash for a given text."""
     return hashlib.sha256(text.encode()).hexdigest()
 
+def _decode_value(value: str) -> Any:
+    try:
+        return json.loads(value)
+    except json.JSONDecodeError:
+        return value
+
+def _encode_value(value: Any) -> Any:
+    return json.dumps(value) if isinstance(value, (dict, list)) else value
+
+def _l1_store(key: str, encoded: Any, expire: int):
+    # L1 holds what a Redis read would return, so both tiers hand back the same type
+    _l1_set(key, _decode_value(encoded) if isinstance(encoded, str) else encoded, expire)
+
 def set_cache(key: str, value: Any, expire: int = 3600):
-    """Store a value in Redis with an expiration time (default 1 hour)."""
+    """Store a value in L1 and Redis with an expiration time (default 1 hour)."""
+    value = _encode_value(value)
+    _l1_store(key, value, expire)
     if redis_client:
         try:
-            if isinstance(value, (dict, list)):
-                value = json.dumps(value)
             redis_client.set(key, value, ex=expire)
         except Exception as e:
             print(f"Redis Cache Set Error: {e}")
+        _publish_invalidation(key)
 
 def get_cache(key: str) -> Optional[Any]:
-    """Retrieve a value from Redis."""
+    """Retrieve a value from L1, falling back to Redis."""
+    value = _l1_get(key)
+    if value is not _MISSING:
+        return value
     if redis_client:
         try:
             value = redis_client.get(key)
+            _record_l2(key, bool(value))
             if value:
-                try:
-                    return json.loads(value)
-                except json.JSONDecodeError:
-                    return value
+                value = _decode_value(value)
+                _l1_set(key, value)
+                return value
         except Exception as e:
             print(f"Redis Cache Get Error: {e}")
     return None
 
-def set_embedding_cache(key: str, vector: list[float], expire: int = 86400):
-    """Store an embedding vector in Redis (default 24 hours)."""
+def _encode_vector(vector) -> bytes:
+    """Pack a vector into raw little-endian float bytes."""
+    return np.asarray(vector, dtype=EMBEDDING_DTYPE).tobytes()
+
+def _decode_vector(raw: bytes) -> np.ndarray:
+    """Decode packed bytes into a float32 array (zero-copy for float32 storage)."""
+    vector = np.frombuffer(raw, dtype=EMBEDDING_DTYPE)
+    # float16 is only a storage format, callers always get float32
+    return vector if EMBEDDING_DTYPE == np.float32 else vector.astype(np.float32)
+
+def _emb_keys(key: str) -> tuple[str, str]:
+    """(packed key, legacy JSON key) for an embedding hash."""
+    return f"{EMB_PREFIX}{key}", f"emb:{key}"
+
+def _decode_or_migrate(pipe, key: str, raw: Optional[bytes], legacy: Optional[bytes]) -> Optional[np.ndarray]:
+    """Decode a packed entry, or convert a legacy JSON entry and queue its migration on `pipe`."""
+    if raw:
+        return _decode_vector(raw)
+    if legacy:
+        vector = np.asarray(json.loads(legacy), dtype=np.float32)
+        packed_key, legacy_key = _emb_keys(key)
+        pipe.set(packed_key, _encode_vector(vector), ex=86400)
+        pipe.delete(legacy_key)
+        return vector
+    return None
+
+def set_embedding_cache(key: str, vector, expire: int = 86400):
+    """Store an embedding vector in L1 and in Redis as packed floats (default 24 hours)."""
+    _l1_set(f"emb:{key}", np.asarray(vector, dtype=np.float32), expire)
     if redis_binary_client:
         try:
-            # We store vectors as json strings for simplicity, or binary if preferred.
-            # Here we use json for compatibility with the decode_responses=True client if needed.
-            redis_client.set(f"emb:{key}", json.dumps(vector), ex=expire)
+            redis_binary_client.set(_emb_keys(key)[0], _encode_vector(vector), ex=expire)
         except Exception as e:
             print(f"Redis Embedding Cache Set Error: {e}")
 
-def get_embedding_cache(key: str) -> Optional[list[float]]:
-    """Retrieve an embedding vector from Redis."""
-    if redis_client:
+def get_embedding_cache(key: str) -> Optional[np.ndarray]:
+    """Retrieve an embedding vector from L1 or Redis, migrating legacy JSON entries on read."""
+    vector = _l1_get(f"emb:{key}")
+    if vector is not _MISSING:
+        return vector
+    if redis_binary_client:
         try:
-            value = redis_client.get(f"emb:{key}")
-            if value:
-                return json.loads(value)
+            raw, legacy = redis_binary_client.mget(*_emb_keys(key))
+            pipe = redis_binary_client.pipeline(transaction=False)
+            vector = _decode_or_migrate(pipe, key, raw, legacy)
+            if legacy and not raw:
+                pipe.execute()
+            _record_l2(f"emb:{key}", vector is not None)
+            if vector is not None:
+                _l1_set(f"emb:{key}", vector)
+            return vector
         except Exception as e:
             print(f"Redis Embedding Cache Get Error: {e}")
     return None
 
+def get_embedding_cache_many(keys: list[str]) -> list[Optional[np.ndarray]]:
+    """Retrieve many embedding vectors (L1 first, then a single MGET for the rest; None for misses)."""
+    vectors = [_l1_get(f"emb:{key}") for key in keys]
+    remote = [i for i, vector in enumerate(vectors) if vector is _MISSING]
+    for i in remote:
+        vectors[i] = None
+    if redis_binary_client and remote:
+        try:
+            values = redis_binary_client.mget([k for i in remote for k in _emb_keys(keys[i])])
+            pipe = redis_binary_client.pipeline(transaction=False)
+            for j, i in enumerate(remote):
+                vector = _decode_or_migrate(pipe, keys[i], values[2 * j], values[2 * j + 1])
+                _record_l2(f"emb:{keys[i]}", vector is not None)
+                if vector is not None:
+                    _l1_set(f"emb:{keys[i]}", vector)
+                vectors[i] = vector
+            if len(pipe):
+                pipe.execute()
+        except Exception as e:
+            print(f"Redis Embedding Cache Get Error: {e}")
+    return vectors
+
+def set_embedding_cache_many(vectors: dict, expire: int = 86400):
+    """Store many embedding vectors in L1 and in one pipelined Redis round trip (default 24 hours)."""
+    for key, vector in vectors.items():
+        _l1_set(f"emb:{key}", np.asarray(vector, dtype=np.float32), expire)
+    if redis_binary_client and vectors:
+        try:
+            pipe = redis_binary_client.pipeline(transaction=False)
+            for key, vector in vectors.items():
+                pipe.set(_emb_keys(key)[0], _encode_vector(vector), ex=expire)
+            pipe.execute()
+        except Exception as e:
+            print(f"Redis Embedding Cache Set Error: {e}")
+
+def get_rerank_scores(query_hash: str, chunk_hashes: list[str]) -> list[Optional[float]]:
+    """Cached reranker scores for (query, chunk) pairs, one HMGET round trip (None for misses)."""
+    if redis_client and chunk_hashes:
+        try:
+            values = redis_client.hmget(f"rerank:{query_hash}", chunk_hashes)
+            return [float(v) if v is not None else None for v in values]
+        except Exception as e:
+            print(f"Redis Rerank Cache Get Error: {e}")
+    return [None] * len(chunk_hashes)
+
+def set_rerank_scores(query_hash: str, scores: dict[str, float], expire: int = 86400):
+    """Store reranker scores for a query, keyed by chunk hash (default 24 hours)."""
+    if redis_client and scores:
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.hset(f"rerank:{query_hash}", mapping=scores)
+            pipe.expire(f"rerank:{query_hash}", expire)
+            pipe.execute()
+        except Exception as e:
+            print(f"Redis Rerank Cache Set Error: {e}")
+
 def set_llm_cache(prompt: str, answer: str, expire: int = 3600):
     """Store LLM response keyed by full prompt hash."""
     prompt_hash = get_hash(prompt)
@@ -92,3 +352,78 @@ def get_llm_cache(prompt: str) -> Optional[str]:
     """Retrieve LLM response keyed by full prompt hash."""
     prompt_hash = get_hash(prompt)
     return get_cache(f"llm:{prompt_hash}")
+
+
+# --- Async API (mirrors the sync helpers above, used on the event loop) ---
+
+async def aset_cache(key: str, value: Any, expire: int = 3600):
+    """Async version of set_cache."""
+    value = _encode_value(value)
+    _l1_store(key, value, expire)
+    if async_redis_client:
+        try:
+            await async_redis_client.set(key, value, ex=expire)
+        except Exception as e:
+            print(f"Redis Cache Set Error: {e}")
+        if CACHE_INVALIDATION:
+            # Same publish as the sync path, off the event loop
+            await asyncio.to_thread(_publish_invalidation, key)
+
+async def aget_cache(key: str) -> Optional[Any]:
+    """Async version of get_cache."""
+    value = _l1_get(key)
+    if value is not _MISSING:
+        return value
+    if async_redis_client:
+        try:
+            value = await async_redis_client.get(key)
+            _record_l2(key, bool(value))
+            if value:
+                value = _decode_value(value)
+                _l1_set(key, value)
+                return value
+        except Exception as e:
+            print(f"Redis Cache Get Error: {e}")
+    return None
+
+async def aset_embedding_cache(key: str, vector, expire: int = 86400):
+    """Async version of set_embedding_cache."""
+    _l1_set(f"emb:{key}", np.asarray(vector, dtype=np.float32), expire)
+    if async_redis_binary_client:
+        try:
+            await async_redis_binary_client.set(_emb_keys(key)[0], _encode_vector(vector), ex=expire)
+        except Exception as e:
+            print(f"Redis Embedding Cache Set Error: {e}")
+
+async def aget_embedding_cache(key: str) -> Optional[np.ndarray]:
+    """Async version of get_embedding_cache."""
+    vector = _l1_get(f"emb:{key}")
+    if vector is not _MISSING:
+        return vector
+    if async_redis_binary_client:
+        try:
+            raw, legacy = await async_redis_binary_client.mget(*_emb_keys(key))
+            pipe = async_redis_binary_client.pipeline(transaction=False)
+            vector = _decode_or_migrate(pipe, key, raw, legacy)
+            if legacy and not raw:
+                await pipe.execute()
+            _record_l2(f"emb:{key}", vector is not None)
+            if vector is not None:
+                _l1_set(f"emb:{key}", vector)
+            return vector
+        except Exception as e:
+            print(f"Redis Embedding Cache Get Error: {e}")
+    return None
+
+async def aset_llm_cache(prompt: str, answer: str, expire: int = 3600):
+    """Async version of set_llm_cache."""
+    prompt_hash = get_hash(prompt)
+    await aset_cache(f"llm:{prompt_hash}", answer, expire=expire)
+
+async def aget_llm_cache(prompt: str) -> Optional[str]:
+    """Async version of get_llm_cache."""
+    prompt_hash = get_hash(prompt)
+    return await aget_cache(f"llm:{prompt_hash}")
+
+
+start_invalidation_listener()
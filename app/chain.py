@@ -1,4 +1,5 @@
 import os
+import asyncio
 from llm import model
 from vectorstore import vector_store
 from langchain.agents import create_agent
@@ -8,68 +9,83 @@ from langchain_core.messages import HumanMessage
 # Set USER_AGENT
 os.environ["USER_AGENT"] = "LangChainRAGAgent/1.0"
 
-from prompts import get_rag_prompt
+from context_packer import build_prompt
+from compression import compress_documents
 from cache import get_cache, set_cache, get_hash
+from summarizer import get_summarizer
 
-# Global map for correlation (fallback for ContextVar scope issues)
-CORRELATION_MAP = {}
+from observability import span, set_trace_attr
+from metrics import record_context
 
-@dynamic_prompt
-def prompt_with_context(request: ModelRequest) -> str:
-    """Inject context and memory into state messages."""
+def _report_context(stats: dict):
+    print(f"--- Prompt packed: {stats['input_tokens']}/{stats['budget']} tokens, {stats['docs_used']} docs ({stats['docs_dropped']} dropped) ---")
+    set_trace_attr("context_tokens", stats)
+    record_context(stats)
+
+def _session_message(request: ModelRequest):
+    """Session memory and the latest user message of the request (message is None if there is nothing to answer)."""
     from memory import ChatMemoryManager
-    
+
     # Extract session_id from request state (passed from server)
-    session_id = request.state.get("session_id", "default")
-    memory = ChatMemoryManager(session_id=session_id)
-    
+    memory = ChatMemoryManager(session_id=request.state.get("session_id", "default"))
     last_msg = None
     if "messages" in request.state and request.state["messages"]:
         last_msg = request.state["messages"][-1]
-    
     if not last_msg or not last_msg.content:
+        return memory, None
+    return memory, last_msg
+
+def _after_memory(memory, doc_ids: list, needs_summary: bool):
+    # Store doc_ids on the request trace (read by the server when logging)
+    set_trace_attr("retrieved_doc_ids", doc_ids)
+    # Summarize in the background; this turn uses the current window and summary
+    if needs_summary:
+        get_summarizer().schedule(memory)
+
+def _assemble_prompt(query: str, retrieved_docs, windowed_history, summary) -> str:
+    """Keep only query-relevant sentences (CONTEXT_COMPRESSION), then fit everything into the token budget."""
+    with span("compress"):
+        retrieved_docs, compression_stats = compress_documents(query, retrieved_docs)
+    with span("pack"):
+        prompt, stats = build_prompt(query, retrieved_docs, windowed_history, summary)
+    _report_context({**stats, **compression_stats})
+    # Note: AI messages are added to memory in the server after generation
+    return prompt
+
+@dynamic_prompt
+def prompt_with_context(request: ModelRequest) -> str:
+    """Inject context and memory into state messages."""
+    memory, last_msg = _session_message(request)
+    if last_msg is None:
         return "You are a helpful assistant."
-    
-    last_query = last_msg.content
 
     from retriever import final_retriever
-    from observability import retrieved_doc_ids_var
-    retrieved_docs, doc_ids = final_retriever.invoke_with_metadata(last_query)
-    
-    # Store doc_ids in context variable
-    retrieved_doc_ids_var.set(doc_ids)
-    
-    # Also store in global map using message ID or object hash as key
-    # This helps when the context is lost
-    msg_key = getattr(last_msg, "id", None) or hash(last_msg)
-    CORRELATION_MAP[msg_key] = doc_ids
-    
-    docs_content = "\n\n".join(doc.page_content for doc in retrieved_docs)
+    retrieved_docs, doc_ids = final_retriever.invoke_with_metadata(last_msg.content)
 
     # Memory Management
-    # 1. Add current user message to history
-    memory.add_message(last_msg)
-    
-    # 2. Check if we need to summarize
-    if memory.should_summarize():
-        full_history = memory.get_history()
-        summary = model.summarize_conversation(full_history)
-        memory.set_summary(summary)
-        memory.clear_history()
-        # Keep the latest message in history after clearing
-        memory.add_message(last_msg)
-    
-    # 3. Get history and summary for the prompt
-    windowed_history = memory.get_windowed_history()
-    summary = memory.get_summary() or "None"
-    
-    history_str = "\n".join([f"{m.type}: {m.content}" for m in windowed_history])
-    
-    prompt = get_rag_prompt(docs_content, chat_history=history_str, summary=summary)
-    
-    # Note: AI messages are added to memory in the server after generation
-    
-    return prompt
+    with span("memory"):
+        # Add the user message, then read history, summary and the summarization check (one round trip)
+        windowed_history, summary, needs_summary = memory.add_message_and_get_context(last_msg)
+    _after_memory(memory, doc_ids, needs_summary)
+
+    return _assemble_prompt(last_msg.content, retrieved_docs, windowed_history, summary)
+
+@dynamic_prompt
+async def aprompt_with_context(request: ModelRequest) -> str:
+    """Async version of prompt_with_context, used by the FastAPI request path."""
+    memory, last_msg = _session_message(request)
+    if last_msg is None:
+        return "You are a helpful assistant."
+
+    from retriever import final_retriever
+    retrieved_docs, doc_ids = await final_retriever.ainvoke_with_metadata(last_msg.content)
+
+    with span("memory"):
+        windowed_history, summary, needs_summary = await memory.aadd_message_and_get_context(last_msg)
+    _after_memory(memory, doc_ids, needs_summary)
+
+    # Compression and tokenization are CPU-bound; keep them off the event loop
+    return await asyncio.to_thread(_assemble_prompt, last_msg.content, retrieved_docs, windowed_history, summary)
 
 # To properly cache the LLM response, we should wrap the agent invocation
 # but since the user suggested "Final LLM response cache" in production pattern:
@@ -79,6 +95,10 @@ def prompt_with_context(request: ModelRequest) -> str:
 # The new create_agent returns a graph that can be invoked directly
 agent = create_agent(model, tools=[], middleware=[prompt_with_context])
 
+# Async-only twin of `agent` for the server; drive it with `ainvoke` so retrieval,
+# Redis I/O and generation never block the event loop.
+async_agent = create_agent(model, tools=[], middleware=[aprompt_with_context])
+
 if __name__ == "__main__":
     print("--- Middleware Chain (Graph) Ready ---")
     query = "What information do you collect?"
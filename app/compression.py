@@ -0,0 +1,95 @@
+"""
+Extractive context compression.
+
+Optional stage between retrieval and prompt packing: each retrieved chunk is
+split into sentences, sentences are scored against the query and only the
+best ones (in original order) are kept, up to COMPRESSION_RATIO of the
+chunk's tokens. At least one sentence per chunk is always kept.
+
+CONTEXT_COMPRESSION selects the scorer:
+- off (default): chunks are passed through unchanged
+- embedding: cosine similarity with the query, using the cached embeddings
+- rerank: Flashrank scores through the retriever's rerank micro-batcher
+"""
+import os
+import re
+import numpy as np
+from typing import List
+from langchain_core.documents import Document
+from context_packer import count_tokens
+
+CONTEXT_COMPRESSION = os.getenv("CONTEXT_COMPRESSION", "off").lower()
+COMPRESSION_RATIO = float(os.getenv("COMPRESSION_RATIO", 0.5))
+
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?;])\s+|\n+")
+
+def split_sentences(text: str) -> List[str]:
+    return [s.strip() for s in _SENTENCE_SPLIT.split(text) if s and s.strip()]
+
+def _embedding_scores(query: str, groups: List[List[str]]) -> List[List[float]]:
+    from embeddings import embeddings
+    # One bulk call for all sentences; repeated chunks hit the embedding cache
+    sentences = [s for group in groups for s in group]
+    vectors = np.asarray(embeddings.embed_documents(sentences), dtype=np.float32)
+    query_vector = np.asarray(embeddings.embed_query(query), dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1) * (np.linalg.norm(query_vector) or 1.0)
+    scores = vectors @ query_vector / np.where(norms == 0, 1.0, norms)
+
+    grouped, offset = [], 0
+    for group in groups:
+        grouped.append(scores[offset:offset + len(group)].tolist())
+        offset += len(group)
+    return grouped
+
+def _rerank_scores(query: str, groups: List[List[str]]) -> List[List[float]]:
+    from retriever import final_retriever
+    futures = [final_retriever.rerank_batcher.submit_future((query, group)) for group in groups]
+    return [future.result() for future in futures]
+
+def _select(sentences: List[str], scores: List[float], ratio: float) -> str:
+    """Keep the highest scoring sentences up to `ratio` of the tokens, in original order."""
+    budget = ratio * sum(count_tokens(s) for s in sentences)
+    keep, used = set(), 0
+    for i in sorted(range(len(sentences)), key=lambda i: scores[i], reverse=True):
+        cost = count_tokens(sentences[i])
+        if keep and used + cost > budget:
+            continue
+        keep.add(i)
+        used += cost
+    return " ".join(sentences[i] for i in sorted(keep))
+
+def compress_documents(query: str, docs: List[Document], mode: str = CONTEXT_COMPRESSION, ratio: float = COMPRESSION_RATIO) -> tuple[List[Document], dict]:
+    """
+    Return (compressed docs, stats). Stats report the chunk tokens before and
+    after compression and the tokens saved for this request.
+    """
+    if mode not in ("embedding", "rerank") or not docs or ratio >= 1:
+        return docs, {}
+
+    groups = [split_sentences(doc.page_content) for doc in docs]
+    # Only chunks with more than one sentence can be compressed
+    targets = [i for i, group in enumerate(groups) if len(group) > 1]
+    if not targets:
+        return docs, {}
+
+    scorer = _rerank_scores if mode == "rerank" else _embedding_scores
+    try:
+        scores = scorer(query, [groups[i] for i in targets])
+    except Exception as e:
+        print(f"Context Compression Error: {e}")
+        return docs, {}
+
+    tokens_before = sum(count_tokens(doc.page_content) for doc in docs)
+    compressed = list(docs)
+    for i, group_scores in zip(targets, scores):
+        compressed[i] = Document(page_content=_select(groups[i], group_scores, ratio), metadata=docs[i].metadata)
+
+    tokens_after = sum(count_tokens(doc.page_content) for doc in compressed)
+    stats = {
+        "compression": mode,
+        "compression_tokens_before": tokens_before,
+        "compression_tokens_after": tokens_after,
+        "compression_tokens_saved": tokens_before - tokens_after,
+    }
+    print(f"--- Context compressed ({mode}): {tokens_before} -> {tokens_after} tokens ---")
+    return compressed, stats
@@ -0,0 +1,163 @@
+"""
+Token-budgeted prompt assembly.
+
+Counts tokens with the served model's tokenizer (memoised per text, since
+chunks, summaries and history lines repeat across turns) and fits retrieved
+docs, chat history and the conversation summary into PROMPT_TOKEN_BUDGET.
+
+Sections are filled in CONTEXT_PRIORITY order:
+- top_doc: best reranked chunk (truncated to fit if needed)
+- summary: conversation summary (truncated to fit if needed)
+- history: windowed chat history, newest messages first, whole messages only
+- docs: remaining chunks in rank order, whole chunks only
+"""
+import os
+import threading
+from functools import lru_cache
+from typing import List, Optional
+from langchain_core.documents import Document
+from langchain_core.messages import BaseMessage
+from prompts import get_rag_prompt
+from metrics import PROMPT_TOKENIZER_EXACT
+
+# Tokenizer of the served model. The Mistral repo is gated on the Hugging Face Hub:
+# HF_TOKEN (or HUGGINGFACE_API_KEY) must belong to an account that accepted its terms
+PROMPT_TOKENIZER = os.getenv("PROMPT_TOKENIZER", "mistralai/Mistral-7B-Instruct-v0.2")
+# Total input tokens for the system prompt + user query
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", 3000))
+CONTEXT_PRIORITY = [s.strip() for s in os.getenv("CONTEXT_PRIORITY", "top_doc,summary,history,docs").split(",") if s.strip()]
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 20000))
+
+_tokenizer = None
+_tokenizer_loaded = False
+_tokenizer_lock = threading.Lock()
+
+def get_tokenizer():
+    """
+    Load the model tokenizer once; None if it cannot be loaded (falls back to a heuristic).
+    The first call may download it: the server preloads it at startup, off the event loop.
+    """
+    global _tokenizer, _tokenizer_loaded
+    if not _tokenizer_loaded:
+        # Concurrent first callers wait for the load instead of counting with the heuristic
+        with _tokenizer_lock:
+            if not _tokenizer_loaded:
+                try:
+                    from tokenizers import Tokenizer
+                    token = os.getenv("HF_TOKEN") or os.getenv("HUGGINGFACE_API_KEY")
+                    _tokenizer = Tokenizer.from_pretrained(PROMPT_TOKENIZER, auth_token=token)
+                    print(f"--- Prompt tokenizer loaded: {PROMPT_TOKENIZER} ---")
+                except Exception as e:
+                    print(
+                        f"--- WARNING: Could not load tokenizer {PROMPT_TOKENIZER} ({e}). Prompt token budgets are "
+                        f"APPROXIMATE (~4 chars/token estimate). Gated repos need HF_TOKEN. ---"
+                    )
+                PROMPT_TOKENIZER_EXACT.set(1 if _tokenizer is not None else 0, tokenizer=PROMPT_TOKENIZER)
+                _tokenizer_loaded = True
+    return _tokenizer
+
+@lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def _encode(text: str) -> tuple:
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        return ()
+    return tuple(tokenizer.encode(text, add_special_tokens=False).offsets)
+
+def count_tokens(text: str, cache: bool = True) -> int:
+    """Token count of `text` under the model tokenizer (cached unless `cache=False`, for one-off texts)."""
+    if not text:
+        return 0
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        # Rough rule of thumb: 1 token ~ 4 characters
+        return len(text) // 4
+    if not cache:
+        return len(tokenizer.encode(text, add_special_tokens=False).ids)
+    return len(_encode(text))
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut `text` to at most `max_tokens` tokens, on a token boundary."""
+    if max_tokens <= 0:
+        return ""
+    if get_tokenizer() is None:
+        return text[:max_tokens * 4]
+    offsets = _encode(text)
+    if len(offsets) <= max_tokens:
+        return text
+    return text[:offsets[max_tokens - 1][1]]
+
+def _format_message(message: BaseMessage) -> str:
+    return f"{message.type}: {message.content}"
+
+def build_prompt(
+    query: str,
+    docs: List[Document],
+    history: List[BaseMessage],
+    summary: Optional[str],
+    budget: int = PROMPT_TOKEN_BUDGET,
+) -> tuple[str, dict]:
+    """
+    Render the RAG system prompt within `budget` tokens.
+    Returns (prompt, stats) where stats reports the tokens actually used per section.
+    """
+    # Fixed cost: the template itself (persona, rules, examples, format) plus the user query
+    fixed = count_tokens(get_rag_prompt("", chat_history="", summary="")) + count_tokens(query)
+    remaining = budget - fixed
+    used = {"docs": 0, "history": 0, "summary": 0}
+
+    def take(text: str, section: str, allow_truncate: bool) -> Optional[str]:
+        nonlocal remaining
+        # +1 for the separator joining this piece to its neighbours
+        cost = count_tokens(text) + 1
+        if cost > remaining:
+            if not allow_truncate or remaining <= 1:
+                return None
+            text = truncate_to_tokens(text, remaining - 1)
+            cost = count_tokens(text) + 1
+        remaining -= cost
+        used[section] += cost
+        return text
+
+    packed_docs: dict[int, str] = {}
+    packed_history: dict[int, str] = {}
+    packed_summary = None
+
+    for section in CONTEXT_PRIORITY:
+        if section == "top_doc" and docs:
+            text = take(docs[0].page_content, "docs", allow_truncate=True)
+            if text:
+                packed_docs[0] = text
+        elif section == "summary" and summary:
+            packed_summary = take(summary, "summary", allow_truncate=True)
+        elif section == "history":
+            for i in range(len(history) - 1, -1, -1):
+                text = take(_format_message(history[i]), "history", allow_truncate=False)
+                if text is None:
+                    break
+                packed_history[i] = text
+        elif section == "docs":
+            for i, doc in enumerate(docs):
+                if i in packed_docs:
+                    continue
+                text = take(doc.page_content, "docs", allow_truncate=False)
+                if text is not None:
+                    packed_docs[i] = text
+
+    prompt = get_rag_prompt(
+        "\n\n".join(packed_docs[i] for i in sorted(packed_docs)),
+        chat_history="\n".join(packed_history[i] for i in sorted(packed_history)),
+        summary=packed_summary or "None",
+    )
+    stats = {
+        # Measured on the rendered prompt, not summed per section
+        "input_tokens": count_tokens(prompt, cache=False) + count_tokens(query),
+        "budget": budget,
+        "fixed_tokens": fixed,
+        "doc_tokens": used["docs"],
+        "history_tokens": used["history"],
+        "summary_tokens": used["summary"],
+        "docs_used": len(packed_docs),
+        "docs_dropped": len(docs) - len(packed_docs),
+        "history_dropped": len(history) - len(packed_history),
+    }
+    return prompt, stats
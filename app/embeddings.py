@@ -1,24 +1,108 @@
 import os
+import numpy as np
 from dotenv import load_dotenv
-from langchain_huggingface import HuggingFaceEmbeddings
-from cache import get_embedding_cache, set_embedding_cache, get_hash
+from langchain_core.embeddings import Embeddings
+from batching import MicroBatcher
+from observability import span
+from metrics import record_cache
+from singleflight import embedding_flights
+from cache import (
+    get_embedding_cache, set_embedding_cache, aget_embedding_cache, aset_embedding_cache,
+    get_embedding_cache_many, set_embedding_cache_many, get_hash
+)
 
 load_dotenv()
 
-class CachedHuggingFaceEmbeddings(HuggingFaceEmbeddings):
-    def embed_query(self, text: str) -> list[float]:
+# Number of cache misses sent to the model per forward pass in embed_documents
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 64))
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embedding model (HuggingFace, or the offline fake) backed by the Redis embedding cache.
+    Vectors are returned as float32 NumPy arrays (cache hits are decoded zero-copy).
+    """
+    def __init__(self, model_to_wrap: Embeddings, embed_batch_size: int = EMBED_BATCH_SIZE):
+        self.model_to_wrap = model_to_wrap
+        self.embed_batch_size = embed_batch_size
+        # Coalesces concurrent query-embedding misses into one forward pass.
+        # Query and document encoding are identical for mpnet (no query_encode_kwargs)
+        self._query_batcher = MicroBatcher(model_to_wrap.embed_documents, name="embed-query-batcher")
+
+    def embed_documents(self, texts: list[str]) -> list[np.ndarray]:
+        if not texts:
+            return []
+
+        hashes = [get_hash(t) for t in texts]
+        # Identical chunks share one cache entry and one forward pass
+        unique_hashes = list(dict.fromkeys(hashes))
+        cached = dict(zip(unique_hashes, get_embedding_cache_many(unique_hashes)))
+
+        text_by_hash = dict(zip(hashes, texts))
+        misses = [h for h in unique_hashes if cached[h] is None]
+        print(f"--- Embedding Cache: {len(unique_hashes) - len(misses)} HIT / {len(misses)} MISS ---")
+        record_cache("embedding", True, len(unique_hashes) - len(misses))
+        record_cache("embedding", False, len(misses))
+
+        new_vectors = {}
+        for i in range(0, len(misses), self.embed_batch_size):
+            batch = misses[i:i + self.embed_batch_size]
+            vectors = self.model_to_wrap.embed_documents([text_by_hash[h] for h in batch])
+            new_vectors.update(zip(batch, np.asarray(vectors, dtype=np.float32)))
+
+        set_embedding_cache_many(new_vectors)
+        cached.update(new_vectors)
+        return [cached[h] for h in hashes]
+
+    def embed_query(self, text: str) -> np.ndarray:
         query_hash = get_hash(text)
-        cached_res = get_embedding_cache(query_hash)
-        if cached_res:
-            print(f"--- Embedding Cache HIT ---")
-            return cached_res
-        
-        print(f"--- Embedding Cache MISS ---")
-        embedding = super().embed_query(text)
-        set_embedding_cache(query_hash, embedding)
-        return embedding
-
-embeddings = CachedHuggingFaceEmbeddings(model_name="sentence-transformers/all-mpnet-base-v2")
+        with span("embed") as attrs:
+            cached_res = get_embedding_cache(query_hash)
+            attrs["cached"] = cached_res is not None
+            if cached_res is not None:
+                print(f"--- Embedding Cache HIT ---")
+                record_cache("embedding", True)
+                return cached_res
+            
+            print(f"--- Embedding Cache MISS ---")
+            record_cache("embedding", False)
+            # Concurrent misses on the same text share one forward pass
+            with embedding_flights.lead(query_hash) as flight:
+                if not flight.shared:
+                    flight.value = np.asarray(self._query_batcher.submit(text), dtype=np.float32)
+                    set_embedding_cache(query_hash, flight.value)
+            return flight.value
+
+    async def aembed_query(self, text: str) -> np.ndarray:
+        query_hash = get_hash(text)
+        with span("embed") as attrs:
+            cached_res = await aget_embedding_cache(query_hash)
+            attrs["cached"] = cached_res is not None
+            if cached_res is not None:
+                print(f"--- Embedding Cache HIT ---")
+                record_cache("embedding", True)
+                return cached_res
+
+            print(f"--- Embedding Cache MISS ---")
+            record_cache("embedding", False)
+            # The forward pass runs on the batcher thread, off the event loop
+            async with embedding_flights.alead(query_hash) as flight:
+                if not flight.shared:
+                    flight.value = np.asarray(await self._query_batcher.asubmit(text), dtype=np.float32)
+                    await aset_embedding_cache(query_hash, flight.value)
+            return flight.value
+
+if os.getenv("EMBEDDINGS", "HF").upper() == "FAKE":
+    from fakes import FakeEmbeddings
+
+    # Deterministic hashing embeddings for benchmarks (no model download); still cached and batched
+    embeddings_base = FakeEmbeddings()
+    print("--- Embeddings initialized with the fake embedding model ---")
+else:
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    embeddings_base = HuggingFaceEmbeddings(model_name="sentence-transformers/all-mpnet-base-v2")
+
+embeddings = CachedEmbeddings(embeddings_base)
 
 if __name__ == "__main__":
     query = "This is a test"
@@ -28,5 +112,5 @@ if __name__ == "__main__":
     vec2 = embeddings.embed_query(query)
     
     print(f"Embeddings dimension: {len(vec1)}")
-    assert vec1 == vec2
+    assert np.allclose(vec1, vec2)
     print("Verification successful: Cache working for embeddings.")
\ No newline at end of file
@@ -0,0 +1,119 @@
+"""
+Deterministic offline stand-ins for benchmarks and local runs.
+
+`LLM=FAKE` swaps the Bedrock/HF chat model for FakeChatModel and
+`EMBEDDINGS=FAKE` swaps the HF embedding model for FakeEmbeddings, so the
+full pipeline can be exercised without paid API calls or model downloads.
+Latencies are simulated with sleeps and configurable through the env.
+"""
+import os
+import time
+import asyncio
+import hashlib
+import numpy as np
+from typing import Any, AsyncIterator, Iterator, List, Optional
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+FAKE_LLM_LATENCY_MS = float(os.getenv("FAKE_LLM_LATENCY_MS", 200))
+FAKE_LLM_TOKEN_MS = float(os.getenv("FAKE_LLM_TOKEN_MS", 5))
+FAKE_EMBED_LATENCY_MS = float(os.getenv("FAKE_EMBED_LATENCY_MS", 10))
+# Must match the dimension of the existing Chroma collection (all-mpnet-base-v2)
+FAKE_EMBEDDING_DIM = int(os.getenv("FAKE_EMBEDDING_DIM", 768))
+
+def _seed(text: str) -> int:
+    return int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little")
+
+class FakeChatModel(BaseChatModel):
+    """
+    Answers deterministically from the last message: time to first token is
+    FAKE_LLM_LATENCY_MS, then one word every FAKE_LLM_TOKEN_MS.
+    The answer ends in "Final Answer:" form so the ReAct agent terminates.
+    """
+    latency_ms: float = FAKE_LLM_LATENCY_MS
+    token_ms: float = FAKE_LLM_TOKEN_MS
+
+    def _answer(self, messages: List[BaseMessage]) -> str:
+        last = str(messages[-1].content) if messages else ""
+        words = [f"w{_seed(last + str(i)) % 1000}" for i in range(12)]
+        return "Thought: I now know the final answer\nFinal Answer: Answer: " + " ".join(words)
+
+    def _usage(self, messages: List[BaseMessage], answer: str) -> dict:
+        input_tokens = sum(len(str(m.content)) for m in messages) // 4
+        output_tokens = len(answer) // 4
+        return {"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens}
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        answer = self._answer(messages)
+        time.sleep((self.latency_ms + self.token_ms * len(answer.split())) / 1000)
+        message = AIMessage(content=answer, usage_metadata=self._usage(messages, answer))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        answer = self._answer(messages)
+        await asyncio.sleep((self.latency_ms + self.token_ms * len(answer.split())) / 1000)
+        message = AIMessage(content=answer, usage_metadata=self._usage(messages, answer))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        answer = self._answer(messages)
+        time.sleep(self.latency_ms / 1000)
+        for word in answer.split(" "):
+            time.sleep(self.token_ms / 1000)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self._usage(messages, answer)))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        answer = self._answer(messages)
+        await asyncio.sleep(self.latency_ms / 1000)
+        for word in answer.split(" "):
+            await asyncio.sleep(self.token_ms / 1000)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+        # Usage on a final empty chunk, as Bedrock does
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self._usage(messages, answer)))
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake_chat_model"
+
+class FakeEmbeddings(Embeddings):
+    """
+    Bag-of-words hashing embeddings: each token maps to a fixed random unit
+    vector and a text is the normalised sum, so near-duplicate queries stay
+    close (exercises the semantic cache). One call costs FAKE_EMBED_LATENCY_MS.
+    """
+    def __init__(self, dim: int = FAKE_EMBEDDING_DIM, latency_ms: float = FAKE_EMBED_LATENCY_MS):
+        self.dim = dim
+        self.latency_ms = latency_ms
+        self._token_vectors: dict[str, np.ndarray] = {}
+
+    def _token_vector(self, token: str) -> np.ndarray:
+        vector = self._token_vectors.get(token)
+        if vector is None:
+            vector = np.random.default_rng(_seed(token)).standard_normal(self.dim).astype(np.float32)
+            vector /= np.linalg.norm(vector)
+            self._token_vectors[token] = vector
+        return vector
+
+    def _embed(self, text: str) -> np.ndarray:
+        tokens = [t.strip(".,?!;:\"'()").lower() for t in text.split()]
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in tokens:
+            if token:
+                vector += self._token_vector(token)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def embed_documents(self, texts: List[str]) -> List[np.ndarray]:
+        time.sleep(self.latency_ms / 1000)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> np.ndarray:
+        time.sleep(self.latency_ms / 1000)
+        return self._embed(text)
+
+    async def aembed_query(self, text: str) -> np.ndarray:
+        await asyncio.sleep(self.latency_ms / 1000)
+        return self._embed(text)
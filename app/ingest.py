@@ -1,11 +1,157 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from vectorstore import vector_store
-from splitter import all_splits
+from loader import DATA_DIR, list_pdfs, file_sha256, load_pdf, parsed_cache_path
+from splitter import text_splitter
+from snapshot import SnapshotWriter
+from manifest import MANIFEST_PATH, load_manifest, save_manifest, chunk_id
 
-def run_ingestion():
-    document_ids = vector_store.add_documents(documents=all_splits)
-    print(f"Ingested {len(document_ids)} documents.")
-    print(f"First 3 document IDs: {document_ids[:3]}")
-    return document_ids
+# PDF parsing processes, and chunks per embedding + Chroma write
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", os.cpu_count() or 1))
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 256))
+
+class IngestStats:
+    """Running counters for progress / throughput reporting."""
+    def __init__(self):
+        self.start = time.time()
+        self.files = 0
+        self.pages = 0
+        self.chunks = 0
+        self.vectors = 0
+
+    def report(self, label: str = "Progress"):
+        elapsed = max(time.time() - self.start, 1e-9)
+        print(
+            f"--- {label}: {self.files} files | {self.pages} pages ({self.pages / elapsed:.1f}/s) | "
+            f"{self.chunks} chunks ({self.chunks / elapsed:.1f}/s) | "
+            f"{self.vectors} vectors ({self.vectors / elapsed:.1f}/s) | {elapsed:.1f}s ---"
+        )
+
+def _parsed_files(jobs, workers: int):
+    """
+    Parse PDFs in a process pool, yielding (job, pages) as each file finishes.
+    At most 2 * workers files are in flight, so a slow consumer (embedding)
+    throttles parsing instead of letting parsed pages pile up in memory.
+    """
+    jobs = iter(jobs)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+
+        def submit_next():
+            job = next(jobs, None)
+            if job is not None:
+                name, path, file_hash = job
+                pending[pool.submit(load_pdf, path, file_hash)] = job
+
+        for _ in range(2 * workers):
+            submit_next()
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = pending.pop(future)
+                yield job, future.result()
+                submit_next()
+
+def _iter_file_chunks(jobs, workers: int, stats: IngestStats):
+    """Stream (name, file_hash, splits) per file, splitting as parsed pages arrive."""
+    for (name, path, file_hash), pages in _parsed_files(jobs, workers):
+        splits = text_splitter.split_documents(pages)
+        stats.files += 1
+        stats.pages += len(pages)
+        stats.chunks += len(splits)
+        yield name, file_hash, splits
+
+def run_ingestion(workers: int = INGEST_WORKERS, batch_size: int = INGEST_BATCH_SIZE):
+    """
+    Incrementally sync data/ into Chroma.
+    Only new or modified PDFs are parsed and embedded; chunks of deleted or
+    changed files are removed by their stable IDs. Parsing runs in a process
+    pool and new chunks are embedded and written in batches as they stream in.
+    """
+    if not os.path.exists(MANIFEST_PATH) and vector_store.get(limit=1)["ids"]:
+        # Vectors from a pre-manifest ingestion have random IDs we cannot diff against
+        print("--- No ingestion manifest found, resetting existing collection ---")
+        vector_store.reset_collection()
+
+    manifest = load_manifest()
+    files = manifest["files"]
+    current = {os.path.relpath(path, DATA_DIR): path for path in list_pdfs()}
+
+    stats = IngestStats()
+    added_ids = []
+    removed = 0
+    batch = {}
+
+    def flush():
+        # One embed_documents call (cached + batched) and one Chroma write per batch
+        if batch:
+            added_ids.extend(vector_store.add_documents(documents=list(batch.values()), ids=list(batch.keys())))
+            stats.vectors += len(batch)
+            batch.clear()
+            stats.report()
+
+    # 1. Files deleted from data/
+    for name in sorted(set(files) - set(current)):
+        entry = files.pop(name)
+        if entry["chunk_ids"]:
+            vector_store.delete(ids=entry["chunk_ids"])
+            removed += len(entry["chunk_ids"])
+        cache_path = parsed_cache_path(entry["sha256"])
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+        print(f"Removed: {name}")
+
+    # 2. New, modified and unchanged files (unchanged ones hit the parsed-page cache)
+    # Chunks + BM25 are persisted as they stream past (so the server can start
+    # without re-parsing the PDFs), instead of holding the whole corpus until the end
+    snapshot = SnapshotWriter()
+    try:
+        jobs = ((name, path, file_sha256(path)) for name, path in current.items())
+        for name, file_hash, splits in _iter_file_chunks(jobs, workers, stats):
+            snapshot.add(splits)
+            entry = files.get(name)
+            if entry and entry["sha256"] == file_hash:
+                continue
+
+            ids = [chunk_id(name, chunk) for chunk in splits]
+            old_ids = set(entry["chunk_ids"]) if entry else set()
+            new_ids = set(ids)
+
+            stale_ids = [i for i in old_ids if i not in new_ids]
+            if stale_ids:
+                vector_store.delete(ids=stale_ids)
+                removed += len(stale_ids)
+
+            added = 0
+            for i, chunk in zip(ids, splits):
+                # Skip chunks already stored, and verbatim repeats at the same position
+                if i in old_ids or i in batch:
+                    continue
+                batch[i] = chunk
+                added += 1
+                if len(batch) >= batch_size:
+                    flush()
+
+            if entry and entry["sha256"] != file_hash:
+                old_cache = parsed_cache_path(entry["sha256"])
+                if os.path.exists(old_cache):
+                    os.remove(old_cache)
+
+            files[name] = {"sha256": file_hash, "chunk_ids": list(dict.fromkeys(ids))}
+            print(f"{'Updated' if entry else 'Added'}: {name} (+{added} / -{len(stale_ids)} chunks)")
+
+        flush()
+    except BaseException:
+        snapshot.abort()
+        raise
+
+    save_manifest(manifest)
+    snapshot.close()
+    stats.report("Done")
+    print(f"Ingested {len(added_ids)} new chunks, removed {removed} stale chunks.")
+    return added_ids
 
 if __name__ == "__main__":
-    run_ingestion()
\ No newline at end of file
+    run_ingestion()
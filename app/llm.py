@@ -1,10 +1,12 @@
 import os
 from dotenv import load_dotenv
-from typing import Any, List, Optional
+from typing import Any, AsyncIterator, List, Optional
 from langchain_core.language_models.chat_models import BaseChatModel
 from langchain_core.messages import BaseMessage, SystemMessage
-from langchain_core.outputs import ChatResult
-from cache import get_llm_cache, set_llm_cache, get_hash
+from langchain_core.outputs import ChatResult, ChatGenerationChunk
+from cache import get_llm_cache, set_llm_cache, aget_llm_cache, aset_llm_cache, get_hash
+from observability import span
+from metrics import record_cache
 
 # Load environment variables from .env file
 load_dotenv()
@@ -21,6 +23,13 @@ if llm_provider == "AWS":
     )
     print("--- LLM initialized with AWS Bedrock ---")
 
+elif llm_provider == "FAKE":
+    from fakes import FakeChatModel
+
+    # Deterministic offline model for benchmarks (latency set by FAKE_LLM_LATENCY_MS / FAKE_LLM_TOKEN_MS)
+    model_base = FakeChatModel()
+    print("--- LLM initialized with the fake chat model ---")
+
 else:
     # Default to Hugging Face
     from langchain_huggingface import ChatHuggingFace, HuggingFaceEndpoint
@@ -53,13 +62,16 @@ class CachedChatModel(BaseChatModel):
         
         if cached_res:
             print(f"--- LLM (Prompt) Cache HIT ---")
+            record_cache("prompt", True)
             # Reconstruct the expected response format
             from langchain_core.messages import AIMessage
             from langchain_core.outputs import ChatGeneration
             return ChatResult(generations=[ChatGeneration(message=AIMessage(content=cached_res))])
 
         print(f"--- LLM (Prompt) Cache MISS ---")
-        result = self.model_to_wrap._generate(messages, stop, **kwargs)
+        record_cache("prompt", False)
+        with span("llm"):
+            result = self.model_to_wrap._generate(messages, stop, **kwargs)
         
         # Cache the result content
         if result.generations:
@@ -68,6 +80,55 @@ class CachedChatModel(BaseChatModel):
             
         return result
 
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, **kwargs: Any) -> ChatResult:
+        prompt_str = "".join([f"{m.type}:{m.content}" for m in messages])
+        cached_res = await aget_llm_cache(prompt_str)
+
+        if cached_res:
+            print(f"--- LLM (Prompt) Cache HIT ---")
+            record_cache("prompt", True)
+            from langchain_core.messages import AIMessage
+            from langchain_core.outputs import ChatGeneration
+            return ChatResult(generations=[ChatGeneration(message=AIMessage(content=cached_res))])
+
+        print(f"--- LLM (Prompt) Cache MISS ---")
+        record_cache("prompt", False)
+        with span("llm"):
+            result = await self.model_to_wrap._agenerate(messages, stop, **kwargs)
+
+        if result.generations:
+            answer = result.generations[0].message.content
+            await aset_llm_cache(prompt_str, answer)
+
+        return result
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        # run_manager is not forwarded: BaseChatModel already emits on_llm_new_token
+        # for every chunk we yield, forwarding it would duplicate streamed tokens.
+        prompt_str = "".join([f"{m.type}:{m.content}" for m in messages])
+        cached_res = await aget_llm_cache(prompt_str)
+
+        if cached_res:
+            print(f"--- LLM (Prompt) Cache HIT ---")
+            record_cache("prompt", True)
+            from langchain_core.messages import AIMessageChunk
+            # Replay the cached answer as a single chunk
+            yield ChatGenerationChunk(message=AIMessageChunk(content=cached_res))
+            return
+
+        print(f"--- LLM (Prompt) Cache MISS ---")
+        record_cache("prompt", False)
+        parts = []
+        with span("llm", stream=True) as attrs:
+            async for chunk in self.model_to_wrap._astream(messages, stop, **kwargs):
+                parts.append(chunk.message.content)
+                yield chunk
+            attrs["chunks"] = len(parts)
+
+        # Only cache once the full completion has been streamed
+        if parts:
+            await aset_llm_cache(prompt_str, "".join(parts))
+
     def summarize_conversation(self, messages: List[BaseMessage]) -> str:
         """
         Compress conversation history into a concise summary.
@@ -79,7 +140,23 @@ class CachedChatModel(BaseChatModel):
         ]
         
         print("--- Summarizing Conversation History ---")
-        result = self.model_to_wrap.invoke(summary_prompt)
+        with span("summarization", messages=len(messages)):
+            result = self.model_to_wrap.invoke(summary_prompt)
+        return result.content
+
+    async def asummarize_conversation(self, messages: List[BaseMessage]) -> str:
+        """
+        Async version of summarize_conversation.
+        """
+        history_text = "\n".join([f"{m.type}: {m.content}" for m in messages])
+        summary_prompt = [
+            SystemMessage(content="Summarize the following conversation history concisely, focusing on key facts and user preferences. Maintain context needed for future questions."),
+            BaseMessage(content=history_text, type="human")
+        ]
+
+        print("--- Summarizing Conversation History ---")
+        with span("summarization", messages=len(messages)):
+            result = await self.model_to_wrap.ainvoke(summary_prompt)
         return result.content
 
     @property
@@ -14,15 +14,70 @@
 #     print(f"Total characters: {len(docs[0].page_content)}")
 
 import os
-from langchain_community.document_loaders import PyPDFDirectoryLoader
+import json
+import hashlib
+from langchain_community.document_loaders import PyPDFLoader
+from langchain_core.documents import Document
 
 # Get absolute path to the data folder
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(os.path.dirname(CURRENT_DIR), "data")
+# Parsed page text, keyed by PDF content hash, so unchanged files are never re-parsed
+PARSED_CACHE_DIR = os.path.join(os.path.dirname(CURRENT_DIR), "parsed_pages")
 
-loader = PyPDFDirectoryLoader(DATA_DIR)
-docs = loader.load()
+_docs = None
+
+def list_pdfs() -> list[str]:
+    """Absolute paths of the PDFs in DATA_DIR, in a stable order."""
+    if not os.path.isdir(DATA_DIR):
+        return []
+    return sorted(
+        os.path.join(DATA_DIR, name)
+        for name in os.listdir(DATA_DIR)
+        if name.lower().endswith(".pdf") and not name.startswith(".")
+    )
+
+def file_sha256(path: str) -> str:
+    """SHA-256 of a file's bytes, read in 1 MB blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def parsed_cache_path(file_hash: str) -> str:
+    return os.path.join(PARSED_CACHE_DIR, f"{file_hash}.json")
+
+def load_pdf(path: str, file_hash: str = None) -> list[Document]:
+    """Load one PDF's pages, from the parsed-page cache when the content is unchanged."""
+    file_hash = file_hash or file_sha256(path)
+    cache_path = parsed_cache_path(file_hash)
+    if os.path.exists(cache_path):
+        with open(cache_path, "r", encoding="utf-8") as f:
+            return [Document(page_content=p["content"], metadata=p["metadata"]) for p in json.load(f)]
+
+    pages = PyPDFLoader(path).load()
+    os.makedirs(PARSED_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump([{"content": p.page_content, "metadata": p.metadata} for p in pages], f, default=str)
+    os.replace(tmp_path, cache_path)
+    return pages
+
+def load_docs():
+    """Load every PDF in DATA_DIR (once per process)."""
+    global _docs
+    if _docs is None:
+        _docs = [page for path in list_pdfs() for page in load_pdf(path)]
+    return _docs
+
+def __getattr__(name):
+    # `docs` is resolved lazily so importing this module does not parse the corpus
+    if name == "docs":
+        return load_docs()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 if __name__ == "__main__":
+    docs = load_docs()
     print(f"Pages loaded: {len(docs)}")
     print(f"Total characters: {sum(len(doc.page_content) for doc in docs)}")
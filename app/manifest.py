@@ -0,0 +1,38 @@
+"""
+Ingestion manifest: which PDFs (by content hash) are in the vector store,
+and the stable chunk IDs each one contributed.
+
+Layout of ingest_manifest.json:
+    {"version": 1, "files": {"<file name>": {"sha256": "...", "chunk_ids": [...]}}}
+"""
+import os
+import json
+from langchain_core.documents import Document
+from cache import get_hash
+
+MANIFEST_VERSION = 1
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+MANIFEST_PATH = os.path.join(os.path.dirname(CURRENT_DIR), "ingest_manifest.json")
+
+def load_manifest(path: str = MANIFEST_PATH) -> dict:
+    """Load the manifest, or return an empty one if missing or from another version."""
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") == MANIFEST_VERSION:
+            return manifest
+        print("--- Ingestion manifest version changed, starting fresh ---")
+    return {"version": MANIFEST_VERSION, "files": {}}
+
+def save_manifest(manifest: dict, path: str = MANIFEST_PATH):
+    """Atomically write the manifest."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+def chunk_id(file_name: str, chunk: Document) -> str:
+    """Stable ID for a chunk: same file, position and text always map to the same ID."""
+    meta = chunk.metadata
+    return get_hash(f"{file_name}:{meta.get('page', 0)}:{meta.get('start_index', 0)}:{chunk.page_content}")
@@ -1,8 +1,92 @@
+import os
 import json
-from typing import List, Dict, Optional
-from cache import redis_client, get_hash
+import uuid
+from typing import List, Dict, Optional, Tuple
+from cache import redis_client, async_redis_client, get_hash
+from redis_backend import local_script
+from singleflight import UNLOCK_SCRIPT
+from context_packer import count_tokens
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
 
+MEMORY_TTL = 86400
+# Hard cap on stored messages per session; summarization normally clears history long before this
+MAX_HISTORY_MESSAGES = int(os.getenv("CHAT_HISTORY_MAX_MESSAGES", 100))
+
+# Append messages and cap the list, keeping the token counter equal to the tokens
+# of the messages actually stored (each message carries its own count).
+# KEYS: history, tokens. ARGV: max messages, ttl, tokens added, messages...
+APPEND_SCRIPT = """
+local length = redis.call('RPUSH', KEYS[1], unpack(ARGV, 4))
+local total = redis.call('INCRBY', KEYS[2], ARGV[3])
+local excess = length - tonumber(ARGV[1])
+if excess > 0 then
+    for _, raw in ipairs(redis.call('LRANGE', KEYS[1], 0, excess - 1)) do
+        total = total - (tonumber(cjson.decode(raw)['tokens']) or 0)
+    end
+    redis.call('LTRIM', KEYS[1], excess, -1)
+    total = math.max(total, 0)
+    redis.call('SET', KEYS[2], total)
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+return total
+"""
+
+@local_script(APPEND_SCRIPT)
+def _append_local(backend, keys, args):
+    history_key, tokens_key = keys
+    max_messages, ttl, tokens, *messages = args
+    length = backend.rpush(history_key, *messages)
+    total = backend.incrby(tokens_key, int(tokens))
+    excess = length - int(max_messages)
+    if excess > 0:
+        total -= sum(int(json.loads(raw).get("tokens", 0)) for raw in backend.lrange(history_key, 0, excess - 1))
+        backend.ltrim(history_key, excess, -1)
+        total = max(total, 0)
+        backend.set(tokens_key, total)
+    backend.expire(history_key, int(ttl))
+    backend.expire(tokens_key, int(ttl))
+    return total
+
+# Swap a summary in for the messages it covers, removing them by identity (each
+# stored message has a unique id), so appends, cap trims or another summary
+# landing meanwhile cannot shift which messages are dropped. Returns the number
+# of messages removed; 0 means they were all gone and the summary is discarded.
+# KEYS: history, tokens, summary. ARGV: ttl, summary, summarized messages...
+APPLY_SUMMARY_SCRIPT = """
+local removed, tokens = 0, 0
+for i = 3, #ARGV do
+    if redis.call('LREM', KEYS[1], 1, ARGV[i]) > 0 then
+        removed = removed + 1
+        tokens = tokens + (tonumber(cjson.decode(ARGV[i])['tokens']) or 0)
+    end
+end
+if removed == 0 then
+    return 0
+end
+redis.call('SET', KEYS[3], ARGV[2], 'EX', ARGV[1])
+if redis.call('DECRBY', KEYS[2], tokens) < 0 then
+    redis.call('SET', KEYS[2], 0, 'EX', ARGV[1])
+end
+return removed
+"""
+
+@local_script(APPLY_SUMMARY_SCRIPT)
+def _apply_summary_local(backend, keys, args):
+    history_key, tokens_key, summary_key = keys
+    ttl, summary, *messages = args
+    removed = tokens = 0
+    for raw in messages:
+        if backend.lrem(history_key, 1, raw):
+            removed += 1
+            tokens += int(json.loads(raw).get("tokens", 0))
+    if not removed:
+        return 0
+    backend.set(summary_key, summary, ex=int(ttl))
+    if backend.incrby(tokens_key, -tokens) < 0:
+        backend.set(tokens_key, 0, ex=int(ttl))
+    return removed
+
 class ChatMemoryManager:
     """
     Manages chat history and summaries using Redis for persistence.
@@ -14,9 +98,19 @@ class ChatMemoryManager:
         self.token_threshold = token_threshold
         self.history_key = f"chat_history:{session_id}"
         self.summary_key = f"chat_summary:{session_id}"
+        # Running token estimate of the stored history, kept next to the list
+        self.tokens_key = f"chat_tokens:{session_id}"
+        self.lock_key = f"chat_summary_lock:{session_id}"
 
     def _serialize_message(self, message: BaseMessage) -> Dict:
-        return {"type": message.type, "content": message.content}
+        # Token count travels with the message so trimming can keep the counter exact;
+        # the id makes every stored entry unique, so a summary can remove exactly what it covers
+        return {
+            "type": message.type,
+            "content": message.content,
+            "tokens": self.estimate_tokens([message]),
+            "id": uuid.uuid4().hex[:16],
+        }
 
     def _deserialize_message(self, data: Dict) -> BaseMessage:
         if data["type"] == "human":
@@ -32,10 +126,15 @@ class ChatMemoryManager:
         if not redis_client:
             return
         
-        serialized = json.dumps(self._serialize_message(message))
-        redis_client.rpush(self.history_key, serialized)
-        # Set expiry for cleanup (e.g., 24 hours)
-        redis_client.expire(self.history_key, 86400)
+        # One script: append, bump the token counter, cap the list, refresh expiry (24 hours)
+        self._queue_append(redis_client.pipeline(transaction=True), [message]).execute()
+
+    def add_message_and_get_context(self, message: BaseMessage) -> Tuple[List[BaseMessage], Optional[str], bool]:
+        """add_message followed by get_context, in one MULTI (a single round trip)."""
+        if not redis_client:
+            return [], None, False
+        pipe = self._queue_context(self._queue_append(redis_client.pipeline(transaction=True), [message]))
+        return self._parse_context(pipe.execute()[1:])
 
     def get_history(self) -> List[BaseMessage]:
         """Retrieve all messages for the session."""
@@ -45,6 +144,12 @@ class ChatMemoryManager:
         raw_history = redis_client.lrange(self.history_key, 0, -1)
         return [self._deserialize_message(json.loads(m)) for m in raw_history]
 
+    def get_history_entries(self) -> List[Tuple[str, BaseMessage]]:
+        """All messages with their stored form (pass the stored forms to apply_summary)."""
+        if not redis_client:
+            return []
+        return [(raw, self._deserialize_message(json.loads(raw))) for raw in redis_client.lrange(self.history_key, 0, -1)]
+
     def get_windowed_history(self) -> List[BaseMessage]:
         """Retrieve the last N turns (window_size) of chat history."""
         if not redis_client:
@@ -59,7 +164,7 @@ class ChatMemoryManager:
         """Store the conversation summary."""
         if not redis_client:
             return
-        redis_client.set(self.summary_key, summary, ex=86400)
+        redis_client.set(self.summary_key, summary, ex=MEMORY_TTL)
 
     def get_summary(self) -> Optional[str]:
         """Retrieve the conversation summary."""
@@ -70,15 +175,87 @@ class ChatMemoryManager:
     def clear_history(self):
         """Clear the history (usually called after summarization)."""
         if redis_client:
-            redis_client.delete(self.history_key)
+            redis_client.delete(self.history_key, self.tokens_key)
 
     def estimate_tokens(self, messages: List[BaseMessage]) -> int:
-        """Rough estimation of tokens in the messages."""
-        text = " ".join([m.content for m in messages])
-        # Rough rule of thumb: 1 token ~ 4 characters or 0.75 words
-        return len(text) // 4
+        """Tokens in the messages under the model tokenizer (cached per message text)."""
+        return sum(count_tokens(m.content) for m in messages)
+
+    def _queue_append(self, pipe, messages: List[BaseMessage]):
+        """Queue the append script (RPUSH + token counter + cap + expiry) for `messages` on `pipe`."""
+        serialized = [self._serialize_message(m) for m in messages]
+        pipe.eval(
+            APPEND_SCRIPT, 2, self.history_key, self.tokens_key,
+            MAX_HISTORY_MESSAGES, MEMORY_TTL, sum(m["tokens"] for m in serialized),
+            *[json.dumps(m) for m in serialized],
+        )
+        return pipe
+
+    def _queue_context(self, pipe):
+        # window_size is turns, so we need 2 * window_size messages (Human + AI)
+        pipe.lrange(self.history_key, -self.window_size * 2, -1)
+        pipe.get(self.summary_key)
+        pipe.get(self.tokens_key)
+        return pipe
+
+    def _parse_context(self, results) -> Tuple[List[BaseMessage], Optional[str], bool]:
+        raw_window, summary, tokens = results
+        window = [self._deserialize_message(json.loads(m)) for m in raw_window]
+        return window, summary, int(tokens or 0) > self.token_threshold
 
     def should_summarize(self) -> bool:
-        """Check if history exceeds the token threshold."""
-        history = self.get_history()
-        return self.estimate_tokens(history) > self.token_threshold
+        """Check if history exceeds the token threshold (reads the running counter, O(1))."""
+        if not redis_client:
+            return False
+        return int(redis_client.get(self.tokens_key) or 0) > self.token_threshold
+
+    def get_context(self) -> Tuple[List[BaseMessage], Optional[str], bool]:
+        """Windowed history, summary and the summarization check in a single round trip."""
+        if not redis_client:
+            return [], None, False
+        return self._parse_context(self._queue_context(redis_client.pipeline(transaction=False)).execute())
+
+    def try_lock_summary(self, ttl: int) -> Optional[str]:
+        """
+        Take the per-session summarization lock (SET NX with a TTL so a crashed worker cannot hold it).
+        Returns the job's lock token (pass it to release_summary_lock), or None if the lock is held.
+        """
+        token = uuid.uuid4().hex
+        if not redis_client:
+            return token
+        return token if redis_client.set(self.lock_key, token, nx=True, ex=ttl) else None
+
+    def release_summary_lock(self, token: str):
+        """Release the lock only if `token` still holds it (it may have expired and been taken over)."""
+        if redis_client:
+            redis_client.eval(UNLOCK_SCRIPT, 1, self.lock_key, token)
+
+    def apply_summary(self, summary: str, summarized: List[str]) -> int:
+        """
+        Swap in `summary` for the `summarized` messages (stored forms from get_history_entries).
+        Messages appended while the summary was being generated are kept. Returns how many
+        of the summarized messages were still stored (0: nothing applied).
+        """
+        if not redis_client or not summarized:
+            return 0
+        return int(redis_client.eval(
+            APPLY_SUMMARY_SCRIPT, 3, self.history_key, self.tokens_key, self.summary_key,
+            MEMORY_TTL, summary, *summarized,
+        ))
+
+
+    # --- Async API (used on the FastAPI event loop) ---
+
+    async def aadd_message(self, message: BaseMessage):
+        """Async version of add_message."""
+        if not async_redis_client:
+            return
+
+        await self._queue_append(async_redis_client.pipeline(transaction=True), [message]).execute()
+
+    async def aadd_message_and_get_context(self, message: BaseMessage) -> Tuple[List[BaseMessage], Optional[str], bool]:
+        """Async version of add_message_and_get_context."""
+        if not async_redis_client:
+            return [], None, False
+        pipe = self._queue_context(self._queue_append(async_redis_client.pipeline(transaction=True), [message]))
+        return self._parse_context((await pipe.execute())[1:])
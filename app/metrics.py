@@ -0,0 +1,201 @@
+"""
+In-process metrics registry with a Prometheus text exposition.
+
+Counters, gauges and histograms are kept in memory (per worker process) and
+rendered by `render_metrics()` for the `/metrics` endpoint. Cache tier
+counters and the Redis circuit state are read from `cache` at scrape time.
+"""
+import time
+import threading
+from typing import Callable
+
+# Seconds; covers cache hits (ms) up to slow LLM generations
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _format_labels(labelnames: tuple, key: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(labelnames, key)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: dict = {}
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = [(key, dict(state, counts=list(state["counts"]))) for key, state in self._values.items()]
+        lines = self.header()
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state["counts"]):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {state['count']}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {state['sum']}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {state['count']}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+        self._collectors: list[Callable[[], None]] = []
+
+    def register(self, metric: _Metric):
+        self._metrics.append(metric)
+
+    def add_collector(self, collector: Callable[[], None]):
+        """`collector` refreshes gauges from other modules right before rendering."""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception as e:
+                print(f"Metrics Collector Error: {e}")
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = Counter("rag_http_requests_total", "HTTP requests by endpoint and status.", ("endpoint", "status"))
+HTTP_LATENCY = Histogram("rag_http_request_duration_seconds", "HTTP request latency (until the last body chunk).", ("endpoint",))
+HTTP_IN_FLIGHT = Gauge("rag_http_requests_in_flight", "HTTP requests currently being served.", ("endpoint",))
+STAGE_LATENCY = Histogram("rag_stage_duration_seconds", "Per-stage latency from request trace spans.", ("stage",))
+CACHE_REQUESTS = Counter("rag_cache_requests_total", "Cache lookups by cache layer and result.", ("cache", "result"))
+CACHE_TIER = Gauge("rag_cache_tier_requests", "L1/L2 lookups per cache namespace since start-up.", ("namespace", "tier", "result"))
+CACHE_L1_ENTRIES = Gauge("rag_cache_l1_entries", "Entries currently held in the in-process L1 tier.", ("namespace",))
+LLM_TOKENS = Counter("rag_llm_tokens_total", "LLM tokens reported by the provider.", ("type",))
+PROMPT_TOKENS = Counter("rag_prompt_tokens_total", "Prompt tokens measured by the context packer, by section.", ("section",))
+PROMPT_TOKENIZER_EXACT = Gauge("rag_prompt_tokenizer_exact", "1 if prompt tokens are counted with the model tokenizer, 0 if with the ~4 chars/token estimate.", ("tokenizer",))
+COMPRESSION_SAVED = Counter("rag_compression_tokens_saved_total", "Chunk tokens removed by context compression.")
+SINGLEFLIGHT_COALESCED = Counter("rag_singleflight_coalesced_total", "Cache misses served by another caller's in-flight computation.", ("layer", "scope"))
+REDIS_CIRCUIT_OPEN = Gauge("rag_redis_circuit_open", "1 while the Redis circuit breaker is open.")
+
+def record_cache(cache: str, hit: bool, count: int = 1):
+    if count:
+        CACHE_REQUESTS.inc(count, cache=cache, result="hit" if hit else "miss")
+
+def record_tokens(usage: dict):
+    """Count provider-reported token usage (as returned by get_token_usage_from_metadata)."""
+    LLM_TOKENS.inc(usage.get("input_tokens", 0), type="input")
+    LLM_TOKENS.inc(usage.get("output_tokens", 0), type="output")
+
+def record_context(stats: dict):
+    """Count packed prompt tokens and compression savings for one request."""
+    for section in ("doc_tokens", "history_tokens", "summary_tokens", "fixed_tokens"):
+        PROMPT_TOKENS.inc(stats.get(section, 0), section=section[:-len("_tokens")])
+    COMPRESSION_SAVED.inc(stats.get("compression_tokens_saved", 0))
+
+def _collect_cache_tiers():
+    from cache import get_cache_stats, redis_breaker
+    for namespace, stats in get_cache_stats().items():
+        for tier in ("l1", "l2"):
+            CACHE_TIER.set(stats[f"{tier}_hits"], namespace=namespace, tier=tier, result="hit")
+            CACHE_TIER.set(stats[f"{tier}_misses"], namespace=namespace, tier=tier, result="miss")
+        CACHE_L1_ENTRIES.set(stats["l1_size"], namespace=namespace)
+    REDIS_CIRCUIT_OPEN.set(1 if redis_breaker.is_open else 0)
+
+REGISTRY.add_collector(_collect_cache_tiers)
+
+def render_metrics() -> str:
+    return REGISTRY.render()
+
+class MetricsMiddleware:
+    """
+    ASGI middleware: in-flight gauge, request counter and latency histogram per route.
+    The wrapped app returns only after the last body chunk, so streamed responses are timed in full.
+    """
+    def __init__(self, app):
+        self.app = app
+        self._paths = None
+
+    def _endpoint(self, scope) -> str:
+        # Only known route paths become labels, so label cardinality stays bounded
+        if self._paths is None:
+            self._paths = {getattr(route, "path", None) for route in scope["app"].routes}
+        path = scope.get("path", "")
+        return path if path in self._paths else "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = {"code": 500}
+        endpoint = self._endpoint(scope)
+        HTTP_IN_FLIGHT.inc(endpoint=endpoint)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec(endpoint=endpoint)
+            HTTP_REQUESTS.inc(endpoint=endpoint, status=str(status["code"]))
+            HTTP_LATENCY.observe(time.perf_counter() - start, endpoint=endpoint)
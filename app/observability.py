@@ -1,10 +1,83 @@
 import json
 import time
 import os
+import uuid
+import threading
+from contextlib import contextmanager
 from contextvars import ContextVar
+from typing import Optional
+from langchain_core.callbacks import BaseCallbackHandler
+from metrics import STAGE_LATENCY
 
-# Context variables to store request-scoped metrics
-retrieved_doc_ids_var: ContextVar[list] = ContextVar("retrieved_doc_ids", default=[])
+# Spans kept per request; a runaway loop cannot grow a trace without bound
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", 200))
+
+class Trace:
+    """
+    Request-scoped trace: per-stage spans plus attributes (retrieved doc IDs,
+    prompt token stats). It lives only as long as the request that created it.
+    """
+    def __init__(self):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.start = time.perf_counter()
+        self.spans: list[dict] = []
+        self.attrs: dict = {}
+        self.dropped_spans = 0
+        self._lock = threading.Lock()
+
+    def add_span(self, name: str, duration_ms: float, start_ms: Optional[float] = None, **attrs):
+        span = {
+            "name": name,
+            "start_ms": round(start_ms if start_ms is not None else (time.perf_counter() - self.start) * 1000 - duration_ms, 2),
+            "duration_ms": round(duration_ms, 2),
+        }
+        if attrs:
+            span.update(attrs)
+        STAGE_LATENCY.observe(duration_ms / 1000, stage=name)
+        with self._lock:
+            if len(self.spans) < TRACE_MAX_SPANS:
+                self.spans.append(span)
+            else:
+                self.dropped_spans += 1
+
+# Set per request by the server. Child contexts (agent nodes, asyncio.to_thread) share the
+# same Trace object, so spans and attributes recorded there are visible to the handler.
+current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+
+def start_trace() -> Trace:
+    trace = Trace()
+    current_trace.set(trace)
+    return trace
+
+@contextmanager
+def span(name: str, **attrs):
+    """Time a block as a span of the current trace (no-op outside a traced request).
+    Yields a dict the block can add attributes to."""
+    trace = current_trace.get()
+    start = time.perf_counter()
+    try:
+        yield attrs
+    finally:
+        if trace is not None:
+            trace.add_span(name, (time.perf_counter() - start) * 1000, (start - trace.start) * 1000, **attrs)
+
+def record_span(name: str, duration_ms: float, **attrs):
+    """Record an already measured stage on the current trace."""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add_span(name, duration_ms, **attrs)
+
+def set_trace_attr(key: str, value):
+    trace = current_trace.get()
+    if trace is not None:
+        trace.attrs[key] = value
+
+# Extra consumers of structured events (e.g. the load-test harness); stdout logging is unaffected
+_event_sinks: list = []
+
+def add_event_sink(sink):
+    """Call `sink(log_data)` for every structured event logged in this process."""
+    _event_sinks.append(sink)
 
 def log_event(
     event_type: str,
@@ -13,7 +86,8 @@ def log_event(
     model_id: str,
     retrieved_doc_ids: list = None,
     token_usage: dict = None,
-    error: str = None
+    error: str = None,
+    trace: Optional[Trace] = None
 ):
     """
     Logs a structured event in JSON format to stdout.
@@ -28,10 +102,56 @@ def log_event(
         "token_usage": token_usage or {},
     }
     
+    if trace is not None:
+        log_data["trace_id"] = trace.trace_id
+        log_data["spans"] = trace.spans
+        if not retrieved_doc_ids:
+            log_data["retrieved_doc_ids"] = trace.attrs.get("retrieved_doc_ids", [])
+        if trace.dropped_spans:
+            log_data["dropped_spans"] = trace.dropped_spans
+        # Other request attributes (prompt token stats, time to first token, ...)
+        for key, value in trace.attrs.items():
+            log_data.setdefault(key, value)
     if error:
         log_data["error"] = error
         
     print(json.dumps(log_data))
+    for sink in _event_sinks:
+        sink(log_data)
+
+def get_token_usage(message) -> dict:
+    """
+    Token usage of an AI message: LangChain's standard `usage_metadata` when
+    the provider fills it, else the provider-specific `response_metadata`.
+    """
+    usage_metadata = getattr(message, "usage_metadata", None)
+    if usage_metadata:
+        return {
+            "input_tokens": usage_metadata.get("input_tokens", 0),
+            "output_tokens": usage_metadata.get("output_tokens", 0),
+            "total_tokens": usage_metadata.get("total_tokens", 0),
+        }
+    return get_token_usage_from_metadata(getattr(message, "response_metadata", None) or {})
+
+class TokenUsageCallback(BaseCallbackHandler):
+    """
+    Sums token usage (as get_token_usage reads it) over every LLM call of a run.
+    For runs such as the ReAct AgentExecutor, whose output carries no AI messages.
+    """
+    def __init__(self):
+        self.usage = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+        self._lock = threading.Lock()
+
+    def on_llm_end(self, response, **kwargs):
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                if message is None:
+                    continue
+                usage = get_token_usage(message)
+                with self._lock:
+                    for key in self.usage:
+                        self.usage[key] += usage.get(key, 0)
 
 def get_token_usage_from_metadata(metadata: dict) -> dict:
     """
@@ -0,0 +1,380 @@
+"""
+Resilient Redis access: pooled clients with timeouts, a circuit breaker,
+and a pluggable in-memory fallback backend.
+
+`ResilientRedis` / `AsyncResilientRedis` wrap a redis-py client and expose
+the same methods. While Redis is healthy every call goes to it. After
+REDIS_BREAKER_THRESHOLD consecutive connection errors the breaker opens:
+calls fast-fail straight to the fallback backend (no connect timeouts),
+and a background thread pings Redis every REDIS_BREAKER_COOLDOWN seconds
+until it answers, then closes the breaker again.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+import redis
+
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", 0.5))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", 1.0))
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 50))
+REDIS_BREAKER_THRESHOLD = int(os.getenv("REDIS_BREAKER_THRESHOLD", 3))
+REDIS_BREAKER_COOLDOWN = float(os.getenv("REDIS_BREAKER_COOLDOWN", 5))
+# "memory" keeps caching/memory working locally during an outage, "none" just fast-fails
+REDIS_FALLBACK = os.getenv("REDIS_FALLBACK", "memory").lower()
+FALLBACK_MAX_KEYS = int(os.getenv("FALLBACK_MAX_KEYS", 10000))
+# "memory" replaces Redis entirely with the in-process backend (benchmarks, local runs without Redis)
+REDIS_BACKEND = os.getenv("REDIS_BACKEND", "redis").lower()
+
+# Errors that mean "Redis is unreachable" (command errors such as WRONGTYPE do not trip the breaker)
+CONNECTION_ERRORS = (redis.ConnectionError, redis.TimeoutError, OSError)
+
+# Lua scripts the app sends with EVAL, mapped to their Python equivalents for InMemoryBackend
+LOCAL_SCRIPTS: dict[str, Callable] = {}
+
+def local_script(source: str):
+    """
+    Register the decorated function as InMemoryBackend's implementation of the
+    Lua script `source`. It is called as fn(backend, keys, args) under the
+    backend lock, so it is atomic like EVAL; args may arrive as str or int.
+    """
+    def register(fn):
+        LOCAL_SCRIPTS[source] = fn
+        return fn
+    return register
+
+def pool_kwargs(decode_responses: bool) -> dict:
+    """Connection pool settings shared by every client."""
+    return {
+        "decode_responses": decode_responses,
+        "socket_connect_timeout": REDIS_CONNECT_TIMEOUT,
+        "socket_timeout": REDIS_SOCKET_TIMEOUT,
+        "max_connections": REDIS_MAX_CONNECTIONS,
+        "health_check_interval": 30,
+    }
+
+class CircuitBreaker:
+    def __init__(self, probe: Callable[[], Any], threshold: int = REDIS_BREAKER_THRESHOLD, cooldown: float = REDIS_BREAKER_COOLDOWN):
+        self.probe = probe
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.is_open = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        return not self.is_open
+
+    def record_success(self):
+        self.failures = 0
+
+    def record_failure(self, error: Exception):
+        with self._lock:
+            self.failures += 1
+            if self.is_open or self.failures < self.threshold:
+                return
+            self.is_open = True
+        print(f"--- Redis circuit OPEN after {self.failures} failures ({error}); using fallback ---")
+        threading.Thread(target=self._probe_loop, name="redis-breaker-probe", daemon=True).start()
+
+    def _probe_loop(self):
+        while True:
+            time.sleep(self.cooldown)
+            try:
+                self.probe()
+            except Exception:
+                continue
+            with self._lock:
+                self.failures = 0
+                self.is_open = False
+            print("--- Redis circuit CLOSED, Redis reachable again ---")
+            return
+
+class InMemoryBackend:
+    """
+    Minimal in-process stand-in for the Redis commands this app uses
+    (strings, lists, hashes, expiry, EVAL of registered scripts).
+    Bounded to FALLBACK_MAX_KEYS, oldest first.
+    """
+    def __init__(self, max_keys: int = FALLBACK_MAX_KEYS):
+        self.max_keys = max_keys
+        self._data: OrderedDict = OrderedDict()
+        self._expires: dict = {}
+        self._lock = threading.RLock()
+
+    def _live(self, key):
+        expires = self._expires.get(key)
+        if expires is not None and expires < time.monotonic():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return self._data.get(key)
+
+    def _store(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_keys:
+            old_key, _ = self._data.popitem(last=False)
+            self._expires.pop(old_key, None)
+
+    def ping(self):
+        return True
+
+    def get(self, key):
+        with self._lock:
+            return self._live(key)
+
+    def mget(self, *keys):
+        if len(keys) == 1 and isinstance(keys[0], (list, tuple)):
+            keys = keys[0]
+        with self._lock:
+            return [self._live(key) for key in keys]
+
+    def set(self, key, value, ex=None, nx=False, **kwargs):
+        with self._lock:
+            if nx and self._live(key) is not None:
+                return None
+            self._store(key, value)
+            if ex:
+                self._expires[key] = time.monotonic() + ex
+            else:
+                self._expires.pop(key, None)
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            removed = 0
+            for key in keys:
+                if self._data.pop(key, None) is not None:
+                    removed += 1
+                self._expires.pop(key, None)
+            return removed
+
+    def expire(self, key, seconds):
+        with self._lock:
+            if self._live(key) is None:
+                return False
+            self._expires[key] = time.monotonic() + seconds
+            return True
+
+    def rpush(self, key, *values):
+        with self._lock:
+            items = self._live(key) or []
+            items.extend(values)
+            self._store(key, items)
+            return len(items)
+
+    def lrange(self, key, start, end):
+        # Same index rules as Redis: inclusive end, negatives from the tail, out-of-range clamps to []
+        with self._lock:
+            items = self._live(key) or []
+            size = len(items)
+            start = max(start + size, 0) if start < 0 else start
+            end = min(end + size if end < 0 else end, size - 1)
+            return list(items[start:end + 1]) if start <= end else []
+
+    def ltrim(self, key, start, end):
+        with self._lock:
+            items = self._live(key)
+            if items is not None:
+                kept = self.lrange(key, start, end)
+                if kept:
+                    self._store(key, kept)
+                else:
+                    # Redis deletes a list trimmed to nothing
+                    self.delete(key)
+            return True
+
+    def lrem(self, key, count, value):
+        # count > 0: first `count` matches from the head, < 0: from the tail, 0: all
+        with self._lock:
+            items = self._live(key)
+            if not items:
+                return 0
+            count = int(count)
+            positions = [i for i, item in enumerate(items) if item == value]
+            if count < 0:
+                positions = positions[count:]
+            elif count > 0:
+                positions = positions[:count]
+            for i in reversed(positions):
+                del items[i]
+            if not items:
+                self.delete(key)
+            return len(positions)
+
+    def llen(self, key):
+        with self._lock:
+            return len(self._live(key) or [])
+
+    def incrby(self, key, amount=1):
+        with self._lock:
+            value = int(self._live(key) or 0) + amount
+            self._store(key, value)
+            return value
+
+    def hmget(self, key, keys, *args):
+        fields = list(keys) + list(args) if isinstance(keys, (list, tuple)) else [keys, *args]
+        with self._lock:
+            mapping = self._live(key) or {}
+            return [mapping.get(field) for field in fields]
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        with self._lock:
+            current = dict(self._live(key) or {})
+            if field is not None:
+                current[field] = value
+            if mapping:
+                current.update(mapping)
+            self._store(key, current)
+            return len(mapping or {}) + (field is not None)
+
+    def eval(self, script, numkeys, *keys_and_args):
+        fn = LOCAL_SCRIPTS.get(script)
+        if fn is None:
+            raise redis.ResponseError("Script has no in-memory equivalent (see local_script)")
+        with self._lock:
+            return fn(self, list(keys_and_args[:numkeys]), list(keys_and_args[numkeys:]))
+
+    def publish(self, channel, message):
+        # No other workers to notify when running on the local fallback
+        return 0
+
+    def pipeline(self, transaction=True):
+        return _RecordingPipeline(lambda commands: [getattr(self, name)(*a, **kw) for name, a, kw in commands])
+
+class _RecordingPipeline:
+    """Queues commands and hands them to `run` on execute (sync or async)."""
+    def __init__(self, run):
+        self._run = run
+        self.commands = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+        return queue
+
+    def __len__(self):
+        return len(self.commands)
+
+    def execute(self):
+        commands, self.commands = self.commands, []
+        return self._run(commands)
+
+class AsyncInMemoryBackend:
+    """Coroutine facade over an InMemoryBackend, standing in for a redis.asyncio client."""
+    def __init__(self, backend: InMemoryBackend):
+        self._backend = backend
+
+    def pipeline(self, transaction=True):
+        async def run(commands):
+            return [getattr(self._backend, name)(*a, **kw) for name, a, kw in commands]
+        return _RecordingPipeline(run)
+
+    def __getattr__(self, name):
+        method = getattr(self._backend, name)
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+        return call
+
+class ResilientRedis:
+    """Sync redis-py client behind the circuit breaker, with fallback."""
+    def __init__(self, client, breaker: CircuitBreaker, fallback: Optional[InMemoryBackend]):
+        self._client = client
+        self._breaker = breaker
+        self._fallback = fallback
+
+    def _call(self, name: str, args, kwargs):
+        if self._breaker.allow():
+            try:
+                result = getattr(self._client, name)(*args, **kwargs)
+                self._breaker.record_success()
+                return result
+            except CONNECTION_ERRORS as e:
+                self._breaker.record_failure(e)
+                if self._fallback is None:
+                    raise
+        if self._fallback is None:
+            raise redis.ConnectionError("Redis circuit open")
+        return getattr(self._fallback, name)(*args, **kwargs)
+
+    def _run_pipeline(self, commands, transaction: bool):
+        if self._breaker.allow():
+            try:
+                pipe = self._client.pipeline(transaction=transaction)
+                for name, args, kwargs in commands:
+                    getattr(pipe, name)(*args, **kwargs)
+                result = pipe.execute()
+                self._breaker.record_success()
+                return result
+            except CONNECTION_ERRORS as e:
+                self._breaker.record_failure(e)
+                if self._fallback is None:
+                    raise
+        if self._fallback is None:
+            raise redis.ConnectionError("Redis circuit open")
+        return [getattr(self._fallback, name)(*args, **kwargs) for name, args, kwargs in commands]
+
+    def pipeline(self, transaction: bool = True):
+        return _RecordingPipeline(lambda commands: self._run_pipeline(commands, transaction))
+
+    def pubsub(self, **kwargs):
+        # Pub/sub needs a real connection, there is no fallback for it
+        return self._client.pubsub(**kwargs)
+
+    def register_script(self, script: str):
+        return self._client.register_script(script)
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self._call(name, args, kwargs)
+
+class AsyncResilientRedis:
+    """redis.asyncio client behind the same circuit breaker, with fallback."""
+    def __init__(self, client, breaker: CircuitBreaker, fallback: Optional[InMemoryBackend]):
+        self._client = client
+        self._breaker = breaker
+        self._fallback = fallback
+
+    async def _call(self, name: str, args, kwargs):
+        if self._breaker.allow():
+            try:
+                result = await getattr(self._client, name)(*args, **kwargs)
+                self._breaker.record_success()
+                return result
+            except CONNECTION_ERRORS as e:
+                self._breaker.record_failure(e)
+                if self._fallback is None:
+                    raise
+        if self._fallback is None:
+            raise redis.ConnectionError("Redis circuit open")
+        return getattr(self._fallback, name)(*args, **kwargs)
+
+    async def _run_pipeline(self, commands, transaction: bool):
+        if self._breaker.allow():
+            try:
+                pipe = self._client.pipeline(transaction=transaction)
+                for name, args, kwargs in commands:
+                    getattr(pipe, name)(*args, **kwargs)
+                result = await pipe.execute()
+                self._breaker.record_success()
+                return result
+            except CONNECTION_ERRORS as e:
+                self._breaker.record_failure(e)
+                if self._fallback is None:
+                    raise
+        if self._fallback is None:
+            raise redis.ConnectionError("Redis circuit open")
+        return [getattr(self._fallback, name)(*args, **kwargs) for name, args, kwargs in commands]
+
+    def pipeline(self, transaction: bool = True):
+        return _RecordingPipeline(lambda commands: self._run_pipeline(commands, transaction))
+
+    def register_script(self, script: str):
+        return self._client.register_script(script)
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self._call(name, args, kwargs)
+
+def make_fallback() -> Optional[InMemoryBackend]:
+    return InMemoryBackend() if REDIS_FALLBACK == "memory" else None
@@ -1,136 +1,454 @@
 import os
-from langchain_community.retrievers import BM25Retriever
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from contextlib import ExitStack
+from contextvars import copy_context
 from langchain_core.documents import Document
 from flashrank import Ranker, RerankRequest
 from vectorstore import vector_store
-from loader import docs
-from splitter import text_splitter
-from cache import get_cache, set_cache, get_hash
+from batching import MicroBatcher
+from snapshot import load_or_build_snapshot
+from manifest import chunk_id
+from cache import get_cache, set_cache, aget_cache, aset_cache, get_hash, get_rerank_scores, set_rerank_scores
+from observability import span, record_span
+from metrics import record_cache
+from singleflight import retrieval_flights
 
-# 1. Prepare documents for BM25
-all_splits = text_splitter.split_documents(docs)
-
-# 2. Initialize BM25 Retriever
-bm25_retriever = BM25Retriever.from_documents(all_splits)
+# 1 & 2. Load chunks and the BM25 index from the on-disk snapshot
+# (re-parses the PDFs only when the snapshot is missing or stale)
+all_splits, bm25_retriever = load_or_build_snapshot()
 bm25_retriever.k = 10  # Retrieve more for re-ranking
 
+def chunk_key(doc: Document) -> str:
+    """Stable chunk ID used by the retrieval cache (same scheme as the ingestion manifest)."""
+    return chunk_id(os.path.basename(doc.metadata.get("source", "")), doc)
+
+class ChunkStore:
+    """In-process chunk lookup by ID, so the retrieval cache only needs to store references."""
+    def __init__(self, docs: list[Document]):
+        self._docs = {chunk_key(doc): doc for doc in docs}
+
+    def add(self, doc: Document) -> str:
+        # Vector hits not present in the snapshot (e.g. ingested after start-up)
+        key = chunk_key(doc)
+        self._docs.setdefault(key, doc)
+        return key
+
+    def get(self, key: str):
+        return self._docs.get(key)
+
+    def __len__(self):
+        return len(self._docs)
+
+chunk_store = ChunkStore(all_splits)
+
 # 3. Initialize Chroma Retriever
 chroma_retriever = vector_store.as_retriever(search_kwargs={"k": 5})
 
 # 4. Initialize Flashrank Ranker directly
 ranker = Ranker()
 
+# Fusion of the vector and BM25 legs before reranking:
+#   "rrf"      - reciprocal rank fusion
+#   "weighted" - min-max normalised score merge (VECTOR_WEIGHT vs 1 - VECTOR_WEIGHT)
+#   "union"    - deduplicated union, vector results first (original behaviour)
+FUSION_MODE = os.getenv("RETRIEVAL_FUSION", "rrf")
+RRF_K = int(os.getenv("RRF_K", 60))
+VECTOR_WEIGHT = float(os.getenv("VECTOR_WEIGHT", 0.5))
+# Max fused candidates sent to Flashrank (0 = no limit)
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", 10))
+# Set RERANK=false to return the top fused results without the reranker
+RERANK_ENABLED = os.getenv("RERANK", "true").lower() == "true"
+# Skip the reranker when the top-N of both legs already agree (0 = always rerank)
+RERANK_AGREEMENT_TOP = int(os.getenv("RERANK_AGREEMENT_TOP", 0))
+
+# Runs the vector and BM25 legs side by side on the sync path
+_leg_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="retrieval")
+
+def _score_rerank_groups(ranker, groups: list[tuple[str, list[str]]]) -> list[list[float]]:
+    """
+    Score several (query, passages) groups with Flashrank, one public
+    Ranker.rerank call per group (runs on the rerank micro-batcher's worker).
+    """
+    grouped = []
+    for query, texts in groups:
+        passages = [{"id": i, "text": text} for i, text in enumerate(texts)]
+        scores = [0.0] * len(texts)
+        for rank, res in enumerate(ranker.rerank(RerankRequest(query=query, passages=passages))):
+            # Listwise rankers only return an order, derive a score from the rank
+            scores[res["id"]] = float(res.get("score", 1.0 / (rank + 1)))
+        grouped.append(scores)
+    return grouped
+
+def _timed(timings: dict, name: str, fn, *args):
+    """Call fn(*args), recording its wall time in ms under timings[name]."""
+    start = time.perf_counter()
+    result = fn(*args)
+    timings[name] = (time.perf_counter() - start) * 1000
+    return result
+
+async def _atimed(timings: dict, name: str, coro):
+    start = time.perf_counter()
+    result = await coro
+    timings[name] = (time.perf_counter() - start) * 1000
+    return result
+
 class ManualHybridRetriever:
-    def __init__(self, vector_retriever, bm25_retriever, ranker):
+    def __init__(
+        self,
+        vector_retriever,
+        bm25_retriever,
+        ranker,
+        fusion: str = FUSION_MODE,
+        rrf_k: int = RRF_K,
+        vector_weight: float = VECTOR_WEIGHT,
+        max_candidates: int = RERANK_CANDIDATES,
+        rerank: bool = RERANK_ENABLED,
+        agreement_top: int = RERANK_AGREEMENT_TOP,
+        top_n: int = 3,
+        chunk_store: ChunkStore = chunk_store,
+    ):
         self.vector_retriever = vector_retriever
         self.bm25_retriever = bm25_retriever
         self.ranker = ranker
+        self.fusion = fusion
+        self.rrf_k = rrf_k
+        self.vector_weight = vector_weight
+        self.max_candidates = max_candidates
+        self.rerank = rerank
+        self.agreement_top = agreement_top
+        self.top_n = top_n
+        self.chunk_store = chunk_store
+        # Serialises concurrent rerank calls onto one worker, scoring queued groups back to back
+        self.rerank_batcher = MicroBatcher(
+            lambda groups: _score_rerank_groups(self.ranker, groups),
+            name="rerank-batcher",
+        )
+
+    # --- Retrieval legs: each returns [(Document, score)], best first ---
+
+    def _vector_k(self) -> int:
+        return getattr(self.vector_retriever, "search_kwargs", {}).get("k", 4)
+
+    def _vector_search(self, query: str):
+        vectorstore = getattr(self.vector_retriever, "vectorstore", None)
+        if vectorstore is not None:
+            return vectorstore.similarity_search_with_relevance_scores(query, k=self._vector_k())
+        return self._rank_scored(self.vector_retriever.invoke(query))
+
+    async def _avector_search(self, query: str):
+        vectorstore = getattr(self.vector_retriever, "vectorstore", None)
+        if vectorstore is not None:
+            return await vectorstore.asimilarity_search_with_relevance_scores(query, k=self._vector_k())
+        return self._rank_scored(await self.vector_retriever.ainvoke(query))
+
+    def _bm25_search(self, query: str):
+        if hasattr(self.bm25_retriever, "search"):
+            return [(self.bm25_retriever.docs[i], score) for i, score in self.bm25_retriever.search(query)]
+        return self._rank_scored(self.bm25_retriever.invoke(query))
+
+    def _rank_scored(self, docs):
+        # Retrievers without scores: derive a decreasing score from the rank
+        return [(doc, 1.0 / (rank + 1)) for rank, doc in enumerate(docs)]
+
+    # --- Fusion and reranking ---
+
+    def _fuse(self, v_hits, b_hits):
+        """Merge both legs into one deduplicated candidate list, best first."""
+        docs = {}
+        fused = {}
+
+        if self.fusion == "weighted":
+            for hits, weight in ((v_hits, self.vector_weight), (b_hits, 1 - self.vector_weight)):
+                if not hits:
+                    continue
+                scores = [score for _, score in hits]
+                low, score_range = min(scores), (max(scores) - min(scores)) or 1.0
+                for doc, score in hits:
+                    docs.setdefault(doc.page_content, doc)
+                    fused[doc.page_content] = fused.get(doc.page_content, 0.0) + weight * (score - low) / score_range
+        elif self.fusion == "rrf":
+            for hits in (v_hits, b_hits):
+                for rank, (doc, _) in enumerate(hits):
+                    docs.setdefault(doc.page_content, doc)
+                    fused[doc.page_content] = fused.get(doc.page_content, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+        else:
+            for doc, score in v_hits + b_hits:
+                if doc.page_content not in docs:
+                    docs[doc.page_content] = doc
+                    fused[doc.page_content] = score
+
+        order = sorted(fused, key=fused.get, reverse=True) if self.fusion in ("rrf", "weighted") else list(fused)
+        candidates = [(docs[text], fused[text]) for text in order]
+        if self.max_candidates:
+            candidates = candidates[:self.max_candidates]
+        return candidates
+
+    def _legs_agree(self, v_hits, b_hits) -> bool:
+        """True if both legs return the same top `agreement_top` chunks (in any order)."""
+        n = self.agreement_top
+        if not n or len(v_hits) < n or len(b_hits) < n:
+            return False
+        return {doc.page_content for doc, _ in v_hits[:n]} == {doc.page_content for doc, _ in b_hits[:n]}
+
+    def _rank(self, query: str, candidates, skip_rerank: bool = False):
+        """
+        Rerank the fused candidates (or keep fusion order) and return the top_n
+        as (Document, score) pairs plus (cached, scored) pair counts.
+        Only (query, chunk) pairs missing from the rerank score cache reach Flashrank.
+        """
+        return self._finish_rank(candidates, self._start_rank(query, candidates, skip_rerank))
+
+    def _start_rank(self, query: str, candidates, skip_rerank: bool = False):
+        """First half of _rank: read cached scores and queue the misses on the rerank batcher."""
+        if not self.rerank or skip_rerank:
+            return None
+
+        query_hash = get_hash(query)
+        chunk_hashes = [get_hash(doc.page_content) for doc, _ in candidates]
+        scores = get_rerank_scores(query_hash, chunk_hashes)
+
+        misses = [i for i, score in enumerate(scores) if score is None]
+        future = None
+        if misses:
+            future = self.rerank_batcher.submit_future((query, [candidates[i][0].page_content for i in misses]))
+        return query_hash, chunk_hashes, scores, misses, future
+
+    def _finish_rank(self, candidates, pending):
+        """Second half of _rank: wait for the queued scores and pick the top_n."""
+        if pending is None:
+            return candidates[:self.top_n], (0, 0)
+
+        query_hash, chunk_hashes, scores, misses, future = pending
+        if future is not None:
+            new_scores = {}
+            for i, score in zip(misses, future.result()):
+                scores[i] = score
+                new_scores[chunk_hashes[i]] = score
+            set_rerank_scores(query_hash, new_scores)
+
+        order = sorted(range(len(candidates)), key=lambda i: scores[i], reverse=True)[:self.top_n]
+        top = [(candidates[i][0], scores[i]) for i in order]
+        return top, (len(candidates) - len(misses), len(misses))
+
+    def _report(self, timings: dict, rerank_counts, skipped: int, queries: int = 1):
+        """Print and record stage timings; `skipped` of the `queries` skipped the reranker (legs agree)."""
+        stages = " ".join(f"{name}={ms:.1f}ms" for name, ms in timings.items())
+        cached, scored = rerank_counts
+        record_cache("rerank", True, cached)
+        record_cache("rerank", False, scored)
+        if skipped == queries:
+            note = "skipped (legs agree)"
+        else:
+            note = f"{cached} cached / {scored} scored" + (f", {skipped}/{queries} skipped (legs agree)" if skipped else "")
+        print(f"--- Retrieval timings: {stages} | rerank {note} ---")
+        # Same stages as spans on the request trace
+        for name, ms in timings.items():
+            if name == "rerank":
+                record_span(name, ms, cached=cached, scored=scored, skipped=skipped)
+            else:
+                record_span(name, ms)
+
+    def _retrieve(self, query: str):
+        timings = {}
+        timed = partial(_timed, timings)
+
+        # 1. Get docs from both sources concurrently
+        # copy_context so spans recorded on the pool thread (e.g. embed) reach the request trace
+        v_future = _leg_pool.submit(copy_context().run, timed, "vector", self._vector_search, query)
+        b_hits = timed("bm25", self._bm25_search, query)
+        v_hits = v_future.result()
+        # 2. Fuse, deduplicate and prune
+        candidates = timed("fuse", self._fuse, v_hits, b_hits)
+        # 3. Rerank (unless both legs already agree)
+        skip = self._legs_agree(v_hits, b_hits)
+        results, counts = timed("rerank", self._rank, query, candidates, skip)
+        self._report(timings, counts, int(skip))
+        return results
+
+    async def _aretrieve(self, query: str):
+        timings = {}
+        timed = partial(_timed, timings)
+
+        v_hits, b_hits = await asyncio.gather(
+            _atimed(timings, "vector", self._avector_search(query)),
+            asyncio.to_thread(timed, "bm25", self._bm25_search, query),
+        )
+        candidates = timed("fuse", self._fuse, v_hits, b_hits)
+        skip = self._legs_agree(v_hits, b_hits)
+        # Flashrank is synchronous and CPU-bound
+        results, counts = await asyncio.to_thread(timed, "rerank", self._rank, query, candidates, skip)
+        self._report(timings, counts, int(skip))
+        return results
+
+    # --- Batch retrieval ---
+
+    def _vector_search_many(self, queries: list[str]):
+        """
+        Vector leg for many queries: one embedding call for the whole batch, then
+        the public per-query search on the leg pool (its embed_query hits the cache).
+        """
+        vectorstore = getattr(self.vector_retriever, "vectorstore", None)
+        embeddings = getattr(vectorstore, "embeddings", None)
+        if embeddings is not None:
+            with span("embed", batch=len(queries)):
+                # Cached embed_documents: one forward pass for all embedding cache misses
+                embeddings.embed_documents(queries)
+        futures = [_leg_pool.submit(copy_context().run, self._vector_search, query) for query in queries]
+        return [future.result() for future in futures]
+
+    def _bm25_search_many(self, queries: list[str]):
+        return [self._bm25_search(query) for query in queries]
+
+    def _retrieve_many(self, queries: list[str]):
+        """_retrieve for a batch: legs run once for all queries, rerank groups queue on the micro-batcher together."""
+        timings = {}
+        timed = partial(_timed, timings)
+
+        # The vector leg fans out on the leg pool itself, so here BM25 takes the pool thread
+        b_future = _leg_pool.submit(copy_context().run, timed, "bm25", self._bm25_search_many, queries)
+        v_hits = timed("vector", self._vector_search_many, queries)
+        b_hits = b_future.result()
+        candidates = timed("fuse", lambda: [self._fuse(v, b) for v, b in zip(v_hits, b_hits)])
+        skips = [self._legs_agree(v, b) for v, b in zip(v_hits, b_hits)]
+
+        def rank_all():
+            # Queue every group first so the micro-batcher picks them up in one batch
+            pending = [self._start_rank(query, cands, skip) for query, cands, skip in zip(queries, candidates, skips)]
+            return [self._finish_rank(cands, p) for cands, p in zip(candidates, pending)]
+
+        ranked = timed("rerank", rank_all)
+        counts = (sum(c for _, (c, _) in ranked), sum(s for _, (_, s) in ranked))
+        self._report(timings, counts, sum(skips), len(queries))
+        return [top for top, _ in ranked]
+
+    def _doc_id(self, meta: dict) -> str:
+        # Extract a unique ID from metadata if possible, else use source + page
+        doc_id = meta.get("source", "unknown")
+        if "page" in meta:
+            doc_id += f":page_{meta['page']}"
+        return doc_id
+
+    # --- Public API ---
+    # All four entry points share one cache entry per query: `retrieval_ref:<query hash>`
+    # holding [{"id": chunk ID, "score": ...}], resolved against `self.chunk_store`.
+
+    def _cache_key(self, query: str) -> str:
+        return f"retrieval_ref:{get_hash(query)}"
+
+    def _resolve(self, cached_refs):
+        """Resolve cached chunk references; None if any chunk is unknown (treated as a miss)."""
+        if not cached_refs:
+            return None
+        docs = [self.chunk_store.get(ref["id"]) for ref in cached_refs]
+        if any(doc is None for doc in docs):
+            return None
+        return docs
+
+    def _lookup(self, cache_key: str):
+        """Cache re-read used by the single-flight while another worker retrieves the query."""
+        return self._resolve(get_cache(cache_key))
+
+    def _store_refs(self, results):
+        docs = [doc for doc, _ in results]
+        refs = [{"id": self.chunk_store.add(doc), "score": float(score)} for doc, score in results]
+        return docs, refs
+
+    def invoke_with_metadata(self, query: str):
+        cache_key = self._cache_key(query)
+        with span("retrieval_cache") as attrs:
+            docs = self._resolve(get_cache(cache_key))
+            attrs["hit"] = docs is not None
+        if docs is not None:
+            print(f"--- Retrieval Cache HIT ---")
+            record_cache("retrieval", True)
+            return docs, [self._doc_id(doc.metadata) for doc in docs]
+
+        print(f"--- Retrieval Cache MISS ---")
+        record_cache("retrieval", False)
+        # Identical concurrent misses (here or on other workers) run the retrieval once
+        with retrieval_flights.lead(cache_key, partial(self._lookup, cache_key)) as flight:
+            if not flight.shared:
+                flight.value, refs = self._store_refs(self._retrieve(query))
+                set_cache(cache_key, refs)
+        docs = flight.value
+        return docs, [self._doc_id(doc.metadata) for doc in docs]
 
     def invoke(self, query: str):
-        # Check cache
-        cache_key = f"retrieval:{get_hash(query)}"
-        cached_data = get_cache(cache_key)
-        if cached_data:
+        return self.invoke_with_metadata(query)[0]
+
+    async def ainvoke_with_metadata(self, query: str):
+        """Async version of invoke_with_metadata; shares the same cache entries."""
+        cache_key = self._cache_key(query)
+        with span("retrieval_cache") as attrs:
+            docs = self._resolve(await aget_cache(cache_key))
+            attrs["hit"] = docs is not None
+        if docs is not None:
             print(f"--- Retrieval Cache HIT ---")
-            return [Document(page_content=d["content"], metadata=d["metadata"]) for d in cached_data]
+            record_cache("retrieval", True)
+            return docs, [self._doc_id(doc.metadata) for doc in docs]
 
         print(f"--- Retrieval Cache MISS ---")
-        # 1. Get docs from both sources
-        v_docs = self.vector_retriever.invoke(query)
-        b_docs = self.bm25_retriever.invoke(query)
-        
-        # 2. Combine and deduplicate
-        combined_docs = []
-        seen_texts = set()
-        
-        for doc in v_docs + b_docs:
-            if doc.page_content not in seen_texts:
-                combined_docs.append(doc)
-                seen_texts.add(doc.page_content)
-        
-        # 3. Prepare for re-ranking
-        passages = []
-        for i, doc in enumerate(combined_docs):
-            passages.append({
-                "id": i,
-                "text": doc.page_content,
-                "meta": doc.metadata
-            })
-            
-        rerank_request = RerankRequest(query=query, passages=passages)
-        
-        # 4. Rerank
-        results = self.ranker.rerank(rerank_request)
-        
-        # 5. Convert back to LangChain Documents (top 3)
-        final_docs = []
-        cache_data = []
-        for res in results[:3]:
-            # The result from flashrank contains the originalpassage info
-            doc = Document(
-                page_content=res["text"],
-                metadata=res["meta"]
-            )
-            final_docs.append(doc)
-            cache_data.append({"content": doc.page_content, "metadata": doc.metadata})
-            
-        # Store in cache
-        set_cache(cache_key, cache_data)
-        return final_docs
+        record_cache("retrieval", False)
 
-    def invoke_with_metadata(self, query: str):
-        # Check cache
-        cache_key = f"retrieval_meta:{get_hash(query)}"
-        cached_data = get_cache(cache_key)
-        if cached_data:
-            print(f"--- Retrieval (Meta) Cache HIT ---")
-            docs = [Document(page_content=d["content"], metadata=d["metadata"]) for d in cached_data["docs"]]
-            return docs, cached_data["ids"]
-
-        print(f"--- Retrieval (Meta) Cache MISS ---")
-        v_docs = self.vector_retriever.invoke(query)
-        b_docs = self.bm25_retriever.invoke(query)
-        
-        combined_docs = []
-        seen_texts = set()
-        
-        for doc in v_docs + b_docs:
-            if doc.page_content not in seen_texts:
-                combined_docs.append(doc)
-                seen_texts.add(doc.page_content)
-        
-        passages = []
-        for i, doc in enumerate(combined_docs):
-            passages.append({
-                "id": i,
-                "text": doc.page_content,
-                "meta": doc.metadata
-            })
-            
-        rerank_request = RerankRequest(query=query, passages=passages)
-        results = self.ranker.rerank(rerank_request)
-        
-        final_docs = []
-        doc_ids = []
-        cache_docs = []
-        for res in results[:3]:
-            # Extract a unique ID from metadata if possible, else use source + page
-            meta = res["meta"]
-            doc_id = meta.get("source", "unknown")
-            if "page" in meta:
-                doc_id += f":page_{meta['page']}"
-            doc_ids.append(doc_id)
-
-            doc = Document(
-                page_content=res["text"],
-                metadata=meta
-            )
-            final_docs.append(doc)
-            cache_docs.append({"content": doc.page_content, "metadata": doc.metadata})
-            
-        # Store in cache
-        set_cache(cache_key, {"docs": cache_docs, "ids": doc_ids})
-        return final_docs, doc_ids
+        async def lookup():
+            return self._resolve(await aget_cache(cache_key))
+
+        async with retrieval_flights.alead(cache_key, lookup) as flight:
+            if not flight.shared:
+                flight.value, refs = self._store_refs(await self._aretrieve(query))
+                await aset_cache(cache_key, refs)
+        docs = flight.value
+        return docs, [self._doc_id(doc.metadata) for doc in docs]
+
+    async def ainvoke(self, query: str):
+        """Async version of invoke; shares the same cache entries."""
+        return (await self.ainvoke_with_metadata(query))[0]
+
+    def batch_invoke_with_metadata(self, queries: list[str]):
+        """
+        invoke_with_metadata for many queries at once, in input order.
+        Cache misses are retrieved together (one embedding call, concurrent Chroma
+        searches, reranks queued together); duplicate queries in the batch are retrieved once,
+        and queries already in flight (single requests or other batches) are not retrieved again.
+        """
+        results = [self._resolve(get_cache(self._cache_key(query))) for query in queries]
+        missing = list(dict.fromkeys(query for query, docs in zip(queries, results) if docs is None))
+        misses = sum(docs is None for docs in results)
+        record_cache("retrieval", True, len(queries) - misses)
+        record_cache("retrieval", False, misses)
+
+        if missing:
+            print(f"--- Retrieval Cache: {len(missing)} batch MISS ---")
+            retrieved = self._retrieve_flights(missing)
+            results = [docs if docs is not None else retrieved[query] for query, docs in zip(queries, results)]
+
+        return [(docs, [self._doc_id(doc.metadata) for doc in docs]) for docs in results]
+
+    def _retrieve_flights(self, queries: list[str]) -> dict:
+        """
+        Retrieve distinct cache misses through the same single-flight as invoke_with_metadata.
+        Queries another caller is already retrieving wait for its result; the ones this batch
+        leads are retrieved together. Flights are entered in key order, so batches with
+        overlapping queries cannot wait on each other in a cycle.
+        """
+        keys = {query: self._cache_key(query) for query in queries}
+        flights = {}
+        with ExitStack() as stack:
+            for query in sorted(queries, key=keys.get):
+                flights[query] = stack.enter_context(retrieval_flights.lead(keys[query], partial(self._lookup, keys[query])))
+            led = [query for query in queries if not flights[query].shared]
+            if led:
+                for query, hits in zip(led, self._retrieve_many(led)):
+                    flights[query].value, refs = self._store_refs(hits)
+                    set_cache(keys[query], refs)
+        return {query: flight.value for query, flight in flights.items()}
+
+    async def abatch_invoke_with_metadata(self, queries: list[str]):
+        """Async version of batch_invoke_with_metadata (runs off the event loop)."""
+        return await asyncio.to_thread(self.batch_invoke_with_metadata, queries)
 
 # Instantiate the final retriever
 final_retriever = ManualHybridRetriever(chroma_retriever, bm25_retriever, ranker)
@@ -0,0 +1,124 @@
+"""
+Semantic (near-duplicate) response cache.
+
+Sits next to the exact-match response cache in cache.py: query embeddings
+are kept in a small in-process NumPy index per namespace, and a lookup
+returns the cached answer of the most similar earlier query if its cosine
+similarity clears SEMANTIC_CACHE_THRESHOLD. Entries are scoped by corpus
+version, so answers never outlive the documents they were grounded on.
+"""
+import os
+import time
+import threading
+from typing import Optional
+import numpy as np
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE", "false").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.92))
+SEMANTIC_CACHE_CAPACITY = int(os.getenv("SEMANTIC_CACHE_CAPACITY", 1000))
+SEMANTIC_CACHE_TTL = int(os.getenv("SEMANTIC_CACHE_TTL", 3600))
+
+class SemanticIndex:
+    """Fixed-capacity ring buffer of unit-normalised query vectors and their answers."""
+    def __init__(self, dim: int, capacity: int = SEMANTIC_CACHE_CAPACITY, ttl: int = SEMANTIC_CACHE_TTL):
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.expires = np.zeros(capacity, dtype=np.float64)
+        self.answers: list[Optional[str]] = [None] * capacity
+        self.capacity = capacity
+        self.ttl = ttl
+        self.next_slot = 0
+        self.lock = threading.Lock()
+
+    def search(self, vector: np.ndarray, threshold: float) -> Optional[tuple[str, float]]:
+        with self.lock:
+            # Expired and empty slots have expires <= now and are masked out
+            live = self.expires > time.time()
+            if not live.any():
+                return None
+            sims = np.where(live, self.vectors @ vector, -1.0)
+            best = int(np.argmax(sims))
+            if sims[best] >= threshold:
+                return self.answers[best], float(sims[best])
+        return None
+
+    def add(self, vector: np.ndarray, answer: str):
+        with self.lock:
+            # Oldest entry is overwritten once the buffer is full
+            slot = self.next_slot
+            self.vectors[slot] = vector
+            self.answers[slot] = answer
+            self.expires[slot] = time.time() + self.ttl
+            self.next_slot = (slot + 1) % self.capacity
+
+_indexes: dict[tuple[str, str], SemanticIndex] = {}
+_indexes_lock = threading.Lock()
+_corpus_version: Optional[str] = None
+
+def get_corpus_version() -> str:
+    """Corpus version this process is serving (computed once, like the loaded snapshot)."""
+    global _corpus_version
+    if _corpus_version is None:
+        from snapshot import corpus_version
+        _corpus_version = corpus_version()
+    return _corpus_version
+
+def _get_index(namespace: str, dim: int) -> SemanticIndex:
+    key = (namespace, get_corpus_version())
+    with _indexes_lock:
+        if key not in _indexes:
+            # Drop indexes of other corpus versions for this namespace
+            for stale in [k for k in _indexes if k[0] == namespace]:
+                del _indexes[stale]
+            _indexes[key] = SemanticIndex(dim)
+        return _indexes[key]
+
+def _normalize(vector) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+def lookup_semantic_cache(namespace: str, vector) -> Optional[str]:
+    """Cached answer for a query embedding within `namespace`, or None."""
+    if not SEMANTIC_CACHE_ENABLED:
+        return None
+    vector = _normalize(vector)
+    hit = _get_index(namespace, len(vector)).search(vector, SEMANTIC_CACHE_THRESHOLD)
+    if hit:
+        answer, similarity = hit
+        print(f"--- Semantic Cache HIT ({namespace}, similarity={similarity:.3f}) ---")
+        return answer
+    return None
+
+def store_semantic_cache(namespace: str, vector, answer: str):
+    """Remember `answer` for a query embedding within `namespace`."""
+    if not SEMANTIC_CACHE_ENABLED or not answer:
+        return
+    vector = _normalize(vector)
+    _get_index(namespace, len(vector)).add(vector, answer)
+
+def get_semantic_cache(namespace: str, query: str) -> Optional[str]:
+    """Embed `query` (through the embedding cache) and look it up."""
+    if not SEMANTIC_CACHE_ENABLED:
+        return None
+    from embeddings import embeddings
+    return lookup_semantic_cache(namespace, embeddings.embed_query(query))
+
+def set_semantic_cache(namespace: str, query: str, answer: str):
+    if not SEMANTIC_CACHE_ENABLED:
+        return
+    from embeddings import embeddings
+    store_semantic_cache(namespace, embeddings.embed_query(query), answer)
+
+async def aget_semantic_cache(namespace: str, query: str) -> Optional[str]:
+    """Async version of get_semantic_cache."""
+    if not SEMANTIC_CACHE_ENABLED:
+        return None
+    from embeddings import embeddings
+    return lookup_semantic_cache(namespace, await embeddings.aembed_query(query))
+
+async def aset_semantic_cache(namespace: str, query: str, answer: str):
+    """Async version of set_semantic_cache."""
+    if not SEMANTIC_CACHE_ENABLED:
+        return
+    from embeddings import embeddings
+    store_semantic_cache(namespace, await embeddings.aembed_query(query), answer)
@@ -1,10 +1,10 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
 import os
 import sys
-from typing import Optional
+from typing import List, Optional
 
 # Add 'app' directory to sys.path to allow standalone imports (like 'import llm')
 # regardless of where the server is started from.
@@ -13,14 +13,29 @@ if app_dir not in sys.path:
     sys.path.insert(0, app_dir)
 
 from main import agent_executor
-from chain import agent as chain_agent, CORRELATION_MAP
-from langchain_core.messages import HumanMessage
-from observability import log_event, get_token_usage_from_metadata, retrieved_doc_ids_var
-from cache import get_llm_cache, set_llm_cache, get_hash
+from chain import async_agent as chain_agent
+from langchain_core.messages import HumanMessage, AIMessageChunk
+from observability import log_event, get_token_usage, TokenUsageCallback, start_trace, span
+from metrics import MetricsMiddleware, render_metrics, record_cache, record_tokens
+from cache import aget_llm_cache, aset_llm_cache, get_hash
+from semantic_cache import aget_semantic_cache, aset_semantic_cache
+from singleflight import response_flights
+from batch import abatch_answer, BATCH_MAX_QUERIES, BATCH_LLM_CONCURRENCY
+from context_packer import get_tokenizer
+from functools import partial
+from contextlib import asynccontextmanager
+import asyncio
 import time
 import json
 
-app = FastAPI(title="LangChain RAG API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The first load may download the tokenizer; do it before serving, off the event loop.
+    # Reports the token counting mode (model tokenizer or estimate), also on /metrics
+    await asyncio.to_thread(get_tokenizer)
+    yield
+
+app = FastAPI(title="LangChain RAG API", lifespan=lifespan)
 
 # Enable CORS for frontend
 app.add_middleware(
@@ -29,6 +44,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
 
 class ChatRequest(BaseModel):
     query: str
@@ -37,6 +53,7 @@ class ChatRequest(BaseModel):
 @app.post("/chat/agent")
 async def chat_agent(request: ChatRequest):
     start_time = time.time()
+    trace = start_trace()
     try:
         # LLM Cache Check
         # For AgentExecutor, we don't have the "full_prompt" until it runs,
@@ -44,10 +61,11 @@ async def chat_agent(request: ChatRequest):
         # Alternative: The user asked to hash the full prompt.
         # Since AgentExecutor is a black box here, we can only easily cache based on input.
         cache_key = f"agent_response:{get_hash(request.query)}"
-        cached_res = get_llm_cache(cache_key)
+        cached_res = await aget_llm_cache(cache_key)
         if cached_res:
             latency = time.time() - start_time
             print(f"--- LLM Response Cache HIT (Agent) ---")
+            record_cache("response", True)
             log_event(
                 event_type="agent_cache_hit",
                 query=request.query,
@@ -56,36 +74,63 @@ async def chat_agent(request: ChatRequest):
             )
             return {"response": cached_res, "cached": True}
 
+        record_cache("response", False)
+        semantic_res = await aget_semantic_cache("agent", request.query)
+        record_cache("semantic", bool(semantic_res))
+        if semantic_res:
+            log_event(
+                event_type="agent_semantic_cache_hit",
+                query=request.query,
+                latency=time.time() - start_time,
+                model_id="semantic_cache_agent"
+            )
+            return {"response": semantic_res, "cached": True, "semantic": True}
+
         print(f"--- LLM Response Cache MISS (Agent) ---")
-        response = agent_executor.invoke({"input": request.query})
+        # Identical in-flight questions (this worker or others) share one agent run
+        async with response_flights.alead(cache_key, partial(aget_llm_cache, cache_key)) as flight:
+            if not flight.shared:
+                # The executor returns only the final text; usage is collected from each LLM call
+                usage_callback = TokenUsageCallback()
+                response = await agent_executor.ainvoke({"input": request.query}, config={"callbacks": [usage_callback]})
+                flight.value = response.get("output", "No response generated.")
+                await aset_llm_cache(cache_key, flight.value)
+                await aset_semantic_cache("agent", request.query, flight.value)
         latency = time.time() - start_time
+
+        output = flight.value
+        if flight.shared:
+            log_event(
+                event_type="agent_coalesced",
+                query=request.query,
+                latency=latency,
+                model_id="singleflight_agent",
+                trace=trace
+            )
+            return {"response": output, "cached": True, "coalesced": True}
         
-        output = response.get("output", "No response generated.")
-        set_llm_cache(cache_key, output)
-        
-        # ... existing logging code ...
-        metadata = response.get("response_metadata", {})
-        token_usage = get_token_usage_from_metadata(metadata)
-        retrieved_doc_ids = retrieved_doc_ids_var.get()
+        token_usage = usage_callback.usage
+        record_tokens(token_usage)
 
         log_event(
             event_type="agent_request",
             query=request.query,
             latency=latency,
             model_id="agent_executor",
-            retrieved_doc_ids=retrieved_doc_ids,
-            token_usage=token_usage
+            token_usage=token_usage,
+            trace=trace
         )
         
         return {"response": output}
     except Exception as e:
         latency = time.time() - start_time
-        log_event(event_type="agent_error", query=request.query, latency=latency, model_id="unknown", error=str(e))
+        log_event(event_type="agent_error", query=request.query, latency=latency, model_id="unknown", error=str(e), trace=trace)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/chat/chain")
 async def chat_chain(request: ChatRequest):
     start_time = time.time()
+    trace = start_trace()
     try:
         inputs = {
             "messages": [HumanMessage(content=request.query)],
@@ -101,10 +146,11 @@ async def chat_chain(request: ChatRequest):
         # To follow the prompt hashing requirement strictly, we should hash the "messages" if possible.
         # But since the middleware forms the prompt, the "input" to the chain is just the query.
         prompt_hash_key = f"chain_response:{get_hash(request.query)}"
-        cached_res = get_llm_cache(prompt_hash_key)
+        cached_res = await aget_llm_cache(prompt_hash_key)
         if cached_res:
              latency = time.time() - start_time
              print(f"--- LLM Response Cache HIT (Chain) ---")
+             record_cache("response", True)
              log_event(
                  event_type="chain_cache_hit",
                  query=request.query,
@@ -113,52 +159,221 @@ async def chat_chain(request: ChatRequest):
              )
              return {"response": cached_res, "cached": True}
 
+        record_cache("response", False)
+        semantic_res = await aget_semantic_cache("chain", request.query)
+        record_cache("semantic", bool(semantic_res))
+        if semantic_res:
+            log_event(
+                event_type="chain_semantic_cache_hit",
+                query=request.query,
+                latency=time.time() - start_time,
+                model_id="semantic_cache_chain"
+            )
+            return {"response": semantic_res, "cached": True, "semantic": True}
+
         print(f"--- LLM Response Cache MISS (Chain) ---")
-        response = chain_agent.invoke(inputs)
+        # Identical in-flight questions (this worker or others) share one chain run
+        async with response_flights.alead(prompt_hash_key, partial(aget_llm_cache, prompt_hash_key)) as flight:
+            if not flight.shared:
+                response = await chain_agent.ainvoke(inputs)
+
+                # Extract content
+                if "messages" in response:
+                    last_message = response["messages"][-1]
+                    flight.value = last_message.content
+
+                await aset_llm_cache(prompt_hash_key, flight.value)
+                await aset_semantic_cache("chain", request.query, flight.value)
         latency = time.time() - start_time
-        
-        # Extract content
-        if "messages" in response:
-            last_message = response["messages"][-1]
-            content = last_message.content
-            metadata = {}
 
-        set_llm_cache(prompt_hash_key, content)
+        content = flight.value
+        if flight.shared:
+            # Like a cache hit: the leader's session got the memory writes
+            log_event(
+                event_type="chain_coalesced",
+                query=request.query,
+                latency=latency,
+                model_id="singleflight_chain",
+                trace=trace
+            )
+            return {"response": content, "cached": True, "coalesced": True}
         
         # PERSIST AI RESPONSE TO MEMORY
         from memory import ChatMemoryManager
         from langchain_core.messages import AIMessage
         memory = ChatMemoryManager(session_id=request.session_id)
-        memory.add_message(AIMessage(content=content))
-        
-        # ... existing logging ...
-        token_usage = get_token_usage_from_metadata(metadata)
+        with span("memory"):
+            await memory.aadd_message(AIMessage(content=content))
         
-        last_msg = inputs["messages"][-1]
-        msg_key = getattr(last_msg, "id", None) or hash(last_msg)
-        retrieved_doc_ids = CORRELATION_MAP.pop(msg_key, [])
-        
-        if not retrieved_doc_ids:
-            retrieved_doc_ids = response.get("retrieved_doc_ids", [])
-            
-        if not retrieved_doc_ids:
-            retrieved_doc_ids = retrieved_doc_ids_var.get()
+        # Provider-reported usage of the final model call (zero on a prompt cache hit)
+        token_usage = get_token_usage(last_message)
+        record_tokens(token_usage)
         
+        # Retrieved doc IDs and prompt token stats were recorded on the trace by the middleware
         log_event(
             event_type="chain_request",
             query=request.query,
             latency=latency,
             model_id="chain_agent",
-            retrieved_doc_ids=retrieved_doc_ids,
-            token_usage=token_usage
+            token_usage=token_usage,
+            trace=trace
         )
             
         return {"response": content}
     except Exception as e:
         latency = time.time() - start_time
-        log_event(event_type="chain_error", query=request.query, latency=latency, model_id="unknown", error=str(e))
+        log_event(event_type="chain_error", query=request.query, latency=latency, model_id="unknown", error=str(e), trace=trace)
         raise HTTPException(status_code=500, detail=str(e))
 
+def _sse(payload: dict) -> str:
+    """Format a payload as a single Server-Sent Events message."""
+    return f"data: {json.dumps(payload)}\n\n"
+
+@app.post("/chat/chain/stream")
+async def chat_chain_stream(request: ChatRequest):
+    """
+    Streaming variant of /chat/chain. Emits `{"token": ...}` events as the model
+    generates, then a final `{"done": true}` event (or `{"error": ...}` on failure).
+    """
+    async def event_stream():
+        start_time = time.time()
+        trace = start_trace()
+        inputs = {
+            "messages": [HumanMessage(content=request.query)],
+            "session_id": request.session_id
+        }
+        # Shares cache entries with /chat/chain
+        prompt_hash_key = f"chain_response:{get_hash(request.query)}"
+        try:
+            cached_res = await aget_llm_cache(prompt_hash_key)
+            record_cache("response", bool(cached_res))
+            semantic = False
+            if not cached_res:
+                cached_res = await aget_semantic_cache("chain", request.query)
+                semantic = bool(cached_res)
+                record_cache("semantic", semantic)
+            if cached_res:
+                print(f"--- LLM Response Cache HIT (Chain Stream) ---")
+                yield _sse({"token": cached_res})
+                log_event(
+                    event_type="chain_stream_semantic_cache_hit" if semantic else "chain_stream_cache_hit",
+                    query=request.query,
+                    latency=time.time() - start_time,
+                    model_id="redis_cache_chain"
+                )
+                yield _sse({"done": True, "cached": True, "semantic": semantic})
+                return
+
+            print(f"--- LLM Response Cache MISS (Chain Stream) ---")
+            parts = []
+            first_token_latency = None
+            token_usage = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+            # The leader streams; identical in-flight questions get its full answer in one event
+            async with response_flights.alead(prompt_hash_key, partial(aget_llm_cache, prompt_hash_key)) as flight:
+                if not flight.shared:
+                    async for chunk, meta in chain_agent.astream(inputs, stream_mode="messages"):
+                        # Only forward tokens produced by the model node
+                        if not isinstance(chunk, AIMessageChunk) or meta.get("langgraph_node") != "model":
+                            continue
+                        # Providers report usage on one (often empty) chunk, usually the last
+                        for key, value in get_token_usage(chunk).items():
+                            token_usage[key] += value
+                        if not chunk.content:
+                            continue
+                        if first_token_latency is None:
+                            first_token_latency = time.time() - start_time
+                        parts.append(chunk.content)
+                        yield _sse({"token": chunk.content})
+
+                    flight.value = "".join(parts)
+                    await aset_llm_cache(prompt_hash_key, flight.value)
+                    await aset_semantic_cache("chain", request.query, flight.value)
+
+            content = flight.value
+            if flight.shared:
+                yield _sse({"token": content})
+                log_event(
+                    event_type="chain_stream_coalesced",
+                    query=request.query,
+                    latency=time.time() - start_time,
+                    model_id="singleflight_chain",
+                    trace=trace
+                )
+                yield _sse({"done": True, "cached": True, "coalesced": True})
+                return
+
+            # Save the AI turn and record the request before "done": clients disconnect on it,
+            # which cancels this generator
+            from memory import ChatMemoryManager
+            from langchain_core.messages import AIMessage
+            memory = ChatMemoryManager(session_id=request.session_id)
+            with span("memory"):
+                await memory.aadd_message(AIMessage(content=content))
+
+            print(f"--- Time to first token: {first_token_latency or 0:.3f}s ---")
+            trace.attrs["first_token_seconds"] = round(first_token_latency or 0, 4)
+            record_tokens(token_usage)
+            log_event(
+                event_type="chain_stream_request",
+                query=request.query,
+                latency=time.time() - start_time,
+                model_id="chain_agent",
+                token_usage=token_usage,
+                trace=trace,
+            )
+            yield _sse({"done": True, "cached": False})
+        except Exception as e:
+            log_event(event_type="chain_stream_error", query=request.query, latency=time.time() - start_time, model_id="unknown", error=str(e), trace=trace)
+            yield _sse({"error": str(e)})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+class BatchRequest(BaseModel):
+    queries: List[str]
+    # Max generations in flight; capped at BATCH_LLM_CONCURRENCY
+    concurrency: Optional[int] = None
+
+@app.post("/chat/batch")
+async def chat_batch(request: BatchRequest):
+    """
+    Answer many queries in one request (offline evaluation, bulk FAQ generation).
+    Streams NDJSON: one `{"index": ..., "response": ...}` line per query as it
+    completes (`{"index": ..., "error": ...}` if it failed), then `{"done": true, ...}`.
+    """
+    if not request.queries or len(request.queries) > BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"Send between 1 and {BATCH_MAX_QUERIES} queries")
+    concurrency = min(request.concurrency or BATCH_LLM_CONCURRENCY, BATCH_LLM_CONCURRENCY)
+
+    async def result_stream():
+        start_time = time.time()
+        trace = start_trace()
+        errors = 0
+        async for result in abatch_answer(request.queries, concurrency):
+            errors += "error" in result
+            yield json.dumps(result) + "\n"
+
+        latency = time.time() - start_time
+        yield json.dumps({"done": True, "count": len(request.queries), "errors": errors, "latency_seconds": round(latency, 4)}) + "\n"
+        log_event(
+            event_type="batch_request",
+            query=f"batch:{len(request.queries)}",
+            latency=latency,
+            model_id="batch",
+            error=f"{errors} queries failed" if errors else None,
+            trace=trace,
+        )
+
+    return StreamingResponse(result_stream(), media_type="application/x-ndjson")
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition of the in-process metrics registry (this worker only)."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 @app.get("/")
 async def get_frontend():
     return FileResponse("../index.html")
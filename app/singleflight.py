@@ -0,0 +1,283 @@
+"""
+Single-flight coalescing of cache misses.
+
+When many callers miss the same cache key at once, only the first (the
+leader) does the expensive work; callers arriving while it runs wait for
+the leader's result instead of recomputing it.
+
+- In-process: a table of in-flight futures per layer, shared by worker
+  threads and the event loop.
+- Across workers (distributed layers only): the leader also takes a short
+  Redis lock `singleflight:<layer>:<key>` (SET NX EX), renewed every third
+  of SINGLEFLIGHT_LOCK_TTL while it runs (so slow LLM calls keep it) and
+  released with a compare-and-delete script. A worker that finds the lock
+  held polls the cache until the result shows up, and computes itself if
+  the lock is released or SINGLEFLIGHT_WAIT passes without one.
+
+Usage (the body runs only for the leader):
+
+    with flights.lead(key, lookup) as flight:
+        if not flight.shared:
+            flight.value = compute()
+    return flight.value
+"""
+import os
+import time
+import uuid
+import asyncio
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager, asynccontextmanager
+from typing import Any, Awaitable, Callable, Optional
+from cache import redis_client, async_redis_client
+from metrics import SINGLEFLIGHT_COALESCED
+from redis_backend import local_script
+
+SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT", "true").lower() == "true"
+# Lock expiry (s): bounds how long a crashed leader can hold other workers back.
+# A live leader renews it every TTL / 3, however long the work takes.
+SINGLEFLIGHT_LOCK_TTL = int(os.getenv("SINGLEFLIGHT_LOCK_TTL", 30))
+# Max time (s) a worker waits for another worker's result before computing itself
+SINGLEFLIGHT_WAIT = float(os.getenv("SINGLEFLIGHT_WAIT", 30))
+SINGLEFLIGHT_POLL_MS = float(os.getenv("SINGLEFLIGHT_POLL_MS", 50))
+
+# Only the holder of the lock (same token) may release or renew it
+UNLOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+EXTEND_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+@local_script(UNLOCK_SCRIPT)
+def _unlock_local(backend, keys, args):
+    return backend.delete(keys[0]) if backend.get(keys[0]) == args[0] else 0
+
+@local_script(EXTEND_SCRIPT)
+def _extend_local(backend, keys, args):
+    return int(backend.expire(keys[0], int(args[1]))) if backend.get(keys[0]) == args[0] else 0
+
+class Flight:
+    """One caller's view of a coalesced call: the leader sets `value`, followers receive it."""
+    def __init__(self, shared: bool = False, value: Any = None):
+        self.shared = shared
+        self.value = value
+
+class SingleFlight:
+    def __init__(self, layer: str, distributed: bool = True):
+        self.layer = layer
+        self.distributed = distributed
+        self._calls: dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    # --- In-process table ---
+
+    def _begin(self, key: str) -> tuple[Future, bool]:
+        """The in-flight future for `key`, and whether the caller is its leader."""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                return future, False
+            future = self._calls[key] = Future()
+            return future, True
+
+    def _finish(self, key: str, future: Future, value: Any = None, error: Optional[BaseException] = None):
+        with self._lock:
+            self._calls.pop(key, None)
+        if error is None:
+            future.set_result(value)
+        elif isinstance(error, Exception):
+            future.set_exception(error)
+        else:
+            # Leader cancelled (client disconnect, shutdown): followers get an error, not the cancellation
+            future.set_exception(RuntimeError(f"Single-flight leader for {self.layer}:{key} was cancelled"))
+
+    def _shared(self, scope: str):
+        SINGLEFLIGHT_COALESCED.inc(layer=self.layer, scope=scope)
+        print(f"--- Single-flight ({self.layer}): waiting on {scope} in-flight call ---")
+
+    # --- Cross-worker lock ---
+
+    def _lock_key(self, key: str) -> str:
+        return f"singleflight:{self.layer}:{key}"
+
+    def _try_lock(self, key: str) -> Optional[str]:
+        """Lock token if acquired, None if another worker holds it ("" if Redis is unusable: just compute)."""
+        token = uuid.uuid4().hex
+        try:
+            return token if redis_client.set(self._lock_key(key), token, nx=True, ex=SINGLEFLIGHT_LOCK_TTL) else None
+        except Exception as e:
+            print(f"Single-flight Lock Error: {e}")
+            return ""
+
+    def _unlock(self, key: str, token: str):
+        try:
+            redis_client.eval(UNLOCK_SCRIPT, 1, self._lock_key(key), token)
+        except Exception as e:
+            print(f"Single-flight Unlock Error: {e}")
+
+    def _keep_lock(self, key: str, token: str, stop: threading.Event):
+        """Renew the lock until `stop` is set (runs on a daemon thread next to the leader)."""
+        while not stop.wait(SINGLEFLIGHT_LOCK_TTL / 3):
+            try:
+                if not redis_client.eval(EXTEND_SCRIPT, 1, self._lock_key(key), token, SINGLEFLIGHT_LOCK_TTL):
+                    print(f"--- Single-flight ({self.layer}): lock lost, no longer renewing ---")
+                    return
+            except Exception as e:
+                print(f"Single-flight Lock Renew Error: {e}")
+
+    def _wait_remote(self, key: str, lookup: Callable[[], Any]) -> Any:
+        """Poll the cache while another worker holds the lock; None if it gives up without a result."""
+        deadline = time.monotonic() + SINGLEFLIGHT_WAIT
+        try:
+            while time.monotonic() < deadline:
+                time.sleep(SINGLEFLIGHT_POLL_MS / 1000)
+                value = lookup()
+                if value is not None:
+                    return value
+                if redis_client.get(self._lock_key(key)) is None:
+                    return None
+        except Exception as e:
+            print(f"Single-flight Wait Error: {e}")
+        return None
+
+    async def _atry_lock(self, key: str) -> Optional[str]:
+        token = uuid.uuid4().hex
+        try:
+            return token if await async_redis_client.set(self._lock_key(key), token, nx=True, ex=SINGLEFLIGHT_LOCK_TTL) else None
+        except Exception as e:
+            print(f"Single-flight Lock Error: {e}")
+            return ""
+
+    async def _aunlock(self, key: str, token: str):
+        try:
+            await async_redis_client.eval(UNLOCK_SCRIPT, 1, self._lock_key(key), token)
+        except Exception as e:
+            print(f"Single-flight Unlock Error: {e}")
+
+    async def _akeep_lock(self, key: str, token: str):
+        """Async version of _keep_lock; runs as a task until cancelled."""
+        while True:
+            await asyncio.sleep(SINGLEFLIGHT_LOCK_TTL / 3)
+            try:
+                if not await async_redis_client.eval(EXTEND_SCRIPT, 1, self._lock_key(key), token, SINGLEFLIGHT_LOCK_TTL):
+                    print(f"--- Single-flight ({self.layer}): lock lost, no longer renewing ---")
+                    return
+            except Exception as e:
+                print(f"Single-flight Lock Renew Error: {e}")
+
+    async def _await_remote(self, key: str, lookup: Callable[[], Awaitable[Any]]) -> Any:
+        deadline = time.monotonic() + SINGLEFLIGHT_WAIT
+        try:
+            while time.monotonic() < deadline:
+                await asyncio.sleep(SINGLEFLIGHT_POLL_MS / 1000)
+                value = await lookup()
+                if value is not None:
+                    return value
+                if await async_redis_client.get(self._lock_key(key)) is None:
+                    return None
+        except Exception as e:
+            print(f"Single-flight Wait Error: {e}")
+        return None
+
+    # --- Public API ---
+
+    @contextmanager
+    def lead(self, key: str, lookup: Optional[Callable[[], Any]] = None):
+        """
+        Yield a Flight for `key`. If `flight.shared`, `flight.value` already holds
+        another caller's result; otherwise the body must compute and set it.
+        `lookup` re-reads the cache and enables the cross-worker lock.
+        """
+        if not SINGLEFLIGHT_ENABLED:
+            yield Flight()
+            return
+
+        future, leader = self._begin(key)
+        if not leader:
+            self._shared("local")
+            yield Flight(shared=True, value=future.result())
+            return
+
+        flight, token, renewing = Flight(), "", threading.Event()
+        try:
+            if self.distributed and lookup is not None:
+                token = self._try_lock(key)
+                if token is None:
+                    value = self._wait_remote(key, lookup)
+                    if value is not None:
+                        self._shared("remote")
+                        flight = Flight(shared=True, value=value)
+                elif token:
+                    threading.Thread(target=self._keep_lock, args=(key, token, renewing), daemon=True).start()
+            yield flight
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        finally:
+            renewing.set()
+            if token:
+                self._unlock(key, token)
+        self._finish(key, future, flight.value)
+
+    @asynccontextmanager
+    async def alead(self, key: str, lookup: Optional[Callable[[], Awaitable[Any]]] = None):
+        """Async version of lead; `lookup` is a coroutine function."""
+        if not SINGLEFLIGHT_ENABLED:
+            yield Flight()
+            return
+
+        future, leader = self._begin(key)
+        if not leader:
+            self._shared("local")
+            # shield: a cancelled follower must not cancel the leader's future
+            yield Flight(shared=True, value=await asyncio.shield(asyncio.wrap_future(future)))
+            return
+
+        flight, token, renewing = Flight(), "", None
+        try:
+            if self.distributed and lookup is not None:
+                token = await self._atry_lock(key)
+                if token is None:
+                    value = await self._await_remote(key, lookup)
+                    if value is not None:
+                        self._shared("remote")
+                        flight = Flight(shared=True, value=value)
+                elif token:
+                    renewing = asyncio.create_task(self._akeep_lock(key, token))
+            yield flight
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        finally:
+            if renewing is not None:
+                renewing.cancel()
+            if token:
+                await self._aunlock(key, token)
+        self._finish(key, future, flight.value)
+
+    def do(self, key: str, compute: Callable[[], Any], lookup: Optional[Callable[[], Any]] = None) -> tuple[Any, bool]:
+        """Run `compute()` once for concurrent callers of `key`. Returns (value, shared)."""
+        with self.lead(key, lookup) as flight:
+            if not flight.shared:
+                flight.value = compute()
+        return flight.value, flight.shared
+
+    async def ado(self, key: str, compute: Callable[[], Awaitable[Any]], lookup: Optional[Callable[[], Awaitable[Any]]] = None) -> tuple[Any, bool]:
+        """Async version of do; `compute` and `lookup` are coroutine functions."""
+        async with self.alead(key, lookup) as flight:
+            if not flight.shared:
+                flight.value = await compute()
+        return flight.value, flight.shared
+
+# One table per layer. Embedding misses are cheaper than a Redis lock round trip
+# plus polling, so that layer coalesces in-process only.
+response_flights = SingleFlight("response")
+retrieval_flights = SingleFlight("retrieval")
+embedding_flights = SingleFlight("embedding", distributed=False)
@@ -0,0 +1,157 @@
+"""
+Versioned on-disk snapshot of the split chunks and the BM25 inverted index.
+
+Ingestion writes the snapshot; the server loads it at import instead of
+re-parsing every PDF and rebuilding BM25 from scratch. The snapshot is
+rebuilt in-process only when it is missing or stale (corpus files or
+splitter settings changed, or the format version was bumped).
+
+File layout: a sequence of pickle frames, so it can be written while
+chunks stream in (SnapshotWriter) without holding the corpus in memory:
+    {"version", "fingerprint"}, [(text, metadata), ...] * n, {"bm25": state}
+"""
+import os
+import json
+import pickle
+import hashlib
+import time
+from typing import Optional
+from langchain_core.documents import Document
+from loader import list_pdfs
+from splitter import CHUNK_SIZE, CHUNK_OVERLAP, split_docs
+from bm25 import InvertedBM25Retriever, BM25IndexBuilder
+
+# Bump whenever the pickled layout changes
+SNAPSHOT_VERSION = 3
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+SNAPSHOT_PATH = os.getenv(
+    "BM25_SNAPSHOT_PATH",
+    os.path.join(os.path.dirname(CURRENT_DIR), "bm25_snapshot.pkl"),
+)
+
+def corpus_fingerprint() -> dict:
+    """Cheap fingerprint of the corpus (file stats only) and the splitter settings."""
+    files = []
+    for path in list_pdfs():
+        stat = os.stat(path)
+        files.append((os.path.basename(path), stat.st_size, stat.st_mtime_ns))
+    return {"files": files, "chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP}
+
+def corpus_version() -> str:
+    """Short stable ID of the current corpus + splitter settings."""
+    fingerprint = json.dumps(corpus_fingerprint(), sort_keys=True)
+    return hashlib.sha256(fingerprint.encode()).hexdigest()[:16]
+
+class SnapshotWriter:
+    """
+    Write a snapshot chunk batch by chunk batch: each batch is appended to a
+    temp file and indexed by a BM25IndexBuilder, so only the BM25 postings
+    stay in memory. close() appends the index and atomically moves the file
+    into place; a writer left without close() (e.g. on error) leaves no file.
+    """
+    def __init__(self, path: str = SNAPSHOT_PATH):
+        self.path = path
+        self.tmp_path = f"{path}.{os.getpid()}.tmp"
+        self.count = 0
+        self._builder = BM25IndexBuilder()
+        self._file = open(self.tmp_path, "wb")
+        self._dump({"version": SNAPSHOT_VERSION, "fingerprint": corpus_fingerprint()})
+
+    def _dump(self, obj):
+        pickle.dump(obj, self._file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _write_chunks(self, chunks: list[Document]):
+        if chunks:
+            self._dump([(doc.page_content, doc.metadata) for doc in chunks])
+            self.count += len(chunks)
+
+    def add(self, chunks: list[Document]):
+        """Append the next batch of chunks and index it."""
+        self._write_chunks(chunks)
+        self._builder.add_documents(chunks)
+
+    def close(self, bm25_state: Optional[dict] = None):
+        """Finish the file; `bm25_state` skips the rebuild when the caller already has the index."""
+        self._dump({"bm25": bm25_state or self._builder.state_dict()})
+        self._file.close()
+        # Rename is atomic, so concurrent workers never read a half-written file
+        os.replace(self.tmp_path, self.path)
+        print(f"--- Snapshot saved: {self.count} chunks -> {self.path} ---")
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def __enter__(self) -> "SnapshotWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+def save_snapshot(chunks: list[Document], bm25_retriever: InvertedBM25Retriever, path: str = SNAPSHOT_PATH):
+    """Atomically write chunks and an already built BM25 index to disk."""
+    writer = SnapshotWriter(path)
+    try:
+        writer._write_chunks(chunks)
+        writer.close(bm25_retriever.state_dict())
+    except BaseException:
+        writer.abort()
+        raise
+
+def load_snapshot(path: str = SNAPSHOT_PATH) -> Optional[tuple[list[Document], InvertedBM25Retriever]]:
+    """Load the snapshot, or return None if it is missing or stale."""
+    if not os.path.exists(path):
+        print("--- Snapshot MISSING ---")
+        return None
+
+    chunks = []
+    try:
+        with open(path, "rb") as f:
+            header = pickle.load(f)
+            if not isinstance(header, dict) or header.get("version") != SNAPSHOT_VERSION or header.get("fingerprint") != corpus_fingerprint():
+                print("--- Snapshot STALE ---")
+                return None
+            while True:
+                frame = pickle.load(f)
+                if isinstance(frame, dict):
+                    bm25_state = frame["bm25"]
+                    break
+                chunks.extend(Document(page_content=text, metadata=meta) for text, meta in frame)
+    except Exception as e:
+        print(f"--- Snapshot unreadable ({e}) ---")
+        return None
+
+    bm25_retriever = InvertedBM25Retriever.from_state(bm25_state, chunks)
+    return chunks, bm25_retriever
+
+def build_snapshot(chunks: list[Document], path: str = SNAPSHOT_PATH) -> InvertedBM25Retriever:
+    """Build BM25 over `chunks` and persist both."""
+    bm25_retriever = InvertedBM25Retriever.from_documents(chunks)
+    save_snapshot(chunks, bm25_retriever, path)
+    return bm25_retriever
+
+def load_or_build_snapshot() -> tuple[list[Document], InvertedBM25Retriever]:
+    """Fast path for server start-up: load the snapshot, rebuilding only if needed."""
+    start = time.time()
+    snapshot = load_snapshot()
+    if snapshot:
+        print(f"--- Snapshot HIT: {len(snapshot[0])} chunks in {time.time() - start:.3f}s ---")
+        return snapshot
+
+    chunks = split_docs()
+    bm25_retriever = InvertedBM25Retriever.from_documents(chunks)
+    try:
+        save_snapshot(chunks, bm25_retriever)
+    except OSError as e:
+        print(f"--- WARNING: Could not write snapshot: {e} ---")
+    print(f"--- Snapshot rebuilt in {time.time() - start:.3f}s ---")
+    return chunks, bm25_retriever
+
+if __name__ == "__main__":
+    chunks, bm25 = load_or_build_snapshot()
+    print(f"Chunks: {len(chunks)}")
@@ -1,12 +1,29 @@
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from loader import docs
+from loader import load_docs
+
+CHUNK_SIZE = 250  # chunk size (characters)
+CHUNK_OVERLAP = 50  # chunk overlap (characters)
 
 text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=250,  # chunk size (characters)
-    chunk_overlap=50,  # chunk overlap (characters)
+    chunk_size=CHUNK_SIZE,
+    chunk_overlap=CHUNK_OVERLAP,
     add_start_index=True,  # track index in original document
 )
-all_splits = text_splitter.split_documents(docs)
+
+_all_splits = None
+
+def split_docs():
+    """Split the loaded corpus into chunks (once per process)."""
+    global _all_splits
+    if _all_splits is None:
+        _all_splits = text_splitter.split_documents(load_docs())
+    return _all_splits
+
+def __getattr__(name):
+    # `all_splits` is resolved lazily so importing this module does not parse the corpus
+    if name == "all_splits":
+        return split_docs()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 if __name__ == "__main__":
-    print(f"Split blog post into {len(all_splits)} sub-documents.")
\ No newline at end of file
+    print(f"Split blog post into {len(split_docs())} sub-documents.")
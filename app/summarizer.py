@@ -0,0 +1,99 @@
+"""
+Background conversation summarization.
+
+The prompt middleware only schedules a summary; the current turn goes ahead
+with the existing window and summary. A worker thread summarizes the older
+part of the history and swaps the new summary in when it is ready.
+A per-session lock (in-process set + Redis SET NX, released only by the job
+holding its token) prevents concurrent turns from triggering duplicate summaries.
+"""
+import os
+import time
+import threading
+from contextvars import Context
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.messages import SystemMessage
+from memory import ChatMemoryManager
+from observability import start_trace, span, log_event
+
+SUMMARY_WORKERS = int(os.getenv("SUMMARY_WORKERS", 2))
+# Upper bound on one summarization; the Redis lock expires after this even if a worker dies
+SUMMARY_LOCK_TTL = int(os.getenv("SUMMARY_LOCK_TTL", 120))
+# Most recent messages left out of the summary (the original behaviour kept the latest message)
+SUMMARY_KEEP_LAST = int(os.getenv("SUMMARY_KEEP_LAST", 1))
+
+class BackgroundSummarizer:
+    def __init__(self, model, workers: int = SUMMARY_WORKERS):
+        self.model = model
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="summarizer")
+        self._pending: set[str] = set()
+        self._lock = threading.Lock()
+
+    def schedule(self, memory: ChatMemoryManager) -> bool:
+        """Queue a summary for the session unless one is already running. Never blocks on the LLM."""
+        with self._lock:
+            if memory.session_id in self._pending:
+                return False
+            self._pending.add(memory.session_id)
+
+        # Fresh context: the job gets its own trace instead of the scheduling request's
+        self._pool.submit(Context().run, self._run, memory)
+        return True
+
+    def _run(self, memory: ChatMemoryManager):
+        lock_token = None
+        trace = start_trace()
+        start_time = time.time()
+        try:
+            # Cross-process part of the lock, taken on the worker so the request path never waits on Redis
+            lock_token = memory.try_lock_summary(SUMMARY_LOCK_TTL)
+            if not lock_token:
+                return
+
+            with span("memory"):
+                history = memory.get_history_entries()
+            to_summarize = history[:-SUMMARY_KEEP_LAST] if SUMMARY_KEEP_LAST else history
+            if not to_summarize:
+                return
+
+            # Fold the previous summary in so long-term context is not dropped
+            with span("memory"):
+                previous = memory.get_summary()
+            messages = [SystemMessage(content=f"Earlier summary: {previous}")] if previous else []
+            summary = self.model.summarize_conversation(messages + [message for _, message in to_summarize])
+
+            # Removes exactly the summarized messages, wherever they sit in the list by now
+            with span("memory"):
+                applied = memory.apply_summary(summary, [raw for raw, _ in to_summarize])
+            if not applied:
+                print(f"--- Summary discarded for session {memory.session_id}: history changed meanwhile ---")
+                return
+            print(f"--- Summary ready for session {memory.session_id}: {applied} messages compressed ---")
+            log_event(
+                event_type="summarization",
+                query=f"session:{memory.session_id}",
+                latency=time.time() - start_time,
+                model_id="summarizer",
+                trace=trace
+            )
+        except Exception as e:
+            print(f"Background Summary Error: {e}")
+            log_event(event_type="summarization_error", query=f"session:{memory.session_id}", latency=time.time() - start_time, model_id="summarizer", error=str(e), trace=trace)
+        finally:
+            if lock_token:
+                try:
+                    memory.release_summary_lock(lock_token)
+                except Exception as e:
+                    print(f"Summary Lock Error: {e}")
+            with self._lock:
+                self._pending.discard(memory.session_id)
+
+_summarizer = None
+
+def get_summarizer() -> BackgroundSummarizer:
+    """Shared summarizer (created on first use so importing this module does not load the LLM)."""
+    global _summarizer
+    if _summarizer is None:
+        from llm import model
+        _summarizer = BackgroundSummarizer(model)
+    return _summarizer
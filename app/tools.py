@@ -6,8 +6,8 @@ def retrieve_context(query: str):
     """Retrieve information to help answer a query."""
     retrieved_docs = vector_store.similarity_search(query, k=2)
     
-    # Track document IDs in ContextVar for observability
-    from observability import retrieved_doc_ids_var
+    # Track document IDs on the request trace for observability
+    from observability import set_trace_attr
     doc_ids = []
     for doc in retrieved_docs:
         meta = doc.metadata
@@ -15,7 +15,7 @@ def retrieve_context(query: str):
         if "page" in meta:
             doc_id += f":page_{meta['page']}"
         doc_ids.append(doc_id)
-    retrieved_doc_ids_var.set(doc_ids)
+    set_trace_attr("retrieved_doc_ids", doc_ids)
 
     serialized = "\n\n".join(
         (f"Source: {doc.metadata}\nContent: {doc.page_content}")
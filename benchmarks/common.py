@@ -0,0 +1,33 @@
+"""Helpers shared by the benchmark scripts."""
+import subprocess
+import os
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(REPO_DIR, "app")
+
+def percentiles(values: list) -> dict:
+    """Nearest-rank percentiles, in the unit of `values`."""
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def pick(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered), 2),
+        "p50": round(pick(50), 2),
+        "p95": round(pick(95), 2),
+        "p99": round(pick(99), 2),
+        "max": round(ordered[-1], 2),
+    }
+
+def git_commit() -> str:
+    """Short HEAD commit, suffixed with -dirty if app/ has uncommitted changes."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "diff", "--quiet", "HEAD", "--", "app"], cwd=REPO_DIR).returncode != 0
+        return commit + ("-dirty" if dirty else "")
+    except Exception:
+        return "unknown"
@@ -0,0 +1,262 @@
+"""
+Offline load test for the RAG API.
+
+Drives the real FastAPI app (`server.app`) in-process over httpx's ASGI
+transport, with the deterministic fake chat model (LLM=FAKE), fake
+embeddings (EMBEDDINGS=FAKE) and the in-memory Redis backend
+(REDIS_BACKEND=memory), so numbers reflect this code rather than provider
+or network latency. Retrieval (Chroma, BM25, Flashrank) runs for real
+against the local corpus.
+
+Query mix:
+- cold: unique queries, every cache layer misses
+- warm: repeats from a small pool primed before the run (exact response cache hits)
+- near: paraphrases of the warm pool (case/punctuation/filler word; semantic
+  cache hits when run with SEMANTIC_CACHE=true)
+
+Writes one JSON report with p50/p95/p99, RPS and per-stage span timings for
+each concurrency level, tagged with the git commit for comparison.
+
+Usage:
+    python benchmarks/load_test.py --endpoint chain --concurrency 1,8,32 \\
+        --requests 200 --mix cold=0.4,warm=0.4,near=0.2 --output bench.json
+    python benchmarks/load_test.py ... --baseline bench_main.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import contextlib
+from collections import defaultdict
+from common import APP_DIR, percentiles, git_commit
+
+# The fakes must be selected before the app modules are imported (explicit env wins)
+os.environ.setdefault("LLM", "FAKE")
+os.environ.setdefault("EMBEDDINGS", "FAKE")
+os.environ.setdefault("REDIS_BACKEND", "memory")
+
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
+
+ENDPOINTS = {
+    "chain": "/chat/chain",
+    "stream": "/chat/chain/stream",
+    "agent": "/chat/agent",
+}
+
+# Env that changes the numbers; recorded in the report
+REPORTED_ENV = (
+    "LLM", "EMBEDDINGS", "REDIS_BACKEND", "FAKE_LLM_LATENCY_MS", "FAKE_LLM_TOKEN_MS",
+    "FAKE_EMBED_LATENCY_MS", "RERANK", "RETRIEVAL_FUSION", "SEMANTIC_CACHE",
+    "CONTEXT_COMPRESSION", "PROMPT_TOKEN_BUDGET",
+)
+
+BASE_QUERIES = [
+    "What personal data do you collect from users?",
+    "For what reasons do you share data with third parties?",
+    "How long is customer data retained after account closure?",
+    "How can I request deletion of my account?",
+    "Do you use cookies or tracking technologies on the website?",
+    "What security measures protect stored payment information?",
+    "Can I opt out of marketing emails?",
+    "Is my data transferred to other countries?",
+    "How will I be notified about changes to this privacy policy?",
+    "What rights do users have to access their personal data?",
+    "Do you sell personal information to advertisers?",
+    "Who can I contact with questions about data protection?",
+]
+FILLER_WORDS = ["please", "exactly", "briefly", "currently"]
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        kind = kind.strip()
+        if kind not in ("cold", "warm", "near"):
+            raise ValueError(f"Unknown query kind '{kind}' (expected cold, warm or near)")
+        mix[kind] = float(weight or 1)
+    return mix
+
+def near_duplicate(query: str, rng: random.Random) -> str:
+    """Paraphrase that differs in the exact cache key but embeds close to the original."""
+    variant = rng.randrange(3)
+    if variant == 0:
+        return query.lower()
+    if variant == 1:
+        return query.rstrip("?") + " ?"
+    return f"{query.rstrip('?')} {rng.choice(FILLER_WORDS)}?"
+
+def build_plan(requests: int, mix: dict, warm_pool: list, sessions: int, rng: random.Random, run_tag: str) -> list:
+    """(kind, query, session_id) per request, reproducible for a given seed."""
+    kinds = list(mix)
+    weights = [mix[k] for k in kinds]
+    plan = []
+    for i in range(requests):
+        kind = rng.choices(kinds, weights)[0]
+        if kind == "warm":
+            query = rng.choice(warm_pool)
+        elif kind == "near":
+            query = near_duplicate(rng.choice(warm_pool), rng)
+        else:
+            # Several unique words push it below the semantic cache threshold as well
+            nonce = " ".join(f"ref{run_tag}x{i}x{k}" for k in range(3))
+            query = f"{rng.choice(BASE_QUERIES).rstrip('?')} {nonce}?"
+        plan.append((kind, query, f"bench-{run_tag}-{i % sessions}"))
+    return plan
+
+def stage_breakdown(events: list) -> dict:
+    """Per-stage span time per request (spans of the same stage within a request are summed)."""
+    per_stage = defaultdict(list)
+    for event in events:
+        totals = defaultdict(float)
+        for span in event.get("spans", []):
+            totals[span["name"]] += span["duration_ms"]
+        for name, total in totals.items():
+            per_stage[name].append(total)
+    return {name: percentiles(values) for name, values in sorted(per_stage.items())}
+
+async def send(client, endpoint: str, query: str, session_id: str) -> bool:
+    response = await client.post(ENDPOINTS[endpoint], json={"query": query, "session_id": session_id})
+    if response.status_code != 200:
+        return False
+    # Streaming errors arrive as an SSE event on a 200 response
+    return not (endpoint == "stream" and 'data: {"error"' in response.text)
+
+async def run_level(client, endpoint: str, plan: list, concurrency: int, events: list) -> dict:
+    """Closed loop: `concurrency` virtual users work through the plan back to back."""
+    queue = list(reversed(plan))
+    results = []
+    events.clear()
+
+    async def user():
+        while queue:
+            kind, query, session_id = queue.pop()
+            start = time.perf_counter()
+            try:
+                ok = await send(client, endpoint, query, session_id)
+            except Exception:
+                ok = False
+            results.append((kind, (time.perf_counter() - start) * 1000, ok))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    duration = time.perf_counter() - start
+
+    # Background summaries log their own events; only request events are reported
+    request_events = [e for e in events if not e["event_type"].startswith("summarization")]
+    by_kind = defaultdict(list)
+    for kind, latency_ms, ok in results:
+        if ok:
+            by_kind[kind].append(latency_ms)
+    event_counts = defaultdict(int)
+    for event in request_events:
+        event_counts[event["event_type"]] += 1
+    first_token = [e["first_token_seconds"] * 1000 for e in request_events if "first_token_seconds" in e]
+
+    report = {
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": sum(1 for _, _, ok in results if not ok),
+        "duration_seconds": round(duration, 3),
+        "rps": round(len(results) / duration, 2) if duration else 0.0,
+        "latency_ms": percentiles([latency for _, latency, ok in results if ok]),
+        "latency_ms_by_kind": {kind: percentiles(values) for kind, values in sorted(by_kind.items())},
+        "events": dict(sorted(event_counts.items())),
+        "stages_ms": stage_breakdown(request_events),
+    }
+    if first_token:
+        report["first_token_ms"] = percentiles(first_token)
+    return report
+
+def compare(runs: list, baseline: dict) -> dict:
+    """Relative change of the headline numbers against a previous report, per concurrency level."""
+    previous = {run["concurrency"]: run for run in baseline.get("runs", [])}
+    deltas = {}
+    for run in runs:
+        before = previous.get(run["concurrency"])
+        if not before:
+            continue
+        delta = {}
+        for key in ("p50", "p95", "p99"):
+            old, new = before["latency_ms"].get(key), run["latency_ms"].get(key)
+            if old and new is not None:
+                delta[f"{key}_pct"] = round((new - old) / old * 100, 1)
+        if before.get("rps"):
+            delta["rps_pct"] = round((run["rps"] - before["rps"]) / before["rps"] * 100, 1)
+        deltas[str(run["concurrency"])] = delta
+    return {"commit": baseline.get("commit"), "deltas": deltas}
+
+async def main(args) -> dict:
+    import httpx
+    from server import app
+    from observability import add_event_sink
+
+    events = []
+    add_event_sink(events.append)
+
+    rng = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    warm_pool = BASE_QUERIES[:args.warm_pool]
+    levels = [int(c) for c in args.concurrency.split(",")]
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=args.timeout) as client:
+        # Prime the warm pool (and lazy loads such as the tokenizer); not measured
+        for query in warm_pool:
+            await send(client, args.endpoint, query, "bench-warmup")
+
+        runs = []
+        for index, concurrency in enumerate(levels):
+            plan = build_plan(args.requests, mix, warm_pool, args.sessions or concurrency, rng, f"{args.seed}r{index}")
+            runs.append(await run_level(client, args.endpoint, plan, concurrency, events))
+
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "config": {
+            "endpoint": args.endpoint,
+            "requests_per_level": args.requests,
+            "mix": mix,
+            "warm_pool": len(warm_pool),
+            "sessions": args.sessions or "per_user",
+            "seed": args.seed,
+            "env": {name: os.environ[name] for name in REPORTED_ENV if name in os.environ},
+        },
+        "runs": runs,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline load test of the RAG API with fake models.")
+    parser.add_argument("--endpoint", choices=sorted(ENDPOINTS), default="chain")
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per concurrency level")
+    parser.add_argument("--mix", default="cold=0.4,warm=0.4,near=0.2", help="Query mix weights")
+    parser.add_argument("--warm-pool", type=int, default=5, help="Distinct queries in the warm pool")
+    parser.add_argument("--sessions", type=int, default=0, help="Chat sessions shared by the users (0 = one per user)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", help="Earlier report to compare against")
+    parser.add_argument("--verbose", action="store_true", help="Keep the app's console logging")
+    args = parser.parse_args()
+
+    # The app logs every cache lookup and event to stdout; keep the report readable
+    with contextlib.ExitStack() as stack:
+        if not args.verbose:
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, "w"))))
+        report = asyncio.run(main(args))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["baseline"] = compare(report["runs"], json.load(f))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"--- Benchmark report written to {args.output} ---")
+    else:
+        print(output)
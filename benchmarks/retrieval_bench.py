@@ -0,0 +1,282 @@
+"""
+Retrieval micro-benchmark with parameter sweeps.
+
+Times each stage of ManualHybridRetriever (embed, vector, bm25, fuse, rerank)
+on synthetic corpora and measures recall against a labeled query set, so
+k / chunking settings can be chosen against a latency SLO without losing
+quality.
+
+Corpus: Zipf-distributed pseudo-words in sentences and documents, sized so
+that the default splitter (250/50) yields roughly the requested number of
+chunks. Each labeled query asks about a planted fact carrying a unique code
+word; a chunk is relevant if it contains that code (so labels survive any
+chunk_size / chunk_overlap). A labeled corpus can also be loaded with
+--corpus (JSON: {"documents": [...], "queries": [{"query": ..., "needle": ...}]}).
+
+Sweeps:
+- outer (re-split and re-index): --sizes, --chunk-size, --chunk-overlap
+- inner (per query): --bm25-k, --vector-k, --top-n
+
+Embedding and reranking are timed on the models directly (no embedding or
+rerank score cache, so every config measures model latency), and the
+vector leg searches by the precomputed query vector so embed and vector
+are timed separately. Defaults to the fake embeddings (EMBEDDINGS=FAKE);
+lower FAKE_EMBEDDING_DIM for the 1M-chunk corpora to bound Chroma's memory.
+
+Usage:
+    python benchmarks/retrieval_bench.py --sizes 1000,10000,100000 \\
+        --bm25-k 5,10,20 --vector-k 3,5,10 --top-n 3 --slo-ms 150 --output retrieval.json
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import contextlib
+import itertools
+import numpy as np
+from collections import defaultdict
+from common import APP_DIR, percentiles, git_commit
+
+os.environ.setdefault("EMBEDDINGS", "FAKE")
+os.environ.setdefault("REDIS_BACKEND", "memory")
+
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
+
+STAGES = ("embed", "vector", "bm25", "fuse", "rerank")
+ATTRIBUTES = ["retention period", "renewal fee", "notice period", "storage region", "review cycle", "contact address"]
+WORDS_PER_SENTENCE = 12
+SENTENCES_PER_DOCUMENT = 40
+# Chroma rejects larger add() batches
+INDEX_BATCH_SIZE = 5000
+
+def _int_list(text: str) -> list[int]:
+    return [int(v) for v in text.split(",") if v.strip()]
+
+def generate_corpus(target_chunks: int, n_queries: int, seed: int, chunk_size: int = 250, chunk_overlap: int = 50) -> dict:
+    """Synthetic labeled corpus of about `target_chunks` chunks at the given splitter settings."""
+    rng = np.random.default_rng(seed)
+    # Pronounceable pseudo-words with a Zipf frequency profile, like natural text
+    syllables = np.array(["ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "ze", "pa", "do", "fe", "gu", "hi", "ba", "cy"])
+    vocab = np.array(["".join(rng.choice(syllables, size=rng.integers(2, 5))) for _ in range(20000)])
+    weights = 1.0 / np.arange(1, len(vocab) + 1)
+    weights /= weights.sum()
+
+    n_words = max(1, target_chunks * (chunk_size - chunk_overlap) // 7)  # ~7 chars per word incl. space
+    words = vocab[rng.choice(len(vocab), size=n_words, p=weights)].tolist()
+    sentences = [" ".join(words[i:i + WORDS_PER_SENTENCE]).capitalize() + "." for i in range(0, n_words, WORDS_PER_SENTENCE)]
+    documents = [sentences[i:i + SENTENCES_PER_DOCUMENT] for i in range(0, len(sentences), SENTENCES_PER_DOCUMENT)]
+
+    queries = []
+    for i in range(n_queries):
+        code = f"code{i:06d}q"
+        attribute = ATTRIBUTES[i % len(ATTRIBUTES)]
+        doc = documents[int(rng.integers(len(documents)))]
+        doc.insert(int(rng.integers(len(doc) + 1)), f"The {attribute} of {code} is {int(rng.integers(1, 999))} days.")
+        # No trailing "?": BM25 tokenizes on whitespace, so it would stick to the code word
+        queries.append({"query": f"What is the {attribute} of {code}", "needle": code})
+
+    return {"documents": [" ".join(doc) for doc in documents], "queries": queries}
+
+def load_or_generate(args, size: int) -> dict:
+    if args.corpus:
+        with open(args.corpus) as f:
+            return json.load(f)
+    path = os.path.join(args.corpus_dir, f"corpus_{size}_{args.queries}_{args.seed}.json") if args.corpus_dir else None
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    corpus = generate_corpus(size, args.queries, args.seed)
+    if path:
+        os.makedirs(args.corpus_dir, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(corpus, f)
+    return corpus
+
+def build_indexes(corpus: dict, chunk_size: int, chunk_overlap: int):
+    """Split the corpus and index it like ingestion does: BM25 (inverted) + an in-memory Chroma collection."""
+    from langchain_core.documents import Document
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    from langchain_chroma import Chroma
+    from bm25 import InvertedBM25Retriever
+    from embeddings import embeddings
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True)
+    sources = [Document(page_content=text, metadata={"source": f"synthetic_{i}.pdf"}) for i, text in enumerate(corpus["documents"])]
+    timings = {}
+
+    start = time.perf_counter()
+    chunks = splitter.split_documents(sources)
+    timings["split"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    bm25 = InvertedBM25Retriever.from_documents(chunks)
+    timings["bm25"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    store = Chroma(collection_name=f"bench_{uuid.uuid4().hex[:8]}", embedding_function=embeddings)
+    for i in range(0, len(chunks), INDEX_BATCH_SIZE):
+        store.add_documents(chunks[i:i + INDEX_BATCH_SIZE])
+    timings["vector"] = time.perf_counter() - start
+
+    return chunks, bm25, store, {name: round(seconds, 2) for name, seconds in timings.items()}
+
+def _hit(docs, needle: str) -> bool:
+    return any(needle in doc.page_content for doc in docs)
+
+def run_config(retriever, store, queries: list, bm25_k: int, vector_k: int, top_n: int) -> dict:
+    """Time every stage per query and compute recall of each leg, the fused candidates and the final top_n."""
+    from embeddings import embeddings
+    from retriever import _score_rerank_groups
+
+    retriever.bm25_retriever.k = bm25_k
+    retriever.top_n = top_n
+    relevance = store._select_relevance_score_fn()
+    stage_ms = defaultdict(list)
+    hits = defaultdict(int)
+
+    for item in queries:
+        query, needle = item["query"], item["needle"]
+        timings = {}
+
+        # The wrapped model, not the cached embeddings: after the first config every query
+        # would be an embedding cache hit and "embed" would time the cache, not the model
+        start = time.perf_counter()
+        vector = embeddings.model_to_wrap.embed_query(query)
+        timings["embed"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        v_hits = [(doc, relevance(distance)) for doc, distance in store.similarity_search_by_vector_with_relevance_scores(np.asarray(vector).tolist(), k=vector_k)]
+        timings["vector"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        b_hits = retriever._bm25_search(query)
+        timings["bm25"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        candidates = retriever._fuse(v_hits, b_hits)
+        timings["fuse"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if retriever.rerank and candidates:
+            scores = _score_rerank_groups(retriever.ranker, [(query, [doc.page_content for doc, _ in candidates])])[0]
+            order = sorted(range(len(candidates)), key=lambda i: scores[i], reverse=True)[:top_n]
+            final = [candidates[i][0] for i in order]
+        else:
+            final = [doc for doc, _ in candidates[:top_n]]
+        timings["rerank"] = time.perf_counter() - start
+
+        for name, seconds in timings.items():
+            stage_ms[name].append(seconds * 1000)
+        stage_ms["total"].append(sum(timings.values()) * 1000)
+        hits["vector"] += _hit([doc for doc, _ in v_hits], needle)
+        hits["bm25"] += _hit([doc for doc, _ in b_hits], needle)
+        hits["fused"] += _hit([doc for doc, _ in candidates], needle)
+        hits["final"] += _hit(final, needle)
+
+    return {
+        "bm25_k": bm25_k,
+        "vector_k": vector_k,
+        "top_n": top_n,
+        "queries": len(queries),
+        "stages_ms": {name: percentiles(stage_ms[name]) for name in STAGES + ("total",)},
+        # Share of queries whose planted fact is in the leg's top k / the candidates / the final top_n
+        "recall": {name: round(hits[name] / len(queries), 4) for name in ("vector", "bm25", "fused", "final")},
+    }
+
+def recommend(results: list, slo_ms: float) -> dict:
+    """Per corpus size: the best final recall whose p95 total latency meets the SLO (ties -> fastest)."""
+    best = {}
+    for result in results:
+        if result["stages_ms"]["total"].get("p95", float("inf")) > slo_ms:
+            continue
+        key = str(result["target_chunks"])
+        current = best.get(key)
+        rank = (result["recall"]["final"], -result["stages_ms"]["total"]["p95"])
+        if current is None or rank > (current["recall"]["final"], -current["stages_ms"]["total"]["p95"]):
+            best[key] = result
+    return {
+        size: {name: result[name] for name in ("chunk_size", "chunk_overlap", "bm25_k", "vector_k", "top_n", "recall")}
+        | {"p95_total_ms": result["stages_ms"]["total"]["p95"]}
+        for size, result in best.items()
+    }
+
+def main(args) -> dict:
+    from flashrank import Ranker
+    from retriever import ManualHybridRetriever, ChunkStore, FUSION_MODE, RERANK_CANDIDATES
+
+    ranker = Ranker()
+    results = []
+    # A loaded corpus has a fixed size (reported as target 0)
+    sizes = [0] if args.corpus else _int_list(args.sizes)
+    for size, chunk_size, chunk_overlap in itertools.product(sizes, _int_list(args.chunk_size), _int_list(args.chunk_overlap)):
+        if chunk_overlap >= chunk_size:
+            continue
+        corpus = load_or_generate(args, size)
+        chunks, bm25, store, index_seconds = build_indexes(corpus, chunk_size, chunk_overlap)
+        retriever = ManualHybridRetriever(
+            store.as_retriever(), bm25, ranker, rerank=not args.no_rerank, chunk_store=ChunkStore(chunks)
+        )
+        queries = corpus["queries"]
+        # Untimed pass: loads the ONNX session and warms the tokenizer
+        run_config(retriever, store, queries[:5], 10, 5, 3)
+
+        for bm25_k, vector_k, top_n in itertools.product(_int_list(args.bm25_k), _int_list(args.vector_k), _int_list(args.top_n)):
+            result = run_config(retriever, store, queries, bm25_k, vector_k, top_n)
+            results.append({
+                "target_chunks": size,
+                "chunks": len(chunks),
+                "chunk_size": chunk_size,
+                "chunk_overlap": chunk_overlap,
+                "index_seconds": index_seconds,
+                **result,
+            })
+        store.delete_collection()
+
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "config": {
+            "embeddings": os.environ.get("EMBEDDINGS"),
+            "fusion": FUSION_MODE,
+            "max_candidates": RERANK_CANDIDATES,
+            "rerank": not args.no_rerank,
+            "seed": args.seed,
+            "slo_ms": args.slo_ms,
+        },
+        "results": results,
+        "recommended": recommend(results, args.slo_ms),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Retrieval stage timings and recall over parameter sweeps.")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="Target corpus sizes in chunks (up to 1000000)")
+    parser.add_argument("--chunk-size", default="250", help="Comma-separated splitter chunk sizes")
+    parser.add_argument("--chunk-overlap", default="50", help="Comma-separated splitter overlaps")
+    parser.add_argument("--bm25-k", default="10", help="Comma-separated BM25 k values")
+    parser.add_argument("--vector-k", default="5", help="Comma-separated Chroma k values")
+    parser.add_argument("--top-n", default="3", help="Comma-separated final top_n values")
+    parser.add_argument("--queries", type=int, default=200, help="Labeled queries per corpus")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--slo-ms", type=float, default=200.0, help="p95 latency budget for the recommendation")
+    parser.add_argument("--no-rerank", action="store_true", help="Keep fusion order instead of Flashrank")
+    parser.add_argument("--corpus", help="Labeled corpus JSON to use instead of generating one")
+    parser.add_argument("--corpus-dir", help="Cache generated corpora here")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--verbose", action="store_true", help="Keep the app's console logging")
+    args = parser.parse_args()
+
+    with contextlib.ExitStack() as stack:
+        if not args.verbose:
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, "w"))))
+        report = main(args)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"--- Benchmark report written to {args.output} ---")
+    else:
+        print(output)
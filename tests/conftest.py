@@ -0,0 +1,16 @@
+import os
+import sys
+
+# App modules import each other as top-level modules (see Dockerfile / README)
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
+
+# No Redis server or model downloads in tests
+os.environ.setdefault("REDIS_BACKEND", "memory")
+os.environ.setdefault("LLM", "FAKE")
+os.environ.setdefault("EMBEDDINGS", "FAKE")
+# Fakes answer instantly unless a test asks for latency
+os.environ.setdefault("FAKE_LLM_LATENCY_MS", "0")
+os.environ.setdefault("FAKE_LLM_TOKEN_MS", "0")
+os.environ.setdefault("FAKE_EMBED_LATENCY_MS", "0")
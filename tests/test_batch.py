@@ -0,0 +1,65 @@
+import sys
+import uuid
+import asyncio
+import types
+import pytest
+from langchain_core.documents import Document
+import batch
+
+class StubRetriever:
+    """Stands in for retriever.final_retriever (no Chroma/Flashrank in tests)."""
+    def __init__(self):
+        self.loops = []
+        self.calls = []
+
+    async def abatch_invoke_with_metadata(self, queries):
+        self.loops.append(asyncio.get_running_loop())
+        self.calls.append(list(queries))
+        return [([Document(page_content=f"Policy text about {query}")], [f"doc-{i}"]) for i, query in enumerate(queries)]
+
+@pytest.fixture
+def retriever(monkeypatch):
+    stub = StubRetriever()
+    monkeypatch.setitem(sys.modules, "retriever", types.SimpleNamespace(final_retriever=stub))
+    return stub
+
+def test_batch_answer_returns_results_in_input_order(retriever):
+    queries = [f"question {i} {uuid.uuid4().hex}" for i in range(4)]
+    results = batch.batch_answer(queries)
+    assert [result["index"] for result in results] == [0, 1, 2, 3]
+    assert [result["query"] for result in results] == queries
+    assert all(result["response"] and not result["cached"] for result in results)
+    assert retriever.calls == [queries]
+
+def test_batch_answer_can_be_called_repeatedly(retriever):
+    queries = [f"repeat {i} {uuid.uuid4().hex}" for i in range(3)]
+    first = batch.batch_answer(queries)
+    second = batch.batch_answer(queries + ["new " + uuid.uuid4().hex])
+
+    assert all("error" not in result for result in first + second)
+    # Second call: cached answers skip retrieval, only the new query is retrieved
+    assert [result["cached"] for result in second] == [True, True, True, False]
+    assert [result["response"] for result in second[:3]] == [result["response"] for result in first]
+    # Both calls ran on the same loop, so loop-bound async clients stay usable
+    assert len(retriever.loops) == 2 and retriever.loops[0] is retriever.loops[1]
+
+def test_batch_answer_reports_retrieval_errors_per_query(monkeypatch):
+    class FailingRetriever:
+        async def abatch_invoke_with_metadata(self, queries):
+            raise RuntimeError("vector store down")
+
+    monkeypatch.setitem(sys.modules, "retriever", types.SimpleNamespace(final_retriever=FailingRetriever()))
+    queries = [f"fail {i} {uuid.uuid4().hex}" for i in range(2)]
+    results = batch.batch_answer(queries)
+    assert [result["error"] for result in results] == ["vector store down"] * 2
+
+def test_batch_answers_are_cached_apart_from_chain_responses(retriever):
+    from cache import get_hash, get_llm_cache, set_llm_cache
+    query = f"namespaced {uuid.uuid4().hex}"
+    # A session-aware /chat/chain answer for the same query is not served to the batch
+    set_llm_cache(f"chain_response:{get_hash(query)}", "answer shaped by a chat session")
+    [result] = batch.batch_answer([query])
+    assert not result["cached"] and result["response"] != "answer shaped by a chat session"
+    # ...and the batch answer does not land under the chain key
+    assert get_llm_cache(f"chain_response:{get_hash(query)}") == "answer shaped by a chat session"
+    assert get_llm_cache(f"batch_response:{get_hash(query)}") == result["response"]
@@ -0,0 +1,91 @@
+import time
+import asyncio
+import threading
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from batching import MicroBatcher
+
+class Recorder:
+    """Batched function that records the batches it receives."""
+    def __init__(self, fn=lambda items: [item * 2 for item in items], delay: float = 0.0):
+        self.fn = fn
+        self.delay = delay
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def __call__(self, items):
+        with self.lock:
+            self.batches.append(list(items))
+        time.sleep(self.delay)
+        return self.fn(items)
+
+def test_single_submit():
+    recorder = Recorder()
+    batcher = MicroBatcher(recorder, max_wait_ms=1)
+    assert batcher.submit(21) == 42
+    assert recorder.batches == [[21]]
+
+def test_concurrent_submits_share_a_batch():
+    recorder = Recorder()
+    batcher = MicroBatcher(recorder, max_batch_size=64, max_wait_ms=200)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(batcher.submit, range(8)))
+    assert results == [i * 2 for i in range(8)]
+    assert len(recorder.batches) < 8
+    assert sorted(item for batch in recorder.batches for item in batch) == list(range(8))
+
+def test_max_batch_size_splits_batches():
+    recorder = Recorder()
+    batcher = MicroBatcher(recorder, max_batch_size=3, max_wait_ms=200)
+    futures = [batcher.submit_future(i) for i in range(7)]
+    assert [future.result(timeout=5) for future in futures] == [i * 2 for i in range(7)]
+    assert all(len(batch) <= 3 for batch in recorder.batches)
+
+def test_timeout_flushes_partial_batch():
+    recorder = Recorder()
+    batcher = MicroBatcher(recorder, max_batch_size=100, max_wait_ms=20)
+    start = time.monotonic()
+    assert batcher.submit(1) == 2
+    # Flushed by the wait deadline, not by filling the batch
+    assert time.monotonic() - start < 2
+    assert recorder.batches == [[1]]
+
+def test_exception_fans_out_to_every_caller():
+    def fail(items):
+        raise ValueError("model down")
+
+    batcher = MicroBatcher(Recorder(fail), max_batch_size=64, max_wait_ms=100)
+    futures = [batcher.submit_future(i) for i in range(4)]
+    for future in futures:
+        with pytest.raises(ValueError, match="model down"):
+            future.result(timeout=5)
+    # The worker survives a failed batch
+    batcher.fn = Recorder()
+    assert batcher.submit(3) == 6
+
+def test_short_result_list_fails_every_caller():
+    batcher = MicroBatcher(Recorder(lambda items: [0] * (len(items) - 1)), max_batch_size=64, max_wait_ms=100)
+    futures = [batcher.submit_future(i) for i in range(3)]
+    for future in futures:
+        with pytest.raises(RuntimeError, match="returned 2 results for 3 items"):
+            future.result(timeout=5)
+
+def test_asubmit():
+    batcher = MicroBatcher(Recorder(), max_batch_size=64, max_wait_ms=50)
+
+    async def main():
+        return await asyncio.gather(*(batcher.asubmit(i) for i in range(5)))
+
+    assert asyncio.run(main()) == [0, 2, 4, 6, 8]
+
+def test_cancelled_caller_does_not_stop_worker():
+    batcher = MicroBatcher(Recorder(delay=0.05), max_batch_size=64, max_wait_ms=1)
+
+    async def main():
+        task = asyncio.create_task(batcher.asubmit(1))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.sleep(0.1)
+        return await batcher.asubmit(2)
+
+    assert asyncio.run(main()) == 4
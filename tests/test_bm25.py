@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+from rank_bm25 import BM25Okapi
+from bm25 import InvertedBM25Retriever, BM25IndexBuilder
+
+CORPUS = [
+    "we collect your name and email address",
+    "data is shared with partners for billing and tax audits",
+    "you may request deletion of your account and your data",
+    "cookies are used to remember your preferences",
+    "payment data is encrypted and stored securely",
+    "data data data retention lasts seven years",
+]
+
+@pytest.fixture
+def docs():
+    return [Document(page_content=text) for text in CORPUS]
+
+def reference_scores(query: str) -> np.ndarray:
+    return BM25Okapi([text.split() for text in CORPUS]).get_scores(query.split())
+
+@pytest.mark.parametrize("query", [
+    "data",
+    "your data",
+    "request deletion of account",
+    "data data payment",
+    "email cookies unknownterm",
+])
+def test_scores_match_bm25okapi(docs, query):
+    expected = reference_scores(query)
+    results = InvertedBM25Retriever.from_documents(docs).search(query, k=len(docs))
+    got = np.zeros(len(docs))
+    for idx, score in results:
+        got[idx] = score
+    # Chunks sharing no term with the query are not candidates (BM25Okapi scores them 0)
+    np.testing.assert_allclose(got, expected, rtol=1e-5, atol=1e-6)
+
+@pytest.mark.parametrize("query", ["your data", "payment data encrypted", "deletion account"])
+def test_top_k_matches_bm25okapi(docs, query):
+    expected = reference_scores(query)
+    matching = [i for i, text in enumerate(CORPUS) if set(query.split()) & set(text.split())]
+    ranked = [i for i in np.argsort(-expected, kind="stable") if i in matching]
+    results = InvertedBM25Retriever.from_documents(docs, k=2).search(query)
+    assert [idx for idx, _ in results] == ranked[:2]
+    assert [score for _, score in results] == sorted((score for _, score in results), reverse=True)
+
+def test_empty_query(docs):
+    bm25 = InvertedBM25Retriever.from_documents(docs)
+    assert bm25.search("") == []
+    assert bm25.invoke("") == []
+
+def test_unknown_terms_only(docs):
+    bm25 = InvertedBM25Retriever.from_documents(docs)
+    assert not reference_scores("zebra quantum").any()
+    assert bm25.search("zebra quantum") == []
+
+def test_invoke_returns_documents(docs):
+    bm25 = InvertedBM25Retriever.from_documents(docs, k=1)
+    assert bm25.invoke("cookies preferences") == [docs[3]]
+
+def test_builder_batches_match_single_build(docs):
+    builder = BM25IndexBuilder()
+    builder.add_documents(docs[:2])
+    builder.add_documents([])
+    builder.add_documents(docs[2:])
+    incremental = builder.build(docs)
+    full = InvertedBM25Retriever.from_documents(docs)
+    assert incremental.search("your data payment", k=6) == full.search("your data payment", k=6)
+
+def test_state_round_trip(docs):
+    bm25 = InvertedBM25Retriever.from_documents(docs)
+    restored = InvertedBM25Retriever.from_state(bm25.state_dict(), docs)
+    assert restored.search("data retention") == bm25.search("data retention")
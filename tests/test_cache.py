@@ -0,0 +1,142 @@
+import time
+import asyncio
+import uuid
+import pytest
+import cache
+from cache import LRUCache, _MISSING
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Controllable time.monotonic (shared by the L1 tier and the in-memory backend)."""
+    now = [time.monotonic()]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    return now
+
+def llm_key() -> str:
+    return f"llm:{uuid.uuid4().hex}"
+
+def test_lru_evicts_least_recently_used():
+    lru = LRUCache(capacity=2, ttl=60)
+    lru.set("a", 1)
+    lru.set("b", 2)
+    assert lru.get("a") == 1
+    lru.set("c", 3)
+    assert lru.get("b") is _MISSING
+    assert lru.get("a") == 1
+    assert lru.get("c") == 3
+    assert len(lru) == 2
+
+def test_lru_overwrite_refreshes_recency():
+    lru = LRUCache(capacity=2, ttl=60)
+    lru.set("a", 1)
+    lru.set("b", 2)
+    lru.set("a", 10)
+    lru.set("c", 3)
+    assert lru.get("a") == 10
+    assert lru.get("b") is _MISSING
+
+def test_lru_hit_miss_counters():
+    lru = LRUCache(capacity=2, ttl=60)
+    lru.set("a", 1)
+    lru.get("a")
+    lru.get("missing")
+    assert (lru.hits, lru.misses) == (1, 1)
+
+def test_lru_zero_capacity_stores_nothing():
+    lru = LRUCache(capacity=0, ttl=60)
+    lru.set("a", 1)
+    assert lru.get("a") is _MISSING
+
+def test_lru_ttl_expiry(clock):
+    lru = LRUCache(capacity=10, ttl=10)
+    lru.set("a", 1)
+    clock[0] += 9
+    assert lru.get("a") == 1
+    clock[0] += 2
+    assert lru.get("a") is _MISSING
+    assert len(lru) == 0
+
+def test_lru_entry_expiry_capped_by_value_ttl(clock):
+    lru = LRUCache(capacity=10, ttl=300)
+    lru.set("a", 1, expire=5)
+    clock[0] += 6
+    assert lru.get("a") is _MISSING
+
+def test_l1_serves_until_ttl_then_reads_redis(clock):
+    key = llm_key()
+    cache.set_cache(key, "answer")
+    cache.redis_client.set(key, "newer")
+    assert cache.get_cache(key) == "answer"
+    clock[0] += cache.L1_TTL + 1
+    assert cache.get_cache(key) == "newer"
+
+def test_invalidate_drops_both_tiers():
+    key = llm_key()
+    cache.set_cache(key, "answer")
+    cache.invalidate(key)
+    assert cache._l1_get(key) is _MISSING
+    assert cache.get_cache(key) is None
+
+def test_writes_publish_invalidations(monkeypatch):
+    published = []
+    monkeypatch.setattr(cache, "CACHE_INVALIDATION", True)
+    monkeypatch.setattr(cache._raw_client, "publish", lambda channel, message: published.append((channel, message)))
+    key = llm_key()
+    cache.set_cache(key, "answer")
+    assert published == [(cache.INVALIDATION_CHANNEL, f"{cache.WORKER_ID}|{key}")]
+
+def test_invalidation_from_other_worker_drops_l1(monkeypatch):
+    key = llm_key()
+    cache._l1_set(key, "stale")
+    # Own messages are ignored (the write already updated this worker's L1)
+    cache._on_invalidation({"data": f"{cache.WORKER_ID}|{key}"})
+    assert cache._l1_get(key) == "stale"
+    cache._on_invalidation({"data": f"other-worker|{key}"})
+    assert cache._l1_get(key) is _MISSING
+
+def test_invalidation_round_trip_between_workers(monkeypatch):
+    """A write on one worker evicts the key from another worker's L1 over pub/sub."""
+    handlers, published = {}, []
+
+    class FakePubSub:
+        def subscribe(self, **channel_handlers):
+            handlers.update(channel_handlers)
+
+        def run_in_thread(self, **kwargs):
+            return "listener"
+
+    monkeypatch.setattr(cache, "CACHE_INVALIDATION", True)
+    monkeypatch.setattr(cache.redis_client, "pubsub", lambda **kwargs: FakePubSub())
+    monkeypatch.setattr(cache._raw_client, "publish", lambda channel, message: published.append((channel, message)))
+    assert cache.start_invalidation_listener() == "listener"
+
+    key = llm_key()
+    # Worker A writes (both workers share this process, so swap the worker ID)
+    worker_b = cache.WORKER_ID
+    monkeypatch.setattr(cache, "WORKER_ID", "worker-a")
+    cache.set_cache(key, "fresh")
+    monkeypatch.setattr(cache, "WORKER_ID", worker_b)
+
+    # Worker B still holds a stale L1 copy until the message arrives
+    cache._l1_set(key, "stale")
+    for channel, message in published:
+        handlers[channel]({"channel": channel, "data": message})
+    assert cache._l1_get(key) is _MISSING
+    assert cache.get_cache(key) == "fresh"
+
+@pytest.mark.parametrize("value", ["answer", '{"a": 1}', "42", {"a": [1, 2]}, [{"id": "x", "score": 0.5}]])
+def test_l1_and_redis_return_the_same_value(value):
+    key = llm_key()
+    cache.set_cache(key, value)
+    from_l1 = cache.get_cache(key)
+    cache._l1[cache._namespace(key)].delete(key)
+    assert from_l1 == cache.get_cache(key)
+
+def test_async_writes_publish_invalidations(monkeypatch):
+    published = []
+    monkeypatch.setattr(cache, "CACHE_INVALIDATION", True)
+    monkeypatch.setattr(cache._raw_client, "publish", lambda channel, message: published.append((channel, message)))
+    key = llm_key()
+    asyncio.run(cache.aset_cache(key, "answer"))
+    assert published == [(cache.INVALIDATION_CHANNEL, f"{cache.WORKER_ID}|{key}")]
+    assert cache._l1_get(key) == "answer"
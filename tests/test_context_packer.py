@@ -0,0 +1,58 @@
+import sys
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+import context_packer
+
+def test_concurrent_first_calls_wait_for_one_load(monkeypatch):
+    loads = []
+
+    class SlowTokenizer:
+        @staticmethod
+        def from_pretrained(name, auth_token=None):
+            loads.append(name)
+            time.sleep(0.1)
+            return SlowTokenizer()
+
+    monkeypatch.setitem(sys.modules, "tokenizers", types.SimpleNamespace(Tokenizer=SlowTokenizer))
+    monkeypatch.setattr(context_packer, "_tokenizer", None)
+    monkeypatch.setattr(context_packer, "_tokenizer_loaded", False)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda _: context_packer.get_tokenizer(), range(8)))
+
+    assert len(loads) == 1
+    # Nobody fell back to the heuristic while the load was in progress
+    assert all(isinstance(result, SlowTokenizer) for result in results)
+    assert len({id(result) for result in results}) == 1
+
+def test_failed_load_falls_back_once(monkeypatch):
+    loads = []
+
+    class BrokenTokenizer:
+        @staticmethod
+        def from_pretrained(name, auth_token=None):
+            loads.append(name)
+            raise OSError("offline")
+
+    monkeypatch.setitem(sys.modules, "tokenizers", types.SimpleNamespace(Tokenizer=BrokenTokenizer))
+    monkeypatch.setattr(context_packer, "_tokenizer", None)
+    monkeypatch.setattr(context_packer, "_tokenizer_loaded", False)
+
+    assert context_packer.get_tokenizer() is None
+    assert context_packer.get_tokenizer() is None
+    assert len(loads) == 1
+
+def test_token_counting_mode_is_reported(monkeypatch):
+    from metrics import PROMPT_TOKENIZER_EXACT
+
+    class BrokenTokenizer:
+        @staticmethod
+        def from_pretrained(name, auth_token=None):
+            raise OSError("gated repo")
+
+    monkeypatch.setitem(sys.modules, "tokenizers", types.SimpleNamespace(Tokenizer=BrokenTokenizer))
+    monkeypatch.setattr(context_packer, "_tokenizer", None)
+    monkeypatch.setattr(context_packer, "_tokenizer_loaded", False)
+    context_packer.get_tokenizer()
+    assert f'rag_prompt_tokenizer_exact{{tokenizer="{context_packer.PROMPT_TOKENIZER}"}} 0' in PROMPT_TOKENIZER_EXACT.render()
@@ -0,0 +1,73 @@
+import asyncio
+import uuid
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from embeddings import CachedEmbeddings, embeddings
+from fakes import FakeEmbeddings
+from observability import start_trace
+
+class CountingEmbeddings(FakeEmbeddings):
+    """Fake model that records every text it actually encodes."""
+    def __init__(self):
+        super().__init__(dim=16, latency_ms=20)
+        self.encoded = []
+
+    def embed_documents(self, texts):
+        self.encoded.extend(texts)
+        return super().embed_documents(texts)
+
+def unique(text: str) -> str:
+    return f"{text} {uuid.uuid4().hex}"
+
+def test_fake_model_is_wrapped_by_the_cache():
+    assert isinstance(embeddings, CachedEmbeddings)
+    assert isinstance(embeddings.model_to_wrap, FakeEmbeddings)
+
+def test_query_embedding_is_cached():
+    model = CountingEmbeddings()
+    cached = CachedEmbeddings(model)
+    text = unique("what data do you collect")
+    first = cached.embed_query(text)
+    second = cached.embed_query(text)
+    assert model.encoded == [text]
+    np.testing.assert_allclose(first, second)
+    assert first.dtype == np.float32
+
+def test_query_embedding_records_embed_span():
+    trace = start_trace()
+    CachedEmbeddings(CountingEmbeddings()).embed_query(unique("span"))
+    assert [span["name"] for span in trace.spans] == ["embed"]
+
+def test_concurrent_query_misses_share_one_forward_pass():
+    model = CountingEmbeddings()
+    cached = CachedEmbeddings(model)
+    text = unique("same question")
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        vectors = list(pool.map(lambda _: cached.embed_query(text), range(6)))
+    assert model.encoded == [text]
+    for vector in vectors:
+        np.testing.assert_allclose(vector, vectors[0])
+
+def test_async_query_embedding():
+    model = CountingEmbeddings()
+    cached = CachedEmbeddings(model)
+    texts = [unique("async") for _ in range(3)]
+
+    async def run():
+        return await asyncio.gather(*(cached.aembed_query(text) for text in texts + texts))
+
+    vectors = asyncio.run(run())
+    assert sorted(model.encoded) == sorted(texts)
+    np.testing.assert_allclose(vectors[0], vectors[3])
+
+def test_documents_only_encode_misses_once():
+    model = CountingEmbeddings()
+    cached = CachedEmbeddings(model, embed_batch_size=2)
+    texts = [unique(f"chunk {i}") for i in range(3)]
+    first = cached.embed_documents(texts + texts[:1])
+    assert sorted(model.encoded) == sorted(texts)
+    second = cached.embed_documents(texts)
+    assert len(model.encoded) == 3
+    for a, b in zip(first, second):
+        np.testing.assert_allclose(a, b)
+    np.testing.assert_allclose(cached.embed_query(texts[0]), first[0])
@@ -0,0 +1,184 @@
+import json
+import time
+import uuid
+import asyncio
+import pytest
+import memory
+from langchain_core.messages import AIMessage, HumanMessage
+from redis_backend import InMemoryBackend, AsyncInMemoryBackend
+
+@pytest.fixture(params=["memory", "lua"])
+def clients(request, monkeypatch):
+    """Point memory.py at the in-memory backend, or at fakeredis to run the real Lua scripts."""
+    if request.param == "memory":
+        backend = InMemoryBackend()
+        sync_client, async_client = backend, AsyncInMemoryBackend(backend)
+    else:
+        fakeredis = pytest.importorskip("fakeredis")
+        pytest.importorskip("lupa")
+        server = fakeredis.FakeServer()
+        sync_client = fakeredis.FakeRedis(server=server, decode_responses=True)
+        async_client = fakeredis.aioredis.FakeRedis(server=server, decode_responses=True)
+    monkeypatch.setattr(memory, "redis_client", sync_client)
+    monkeypatch.setattr(memory, "async_redis_client", async_client)
+    return sync_client, async_client
+
+def manager(**kwargs) -> memory.ChatMemoryManager:
+    return memory.ChatMemoryManager(session_id=uuid.uuid4().hex, **kwargs)
+
+def stored_tokens(chat: memory.ChatMemoryManager) -> int:
+    return sum(chat.estimate_tokens([m]) for m in chat.get_history())
+
+def counter(chat: memory.ChatMemoryManager) -> int:
+    return int(memory.redis_client.get(chat.tokens_key) or 0)
+
+def test_counter_tracks_appends(clients):
+    chat = manager()
+    chat.add_message(HumanMessage(content="What data do you collect about me?"))
+    chat.add_message(AIMessage(content="Name, email address and payment details."))
+    assert counter(chat) == stored_tokens(chat) > 0
+
+def test_cap_keeps_counter_equal_to_stored_messages(clients, monkeypatch):
+    monkeypatch.setattr(memory, "MAX_HISTORY_MESSAGES", 3)
+    chat = manager()
+    for i in range(7):
+        chat.add_message(HumanMessage(content=f"message {i} " + "word " * (i + 1)))
+    history = chat.get_history()
+    assert [m.content.split()[1] for m in history] == ["4", "5", "6"]
+    assert counter(chat) == stored_tokens(chat)
+
+def test_add_message_and_get_context_single_round_trip(clients, monkeypatch):
+    chat = manager(window_size=1, token_threshold=10)
+    chat.set_summary("Earlier: the user asked about cookies.")
+    chat.add_message(HumanMessage(content="first question"))
+    chat.add_message(AIMessage(content="first answer"))
+
+    executed = []
+    pipeline = memory.redis_client.pipeline
+
+    def counting_pipeline(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        execute = pipe.execute
+        pipe.execute = lambda: executed.append(1) or execute()
+        return pipe
+
+    monkeypatch.setattr(memory.redis_client, "pipeline", counting_pipeline)
+    window, summary, needs_summary = chat.add_message_and_get_context(HumanMessage(content="second question " * 20))
+    assert len(executed) == 1
+    assert [m.content for m in window] == ["first answer", "second question " * 20]
+    assert summary == "Earlier: the user asked about cookies."
+    assert needs_summary
+
+def test_async_add_message_and_get_context(clients):
+    chat = manager(window_size=1, token_threshold=1000)
+
+    async def run():
+        await chat.aadd_message(HumanMessage(content="hello"))
+        return await chat.aadd_message_and_get_context(AIMessage(content="hi there"))
+
+    window, summary, needs_summary = asyncio.run(run())
+    assert [m.content for m in window] == ["hello", "hi there"]
+    assert summary is None
+    assert not needs_summary
+    assert counter(chat) == stored_tokens(chat)
+
+def test_messages_without_token_field_are_readable(clients):
+    chat = manager()
+    memory.redis_client.rpush(chat.history_key, json.dumps({"type": "human", "content": "legacy"}))
+    chat.add_message(AIMessage(content="new"))
+    assert [m.content for m in chat.get_history()] == ["legacy", "new"]
+
+def test_apply_summary_keeps_messages_appended_meanwhile(clients):
+    chat = manager()
+    for i in range(4):
+        chat.add_message(HumanMessage(content=f"old {i}"))
+    summarized = [raw for raw, _ in chat.get_history_entries()[:3]]
+    chat.add_message(AIMessage(content="new while summarizing"))
+
+    assert chat.apply_summary("summary of old 0-2", summarized) == 3
+    assert [m.content for m in chat.get_history()] == ["old 3", "new while summarizing"]
+    assert chat.get_summary() == "summary of old 0-2"
+    assert counter(chat) == stored_tokens(chat)
+
+def test_apply_summary_after_head_moved(clients, monkeypatch):
+    """The cap trims the oldest messages while the summary is generated: nothing newer is lost."""
+    monkeypatch.setattr(memory, "MAX_HISTORY_MESSAGES", 4)
+    chat = manager()
+    for i in range(4):
+        chat.add_message(HumanMessage(content=f"old {i}"))
+    summarized = [raw for raw, _ in chat.get_history_entries()[:3]]
+    for i in range(2):
+        chat.add_message(AIMessage(content=f"new {i}"))
+    assert [m.content for m in chat.get_history()] == ["old 2", "old 3", "new 0", "new 1"]
+
+    assert chat.apply_summary("summary", summarized) == 1
+    assert [m.content for m in chat.get_history()] == ["old 3", "new 0", "new 1"]
+    assert counter(chat) == stored_tokens(chat)
+
+def test_apply_summary_identical_messages_removed_by_identity(clients):
+    chat = manager()
+    for _ in range(3):
+        chat.add_message(HumanMessage(content="ok"))
+    summarized = [raw for raw, _ in chat.get_history_entries()[:1]]
+    memory.redis_client.ltrim(chat.history_key, 1, -1)
+    # The summarized "ok" is gone; the other two identical messages must survive
+    assert chat.apply_summary("summary", summarized) == 0
+    assert len(chat.get_history()) == 2
+    assert chat.get_summary() is None
+
+def test_apply_summary_after_clear_is_discarded(clients):
+    chat = manager()
+    chat.add_message(HumanMessage(content="hello"))
+    summarized = [raw for raw, _ in chat.get_history_entries()]
+    chat.clear_history()
+    assert chat.apply_summary("summary", summarized) == 0
+    assert chat.get_summary() is None
+    assert counter(chat) == 0
+
+def test_background_summarizer_run(clients):
+    from summarizer import BackgroundSummarizer
+
+    chat = manager()
+    for i in range(3):
+        chat.add_message(HumanMessage(content=f"turn {i}"))
+
+    class Model:
+        def summarize_conversation(self, messages):
+            # A new turn lands while the summary is being generated
+            chat.add_message(AIMessage(content="late reply"))
+            return "summary: " + ", ".join(m.content for m in messages)
+
+    BackgroundSummarizer(Model(), workers=1)._run(chat)
+    assert chat.get_summary() == "summary: turn 0, turn 1"
+    assert [m.content for m in chat.get_history()] == ["turn 2", "late reply"]
+    assert counter(chat) == stored_tokens(chat)
+
+def test_summary_lock_release_leaves_a_takeover_lock(clients):
+    chat = manager()
+    first = chat.try_lock_summary(ttl=1)
+    assert first and chat.try_lock_summary(ttl=1) is None
+    # The first job overruns its TTL and another worker takes the lock
+    time.sleep(1.1)
+    second = chat.try_lock_summary(ttl=30)
+    assert second and second != first
+    chat.release_summary_lock(first)
+    assert memory.redis_client.get(chat.lock_key) == second
+    assert chat.try_lock_summary(ttl=30) is None
+    chat.release_summary_lock(second)
+    assert memory.redis_client.get(chat.lock_key) is None
+
+def test_background_summarizer_releases_only_its_own_lock(clients):
+    from summarizer import BackgroundSummarizer
+
+    chat = manager()
+    for i in range(3):
+        chat.add_message(HumanMessage(content=f"turn {i}"))
+
+    class Model:
+        def summarize_conversation(self, messages):
+            # The job's lock expired meanwhile and another worker holds it now
+            memory.redis_client.set(chat.lock_key, "other-worker", ex=30)
+            return "summary"
+
+    BackgroundSummarizer(Model(), workers=1)._run(chat)
+    assert memory.redis_client.get(chat.lock_key) == "other-worker"
@@ -0,0 +1,35 @@
+from langchain_core.messages import AIMessage, HumanMessage
+from fakes import FakeChatModel
+from observability import TokenUsageCallback, get_token_usage, get_token_usage_from_metadata
+
+def test_usage_from_usage_metadata():
+    message = AIMessage(content="hi", usage_metadata={"input_tokens": 3, "output_tokens": 2, "total_tokens": 5})
+    assert get_token_usage(message) == {"input_tokens": 3, "output_tokens": 2, "total_tokens": 5}
+
+def test_usage_from_bedrock_response_metadata():
+    message = AIMessage(content="hi", response_metadata={"usage": {"prompt_tokens": 7, "completion_tokens": 4}})
+    assert get_token_usage(message) == {"input_tokens": 7, "output_tokens": 4, "total_tokens": 11}
+    assert get_token_usage_from_metadata({}) == {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+
+def test_usage_from_callback_sums_every_call():
+    model = FakeChatModel(latency_ms=0, token_ms=0)
+    callback = TokenUsageCallback()
+    first = model.invoke([HumanMessage(content="What data do you collect?")], config={"callbacks": [callback]})
+    second = model.invoke([HumanMessage(content="Thought: look it up")], config={"callbacks": [callback]})
+
+    usage = callback.usage
+    expected = [get_token_usage(first), get_token_usage(second)]
+    assert usage == {key: sum(u[key] for u in expected) for key in usage}
+    assert usage["total_tokens"] > 0
+
+def test_usage_from_callback_reads_response_metadata():
+    """Providers that only report usage in response_metadata (Bedrock) are counted too."""
+    from langchain_core.outputs import ChatGeneration, LLMResult
+
+    callback = TokenUsageCallback()
+    message = AIMessage(content="hi", response_metadata={"usage": {"prompt_tokens": 7, "completion_tokens": 4}})
+    callback.on_llm_end(LLMResult(generations=[[ChatGeneration(message=message)]]))
+    assert callback.usage == {"input_tokens": 7, "output_tokens": 4, "total_tokens": 11}
+
+def test_usage_from_callback_without_calls():
+    assert TokenUsageCallback().usage == {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
@@ -0,0 +1,202 @@
+import time
+import pytest
+import redis
+from redis_backend import CircuitBreaker, InMemoryBackend, ResilientRedis
+
+# (start, end) -> what Redis returns for LRANGE on [0, 1, 2, 3, 4]
+LRANGE_CASES = [
+    ((0, -1), [0, 1, 2, 3, 4]),
+    ((0, 0), [0]),
+    ((1, 3), [1, 2, 3]),
+    ((-2, -1), [3, 4]),
+    ((-3, 3), [2, 3]),
+    ((0, 10), [0, 1, 2, 3, 4]),
+    ((-10, 1), [0, 1]),
+    ((-10, -6), []),
+    ((0, -6), []),
+    ((0, -7), []),
+    ((3, 1), []),
+    ((5, 10), []),
+    ((-1, -2), []),
+]
+
+@pytest.fixture
+def backend():
+    backend = InMemoryBackend()
+    backend.rpush("list", 0, 1, 2, 3, 4)
+    return backend
+
+@pytest.mark.parametrize("bounds, expected", LRANGE_CASES)
+def test_lrange_matches_redis(backend, bounds, expected):
+    assert backend.lrange("list", *bounds) == expected
+
+@pytest.mark.parametrize("bounds, expected", LRANGE_CASES)
+def test_ltrim_matches_redis(backend, bounds, expected):
+    assert backend.ltrim("list", *bounds)
+    assert backend.lrange("list", 0, -1) == expected
+    assert backend.llen("list") == len(expected)
+    if not expected:
+        assert backend.get("list") is None
+
+def test_list_commands_on_missing_key(backend):
+    assert backend.lrange("missing", 0, -1) == []
+    assert backend.llen("missing") == 0
+    assert backend.ltrim("missing", 0, 1)
+    assert backend.get("missing") is None
+
+def test_rpush_returns_length_and_keeps_order(backend):
+    assert backend.rpush("list", 5, 6) == 7
+    assert backend.lrange("list", -3, -1) == [4, 5, 6]
+
+def test_lrange_returns_a_copy(backend):
+    backend.lrange("list", 0, -1).append(99)
+    assert backend.llen("list") == 5
+
+def test_expiry(backend, monkeypatch):
+    now = time.monotonic()
+    backend.set("key", "value", ex=10)
+    backend.expire("list", 10)
+    monkeypatch.setattr(time, "monotonic", lambda: now + 11)
+    assert backend.get("key") is None
+    assert backend.lrange("list", 0, -1) == []
+
+def test_set_nx(backend):
+    assert backend.set("lock", "a", nx=True, ex=5)
+    assert backend.set("lock", "b", nx=True, ex=5) is None
+    assert backend.get("lock") == "a"
+
+def test_max_keys_evicts_oldest():
+    backend = InMemoryBackend(max_keys=2)
+    for key in ("a", "b", "c"):
+        backend.set(key, key)
+    assert backend.mget("a", "b", "c") == [None, "b", "c"]
+
+def test_pipeline_runs_queued_commands(backend):
+    pipe = backend.pipeline()
+    pipe.rpush("list", 5).incrby("counter", 3).lrange("list", -2, -1)
+    assert pipe.execute() == [6, 3, [4, 5]]
+
+# --- Circuit breaker ---
+
+class FlakyProbe:
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise redis.ConnectionError("still down")
+        return True
+
+def wait_until(condition, timeout: float = 2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.005)
+    return False
+
+def test_breaker_opens_at_threshold():
+    breaker = CircuitBreaker(probe=FlakyProbe(failures=1000), threshold=3, cooldown=60)
+    breaker.record_failure(redis.ConnectionError())
+    breaker.record_failure(redis.ConnectionError())
+    assert breaker.allow()
+    breaker.record_failure(redis.ConnectionError())
+    assert not breaker.allow()
+
+def test_success_resets_failure_count():
+    breaker = CircuitBreaker(probe=FlakyProbe(failures=0), threshold=2, cooldown=60)
+    breaker.record_failure(redis.ConnectionError())
+    breaker.record_success()
+    breaker.record_failure(redis.ConnectionError())
+    assert breaker.allow()
+
+def test_breaker_stays_open_until_probe_succeeds():
+    probe = FlakyProbe(failures=2)
+    breaker = CircuitBreaker(probe=probe, threshold=1, cooldown=0.01)
+    breaker.record_failure(redis.ConnectionError())
+    assert not breaker.allow()
+    # Probes are the only traffic while open (half-open): two fail, the third closes the breaker
+    assert wait_until(breaker.allow)
+    assert probe.calls == 3
+    assert breaker.failures == 0
+
+class FakeRedis:
+    """Client whose availability can be switched off."""
+    def __init__(self):
+        self.up = True
+        self.calls = 0
+        self.data = {}
+
+    def _check(self):
+        self.calls += 1
+        if not self.up:
+            raise redis.ConnectionError("connection refused")
+
+    def ping(self):
+        self._check()
+        return True
+
+    def get(self, key):
+        self._check()
+        return self.data.get(key)
+
+    def set(self, key, value, **kwargs):
+        self._check()
+        self.data[key] = value
+        return True
+
+def test_resilient_client_falls_back_and_recovers():
+    client = FakeRedis()
+    breaker = CircuitBreaker(probe=client.ping, threshold=2, cooldown=0.01)
+    fallback = InMemoryBackend()
+    resilient = ResilientRedis(client, breaker, fallback)
+
+    assert resilient.set("key", "redis")
+    client.up = False
+    # Below the threshold the failure still reaches the caller's fallback, breaker stays closed
+    assert resilient.get("key") is None
+    assert breaker.allow()
+    resilient.get("key")
+    assert not breaker.allow()
+
+    # Open: calls skip Redis entirely and use the fallback store
+    calls = client.calls
+    assert resilient.set("key", "fallback")
+    assert resilient.get("key") == "fallback"
+    assert resilient.pipeline().set("other", 1).get("other").execute() == [True, 1]
+    assert client.calls == calls
+
+    client.up = True
+    assert wait_until(breaker.allow)
+    assert resilient.get("key") == "redis"
+
+def test_resilient_client_without_fallback_raises():
+    client = FakeRedis()
+    client.up = False
+    breaker = CircuitBreaker(probe=FlakyProbe(failures=1000), threshold=1, cooldown=60)
+    resilient = ResilientRedis(client, breaker, None)
+    with pytest.raises(redis.ConnectionError):
+        resilient.get("key")
+    with pytest.raises(redis.ConnectionError, match="circuit open"):
+        resilient.get("key")
+
+@pytest.mark.parametrize("count, expected_removed, expected", [
+    (1, 1, ["b", "a", "c", "a"]),
+    (2, 2, ["b", "c", "a"]),
+    (-1, 1, ["a", "b", "a", "c"]),
+    (0, 3, ["b", "c"]),
+])
+def test_lrem_matches_redis(count, expected_removed, expected):
+    backend = InMemoryBackend()
+    backend.rpush("list", "a", "b", "a", "c", "a")
+    assert backend.lrem("list", count, "a") == expected_removed
+    assert backend.lrange("list", 0, -1) == expected
+
+def test_lrem_last_item_deletes_key():
+    backend = InMemoryBackend()
+    backend.rpush("list", "a")
+    assert backend.lrem("list", 1, "a") == 1
+    assert backend.get("list") is None
+    assert backend.lrem("list", 1, "a") == 0
@@ -0,0 +1,107 @@
+import sys
+import time
+import uuid
+import types
+import threading
+import importlib
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.documents import Document
+from bm25 import InvertedBM25Retriever
+
+def _words(text: str) -> set:
+    return set(text.lower().split())
+
+class StubRanker:
+    """Flashrank stand-in: scores a passage by the words it shares with the query."""
+    def rerank(self, request):
+        results = [{"id": p["id"], "score": float(len(_words(request.query) & _words(p["text"])))} for p in request.passages]
+        return sorted(results, key=lambda r: r["score"], reverse=True)
+
+class StubVectorStore:
+    """Chroma stand-in with the public API the retriever uses; `gate` holds searches back."""
+    def __init__(self, docs):
+        self.docs = docs
+        self.searches = []
+        self.gate = threading.Event()
+        self.gate.set()
+        self.embeddings = types.SimpleNamespace(embed_documents=lambda texts: [[0.0] for _ in texts])
+
+    def similarity_search_with_relevance_scores(self, query, k=4):
+        self.searches.append(query)
+        self.gate.wait(5)
+        scored = [(doc, len(_words(query) & _words(doc.page_content)) / 10) for doc in self.docs]
+        return sorted(scored, key=lambda hit: hit[1], reverse=True)[:k]
+
+@pytest.fixture(scope="module")
+def retriever_module():
+    """Import retriever.py with Flashrank, Chroma and the on-disk snapshot stubbed out."""
+    docs = [
+        Document(page_content="we collect your email address and name", metadata={"source": "policy.pdf", "page": 1}),
+        Document(page_content="you can delete your account at any time", metadata={"source": "policy.pdf", "page": 2}),
+        Document(page_content="cookies remember your language settings", metadata={"source": "cookies.pdf", "page": 1}),
+    ]
+    store = StubVectorStore(docs)
+    stubs = {
+        "flashrank": types.SimpleNamespace(Ranker=StubRanker, RerankRequest=lambda query, passages: types.SimpleNamespace(query=query, passages=passages)),
+        "vectorstore": types.SimpleNamespace(vector_store=types.SimpleNamespace(
+            as_retriever=lambda search_kwargs: types.SimpleNamespace(vectorstore=store, search_kwargs=search_kwargs)
+        )),
+        "snapshot": types.SimpleNamespace(load_or_build_snapshot=lambda: (docs, InvertedBM25Retriever.from_documents(docs))),
+    }
+    with pytest.MonkeyPatch.context() as mp:
+        for name, module in stubs.items():
+            mp.setitem(sys.modules, name, module)
+        mp.delitem(sys.modules, "retriever", raising=False)
+        module = importlib.import_module("retriever")
+        yield module, store
+        sys.modules.pop("retriever", None)
+
+@pytest.fixture
+def make_retriever(retriever_module):
+    module, store = retriever_module
+    store.searches.clear()
+
+    def make(**kwargs):
+        return module.ManualHybridRetriever(module.chroma_retriever, module.bm25_retriever, StubRanker(), **kwargs)
+    return make
+
+def test_batch_matches_single_retrieval(make_retriever):
+    tag = uuid.uuid4().hex
+    queries = [f"delete account {tag}", f"email address {tag}"]
+    batched = make_retriever().batch_invoke_with_metadata(queries)
+    single = [make_retriever()._retrieve(query) for query in queries]
+    assert [docs for docs, _ in batched] == [[doc for doc, _ in hits] for hits in single]
+
+def test_batch_reports_groups_that_skip_the_reranker(make_retriever, monkeypatch, retriever_module):
+    module, _ = retriever_module
+    spans = []
+    monkeypatch.setattr(module, "record_span", lambda name, ms, **attrs: spans.append((name, attrs)))
+    # Top-1 of both legs agree for the first query; BM25 finds nothing for the second
+    retriever = make_retriever(agreement_top=1)
+    queries = [f"delete your account {uuid.uuid4().hex}", f"zebra {uuid.uuid4().hex}"]
+    retriever.batch_invoke_with_metadata(queries)
+    legs = [retriever._legs_agree(retriever._vector_search(q), retriever._bm25_search(q)) for q in queries]
+    assert legs == [True, False]
+    assert dict(spans)["rerank"]["skipped"] == 1
+
+def test_batch_waits_for_an_in_flight_single_request(make_retriever, retriever_module):
+    _, store = retriever_module
+    retriever = make_retriever()
+    query, other = f"cookies language {uuid.uuid4().hex}", f"email name {uuid.uuid4().hex}"
+
+    store.gate.clear()
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        single = pool.submit(retriever.invoke, query)
+        while query not in store.searches:
+            pass
+        batch = pool.submit(retriever.batch_invoke_with_metadata, [query, other])
+        # Let the batch reach the query's flight while the single request still holds it
+        time.sleep(0.2)
+        store.gate.set()
+        single_docs, batched = single.result(timeout=5), batch.result(timeout=5)
+
+    assert batched[0][0] == single_docs
+    # The batch took the single request's result instead of retrieving the query again
+    assert store.searches.count(query) == 1
+    assert store.searches.count(other) == 1
@@ -0,0 +1,201 @@
+import time
+import asyncio
+import threading
+import pytest
+import singleflight
+from concurrent.futures import ThreadPoolExecutor
+from redis_backend import InMemoryBackend, AsyncInMemoryBackend
+from singleflight import SingleFlight
+
+@pytest.fixture(params=["memory", "lua"])
+def redis_clients(request, monkeypatch):
+    """Lock backend: the in-memory store, or fakeredis to run the real Lua scripts."""
+    if request.param == "memory":
+        backend = InMemoryBackend()
+        sync_client, async_client = backend, AsyncInMemoryBackend(backend)
+    else:
+        fakeredis = pytest.importorskip("fakeredis")
+        pytest.importorskip("lupa")
+        server = fakeredis.FakeServer()
+        sync_client = fakeredis.FakeRedis(server=server, decode_responses=True)
+        async_client = fakeredis.aioredis.FakeRedis(server=server, decode_responses=True)
+    monkeypatch.setattr(singleflight, "redis_client", sync_client)
+    monkeypatch.setattr(singleflight, "async_redis_client", async_client)
+    return sync_client
+
+def run_leader_and_followers(flights: SingleFlight, key: str, compute, callers: int = 5):
+    """Start `callers` threads on `key`; the first becomes leader and runs `compute` once released."""
+    release = threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        release.wait(5)
+        return compute()
+
+    with ThreadPoolExecutor(max_workers=callers) as pool:
+        futures = [pool.submit(flights.do, key, work)]
+        # Followers join while the leader is blocked
+        while not flights._calls:
+            time.sleep(0.001)
+        futures += [pool.submit(flights.do, key, work) for _ in range(callers - 1)]
+        time.sleep(0.05)
+        release.set()
+        outcomes = []
+        for future in futures:
+            try:
+                outcomes.append(future.result(timeout=5))
+            except Exception as e:
+                outcomes.append(e)
+    return calls, outcomes
+
+def test_lead_computes_once_for_concurrent_callers():
+    calls, outcomes = run_leader_and_followers(SingleFlight("test", distributed=False), "key", lambda: "value")
+    assert len(calls) == 1
+    assert outcomes[0] == ("value", False)
+    assert outcomes[1:] == [("value", True)] * 4
+
+def test_lead_propagates_leader_exception_to_followers():
+    def fail():
+        raise ValueError("upstream down")
+
+    flights = SingleFlight("test", distributed=False)
+    calls, outcomes = run_leader_and_followers(flights, "key", fail)
+    assert len(calls) == 1
+    assert all(isinstance(outcome, ValueError) and str(outcome) == "upstream down" for outcome in outcomes)
+    # The failed call is not remembered: the next caller computes again
+    assert flights.do("key", lambda: "recovered") == ("recovered", False)
+
+def test_alead_computes_once_for_concurrent_tasks():
+    flights = SingleFlight("test", distributed=False)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "value"
+
+    async def main():
+        return await asyncio.gather(*(flights.ado("key", compute) for _ in range(5)))
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert sorted(results, key=lambda r: r[1]) == [("value", False)] + [("value", True)] * 4
+
+def test_alead_propagates_leader_exception_to_followers():
+    flights = SingleFlight("test", distributed=False)
+
+    async def compute():
+        await asyncio.sleep(0.05)
+        raise ValueError("upstream down")
+
+    async def main():
+        return await asyncio.gather(*(flights.ado("key", compute) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(r, ValueError) for r in results)
+
+def test_alead_cancelled_leader_fails_followers_and_follower_cancel_is_isolated():
+    flights = SingleFlight("test", distributed=False)
+
+    async def compute():
+        await asyncio.sleep(10)
+
+    async def main():
+        leader = asyncio.create_task(flights.ado("key", compute))
+        await asyncio.sleep(0.01)
+        follower = asyncio.create_task(flights.ado("key", compute))
+        impatient = asyncio.create_task(flights.ado("key", compute))
+        await asyncio.sleep(0.01)
+        # A follower giving up must not cancel the shared call
+        impatient.cancel()
+        await asyncio.sleep(0.01)
+        assert not leader.done()
+        leader.cancel()
+        return await asyncio.gather(leader, follower, impatient, return_exceptions=True)
+
+    leader, follower, impatient = asyncio.run(main())
+    assert isinstance(leader, asyncio.CancelledError)
+    assert isinstance(follower, RuntimeError)
+    assert isinstance(impatient, asyncio.CancelledError)
+
+def test_lock_released_after_leader(redis_clients):
+    flights = SingleFlight("test")
+    with flights.lead("key", lambda: None) as flight:
+        assert redis_clients.get(flights._lock_key("key"))
+        flight.value = "value"
+    assert redis_clients.get(flights._lock_key("key")) is None
+
+def test_lock_released_after_leader_error(redis_clients):
+    flights = SingleFlight("test")
+    with pytest.raises(ValueError):
+        with flights.lead("key", lambda: None):
+            raise ValueError("boom")
+    assert redis_clients.get(flights._lock_key("key")) is None
+
+def test_alead_lock_released(redis_clients):
+    flights = SingleFlight("test")
+
+    async def lookup():
+        return None
+
+    async def main():
+        async with flights.alead("key", lookup) as flight:
+            assert await singleflight.async_redis_client.get(flights._lock_key("key"))
+            flight.value = "value"
+
+    asyncio.run(main())
+    assert redis_clients.get(flights._lock_key("key")) is None
+
+def test_unlock_leaves_another_holders_lock(redis_clients):
+    flights = SingleFlight("test")
+    redis_clients.set(flights._lock_key("key"), "other-token", ex=30)
+    flights._unlock("key", "my-token")
+    assert redis_clients.get(flights._lock_key("key")) == "other-token"
+    flights._unlock("key", "other-token")
+    assert redis_clients.get(flights._lock_key("key")) is None
+
+def test_slow_leader_keeps_its_lock(redis_clients, monkeypatch):
+    monkeypatch.setattr(singleflight, "SINGLEFLIGHT_LOCK_TTL", 1)
+    flights = SingleFlight("test")
+    with flights.lead("key", lambda: None) as flight:
+        # Well past the TTL: renewed, so other workers still see the leader
+        time.sleep(1.6)
+        assert redis_clients.get(flights._lock_key("key"))
+        flight.value = "value"
+    assert redis_clients.get(flights._lock_key("key")) is None
+
+def test_slow_async_leader_keeps_its_lock(redis_clients, monkeypatch):
+    monkeypatch.setattr(singleflight, "SINGLEFLIGHT_LOCK_TTL", 1)
+    flights = SingleFlight("test")
+
+    async def lookup():
+        return None
+
+    async def main():
+        async with flights.alead("key", lookup) as flight:
+            await asyncio.sleep(1.6)
+            assert redis_clients.get(flights._lock_key("key"))
+            flight.value = "value"
+
+    asyncio.run(main())
+    assert redis_clients.get(flights._lock_key("key")) is None
+
+def test_follower_picks_up_other_workers_result(redis_clients, monkeypatch):
+    monkeypatch.setattr(singleflight, "SINGLEFLIGHT_POLL_MS", 5)
+    flights = SingleFlight("test")
+    cache = {}
+    # Another worker holds the lock and publishes its result shortly
+    redis_clients.set(flights._lock_key("key"), "other-worker", ex=30)
+    threading.Timer(0.05, cache.update, kwargs={"key": "remote value"}).start()
+
+    value, shared = flights.do("key", lambda: "computed here", lookup=lambda: cache.get("key"))
+    assert (value, shared) == ("remote value", True)
+
+def test_follower_computes_when_other_worker_releases_without_result(redis_clients, monkeypatch):
+    monkeypatch.setattr(singleflight, "SINGLEFLIGHT_POLL_MS", 5)
+    flights = SingleFlight("test")
+    redis_clients.set(flights._lock_key("key"), "other-worker", ex=30)
+    threading.Timer(0.05, redis_clients.delete, args=(flights._lock_key("key"),)).start()
+
+    assert flights.do("key", lambda: "computed here", lookup=lambda: None) == ("computed here", False)